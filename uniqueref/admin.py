@@ -9,13 +9,20 @@ from import_export import widgets
 from django.contrib.auth.models import Group, User
 from import_export.fields import Field
 import models as db
+import datastore
 
 
 class PhenosaurusAdmin(AdminSite):
     site_header = 'Command and Control Center Phenosaurus'
 
+# The datapoints of an import are saved one by one, the versions of their screens are bumped once in after_import
+class DatapointImportMixin(object):
+	def import_data(self, *args, **kwargs):
+		with datastore.importing():
+			return super(DatapointImportMixin, self).import_data(*args, **kwargs)
+
 # class IPSDatapointResource to define that data can imported into class IPSDatapoint using import_export
-class IPSDatapointResource(resources.ModelResource):
+class IPSDatapointResource(DatapointImportMixin, resources.ModelResource):
 
 	pass_relscreen = fields.Field(column_name='relscreenname', attribute='relscreen', widget=ForeignKeyWidget(db.Screen,'name'))
 	pass_relgene = fields.Field(column_name='relgenename', attribute='relgene', widget=ForeignKeyWidget(db.Gene,'name'))
@@ -41,6 +48,13 @@ class IPSDatapointResource(resources.ModelResource):
 			'mi',
 		)
 
+	def after_import(self, dataset, result, using_transactions, dry_run, **kwargs):
+		# Rebuild the columnar stores of all screens that were part of this import. Their snapshots are not rendered
+		# within the request, the plots are drawn live until the snapshot_public_screens command has been run.
+		if not dry_run:
+			screennames = set(dataset['relscreenname'])
+			datastore.screens_changed(db.Screen.objects.filter(name__in=screennames).values_list('id', flat=True), refresh_snapshots=False)
+
 class IPSDatapointAdmin(ImportExportModelAdmin):
 	def get_relgene(self, obj):
 		return obj.relgene.name
@@ -53,7 +67,7 @@ class IPSDatapointAdmin(ImportExportModelAdmin):
     	pass
 
 # class PSSDatapointResource to define that data can imported into class PSSDatapoint using import_export
-class PSSDatapointResource(resources.ModelResource):
+class PSSDatapointResource(DatapointImportMixin, resources.ModelResource):
 
 	pass_relscreen = fields.Field(column_name='relscreenname', attribute='relscreen', widget=ForeignKeyWidget(db.Screen,'name'))
 	pass_relgene = fields.Field(column_name='relgenename', attribute='relgene', widget=ForeignKeyWidget(db.Gene,'name'))
@@ -79,6 +93,11 @@ class PSSDatapointResource(resources.ModelResource):
 			  'seq',
 		  )
 
+	def after_import(self, dataset, result, using_transactions, dry_run, **kwargs):
+		if not dry_run:
+			screennames = set(dataset['relscreenname'])
+			datastore.pss_screens_changed(db.Screen.objects.filter(name__in=screennames).values_list('id', flat=True))
+
 class PSSDatapointAdmin(ImportExportModelAdmin):
 	def get_relgene(self, obj):
 		return obj.relgene.name
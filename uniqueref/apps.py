@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class UniquerefConfig(AppConfig):
     name = 'uniqueref'
     verbose_name = 'Database entries for non-overlapping gene annotation (uniqueref)'
+
+    def ready(self):
+        import signals    # Connects the signal handlers that invalidate stores and caches
@@ -0,0 +1,275 @@
+# Synthetic data and benchmarks for the hot paths of Phenosaurus
+#
+# generate_synthetic_data() fills the database with fake genes, screens and IPS/PSS datapoints at a configurable
+# scale (the same seed always yields the same data), run_benchmarks() times the functions of custom_functions and
+# the views that serve the plots. Both are wrapped by the generate_synthetic_data and run_benchmarks management
+# commands; never run them against the production database.
+
+# Import Django related libraries and functions
+from django.contrib.auth.models import Group, User, AnonymousUser
+from django.test import Client
+from django.db import transaction
+
+# Import other custom phenosaurus functions
+import custom_functions as cf
+import globalvars as gv
+import models as db
+import datastore
+import geneindex
+import intervals
+import genematrix
+import correlations
+import neighbours
+import snapshots
+import caches
+
+# Other general libraries
+from datetime import datetime
+import numpy as np
+import platform
+import json
+import time
+
+
+synthetic_prefix = 'SYNTH'
+chromosomes = [str(i) for i in range(1, 23)] + ['X', 'Y']
+
+
+##########################################################
+# 1. Synthetic data                                      #
+##########################################################
+
+def synthetic_ips_columns(rs, n_genes):
+    # Low and high channel counts for every gene, most genes are not significant and a few percent are strong hits
+    insertions = np.maximum(rs.lognormal(4, 1.2, n_genes).astype(np.int64), 2)
+    effect = rs.normal(0, 0.4, n_genes)
+    hits = rs.rand(n_genes) < 0.03
+    effect[hits] += rs.choice([-1, 1], hits.sum()) * rs.uniform(1, 4, hits.sum())
+    share_high = 1 / (1 + np.power(2, -effect))
+    high = rs.binomial(insertions, share_high)
+    low = insertions - high
+    mi = ((high + 1.0) / (high.sum() + 1.0)) / ((low + 1.0) / (low.sum() + 1.0))
+    pv = np.where(hits, rs.uniform(0, 1e-4, n_genes), rs.uniform(0, 1, n_genes))
+    fcpv = np.minimum(pv * n_genes / (np.argsort(np.argsort(pv)) + 1), 1)
+    return {
+        'low': low, 'lowtotal': np.repeat(low.sum(), n_genes), 'high': high, 'hightotal': np.repeat(high.sum(), n_genes),
+        'lowcor': low, 'lowtotalcor': np.repeat(low.sum(), n_genes), 'highcor': high,
+        'hightotalcor': np.repeat(high.sum(), n_genes), 'pv': pv, 'fcpv': fcpv, 'mi': mi, 'insertions': insertions,
+    }
+
+def synthetic_pss_columns(rs, n_genes):
+    nm = rs.poisson(rs.lognormal(1, 1, n_genes))
+    ct = rs.poisson(rs.lognormal(2, 1, n_genes))
+    pv = rs.uniform(0, 1, n_genes)
+    return {
+        'nm': nm, 'tnm': np.repeat(nm.sum(), n_genes) - nm, 'ct': ct, 'tct': np.repeat(ct.sum(), n_genes) - ct,
+        'cct': ct + 1, 'ctct': np.repeat(ct.sum(), n_genes) - ct + 1, 'pv': pv, 'fcpv': np.minimum(pv * 10, 1),
+        'ti': nm + ct + 1, 'mi': (nm + 1.0) / (ct + 1.0), 'radius': np.sqrt(nm + 1.0), 'seq': rs.permutation(n_genes),
+    }
+
+def bulk_insert(model, screenid, geneids, columns, chunk_size=5000):
+    names = sorted(columns)
+    for start in range(0, len(geneids), chunk_size):
+        objs = []
+        for i in range(start, min(start + chunk_size, len(geneids))):
+            values = dict((name, columns[name][i].item()) for name in names)
+            objs.append(model(relscreen_id=screenid, relgene_id=int(geneids[i]), **values))
+        model.objects.bulk_create(objs)
+
+def generate_synthetic_data(n_screens=200, n_genes=20000, n_pss_screens=0, n_tracks=10, track_size=500, seed=0, stdout=None):
+    # Creates n_genes genes and n_screens IP (plus n_pss_screens PS) screens visible to the public group, and n_tracks
+    # custom tracks of track_size random genes shared with the public group
+    rs = np.random.RandomState(seed)
+    with transaction.atomic():
+        group, created = Group.objects.get_or_create(id=gv.public_group_id, defaults={'name': gv.publicuser})
+        scientist, created = User.objects.get_or_create(username='synthetic')
+        genes = [db.Gene(name='%s%d' % (synthetic_prefix, i), description='Synthetic gene %d' % i,
+                         chromosome=chromosomes[i % len(chromosomes)], orientation='+-'[i % 2]) for i in range(n_genes)]
+        db.Gene.objects.bulk_create(genes, batch_size=5000)
+        geneids = np.array(db.Gene.objects.filter(name__startswith=synthetic_prefix).order_by('id').values_list('id', flat=True))
+        # One location per gene, genes of up to 100 kb scattered over the first 150 Mb of their chromosome
+        starts = rs.randint(0, 150000000, len(geneids))
+        db.Location.objects.bulk_create([db.Location(relgene_id=int(geneid), startpos=int(start), endpos=int(start + length))
+                                         for geneid, start, length in zip(geneids, starts, rs.randint(1000, 100000, len(geneids)))],
+                                        batch_size=5000)
+
+        screenids = []
+        for i in range(n_screens + n_pss_screens):
+            screentype = 'IP' if i < n_screens else 'PS'
+            screen = db.Screen.objects.create(name='%s_%s_%d' % (synthetic_prefix, screentype, i), scientist=scientist,
+                                              description='Synthetic %s screen %d' % (screentype, i), longdescription='',
+                                              sequenceids='', directory='', screentype=screentype)
+            db.ScreenPermissions.objects.create(relscreen=screen, relgroup=group)
+            if screentype == 'IP':
+                columns = synthetic_ips_columns(rs, len(geneids))
+                columns.update(datastore.derive_ips_columns(columns['insertions'], columns['mi']))
+                bulk_insert(db.IPSDatapoint, screen.id, geneids, columns)
+            else:
+                bulk_insert(db.PSSDatapoint, screen.id, geneids, synthetic_pss_columns(rs, len(geneids)))
+            screenids.append(screen.id)
+            if stdout is not None:
+                stdout.write('Created screen %d of %d' % (i + 1, n_screens + n_pss_screens))
+        geneindex.genes_changed()
+        intervals.locations_changed()
+        scientist.groups.add(group)
+        for i in range(n_tracks):
+            names = ['%s%d' % (synthetic_prefix, j) for j in rs.choice(n_genes, min(track_size, n_genes), replace=False)]
+            db.CustomTracks.objects.create(user=scientist, name='%s_track_%d' % (synthetic_prefix, i),
+                                           description='Synthetic track %d' % i, genelist=' '.join(names))
+        datastore.screens_changed(screenids[:n_screens])
+        datastore.pss_screens_changed(screenids[n_screens:])
+    return screenids
+
+def remove_synthetic_data():
+    db.CustomTracks.objects.filter(name__startswith=synthetic_prefix).delete()
+    db.Screen.objects.filter(name__startswith=synthetic_prefix).delete()
+    db.Gene.objects.filter(name__startswith=synthetic_prefix).delete()
+    geneindex.genes_changed()
+    intervals.locations_changed()
+
+
+##########################################################
+# 2. Benchmarks                                          #
+##########################################################
+
+def timeit(func, repeat, setup=None):
+    # Returns the timings of repeat calls of func (in seconds), setup is called before every call and not timed
+    timings = []
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.time()
+        func()
+        timings.append(time.time() - start)
+    return {'min': min(timings), 'median': float(np.median(timings)), 'max': max(timings), 'runs': timings}
+
+def get_view(client, url):
+    response = client.get(url)
+    if response.status_code != 200:
+        raise AssertionError('%s returned status %d' % (url, response.status_code))
+    return response
+
+def get_streaming_view(client, url):
+    # Streaming responses are only produced once their content is consumed
+    response = get_view(client, url)
+    return b''.join(response.streaming_content)
+
+def revalidate_view(client, url):
+    # A repeat visit of a page that has not changed since, answered from its ETag without rendering it
+    etag = get_view(client, url)['ETag']
+    def revalidate():
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        if response.status_code != 304:
+            raise AssertionError('%s returned status %d instead of 304' % (url, response.status_code))
+    return revalidate
+
+def update_screen(screenid):
+    # Marks a screen as re-imported and brings its row in the gene matrix up to date
+    datastore.bump_screen_version(screenid)
+    datastore.write_ips_store(screenid)
+    genematrix.update_gene_matrix([screenid])
+
+def run_benchmarks(repeat=5, n_plot_genes=10, stdout=None):
+    authorized_screens = list(cf.get_authorized_screens_from_gids([gv.public_group_id]))
+    ip_screens = cf.get_authorized_screens_from_gids([gv.public_group_id]).of_type('IP')
+    if not ip_screens:
+        raise ValueError('There are no public IP screens to benchmark, generate synthetic data first')
+    screenid = ip_screens[0]
+    gene_names = geneindex.get_gene_index().names[:n_plot_genes].tolist()
+    genes_string = ' '.join(gene_names)
+    client = Client()
+    screen_part_url = ''.join('screens=%d&' % i for i in ip_screens)
+    pss_screens = cf.get_authorized_screens_from_gids([gv.public_group_id]).of_type('PS')
+    trackids = [i for i, name in cf.authorized_tracks(AnonymousUser())][:10]
+
+    df, legend = cf.generate_df_pips(screenid, gv.pvdc, authorized_screens)
+    benchmarks = [
+        ('generate_df_pips', lambda: cf.generate_df_pips(screenid, gv.pvdc, authorized_screens), None),
+        ('generate_df_pips (cold store)', lambda: cf.generate_df_pips(screenid, gv.pvdc, authorized_screens),
+            lambda: datastore.drop_ips_store(screenid)),
+        ('df_multiple_geneplot', lambda: cf.df_multiple_geneplot(gene_names, ip_screens, gv.pvdc, authorized_screens), None),
+        ('df_geneplot_orm', lambda: cf.df_geneplot_orm(geneindex.get_gene_index(), gene_names, ip_screens, authorized_screens), None),
+        ('df_geneplot_matrix', lambda: cf.df_geneplot_matrix(geneindex.get_gene_index(), gene_names, ip_screens, authorized_screens), None),
+        ('create_genes_array', lambda: cf.create_genes_array(genes_string + ' NOTAGENE'), None),
+        ('generate_ips_tophits_list', lambda: cf.generate_ips_tophits_list(df), None),
+        ('list_genes', lambda: cf.list_genes(), caches.gene_page_cache.clear),
+        ('view IPSFishtail (cold)', lambda: get_view(client, '/uniqueref/simpleplot/?screen=%d&oca=gc&sag=on&showtable=on' % screenid),
+            caches.fishtail_cache.clear),
+        ('view IPSFishtail (warm)', lambda: get_view(client, '/uniqueref/simpleplot/?screen=%d&oca=gc&sag=on&showtable=on' % screenid), None),
+        ('generate_track_overlay', lambda: cf.generate_track_overlay(screenid, trackids, authorized_screens), None),
+        ('view IPSFishtail (tracks)', lambda: get_view(client, '/uniqueref/simpleplot/?screen=%d&oca=gc&sag=on&%s' % (
+            screenid, ''.join('tracks=%d&' % i for i in trackids))), caches.fishtail_cache.clear),
+        ('view IPSFishtail (304)', revalidate_view(client, '/uniqueref/simpleplot/?screen=%d&oca=gc&sag=on&showtable=on' % screenid), None),
+        ('update_snapshots (one screen)', lambda: snapshots.update_snapshots([screenid], full=True), None),
+        ('view IPSFishtail (snapshot)', lambda: get_view(client, '/uniqueref/simpleplot/?screen=%d&pvalue=%s&textsize=%s&oca=gc&sag=on&showtable=on' % (
+            screenid, gv.pvdc, gv.initial_text_size)), caches.fishtail_cache.clear),
+        ('view IPSFishtail (binarydata)', lambda: get_view(client, '/uniqueref/simpleplot/?screen=%d&oca=gc&sag=on&binarydata=on' % screenid),
+            caches.fishtail_cache.clear),
+        ('view IPSFishtailData', lambda: get_view(client, '/uniqueref/simpleplot/data/?screen=%d' % screenid),
+            caches.fishtail_data_cache.clear),
+        ('view IPSFishtailLOD (zoomed out)', lambda: get_view(client, '/uniqueref/simpleplot/lod/?screen=%d&significant=on' % screenid),
+            None),
+        ('view IPSFishtailLOD (zoomed in)', lambda: get_view(client, '/uniqueref/simpleplot/lod/?screen=%d&x0=1&x1=1.5&y0=-1&y1=1' % screenid),
+            None),
+    ]
+    if pss_screens:
+        benchmarks += [
+            ('generate_df_pss', lambda: cf.generate_df_pss(pss_screens[0], gv.pvdc, authorized_screens), None),
+            ('view PSSBubbleplot (cold)', lambda: get_view(client, '/uniqueref/bubbleplot/?screen=%d&oca=gc&sag=on' % pss_screens[0]),
+                caches.bubble_cache.clear),
+            ('view PSSBubbleplot (warm)', lambda: get_view(client, '/uniqueref/bubbleplot/?screen=%d&oca=gc&sag=on' % pss_screens[0]), None),
+        ]
+    benchmarks += [
+        ('view opengenefinder', lambda: get_view(client, '/uniqueref/opengenefinder/?%sgenes=%s&description=on' % (
+            screen_part_url, '+'.join(gene_names))), None),
+        ('view opengenefinder (304)', revalidate_view(client, '/uniqueref/opengenefinder/?%sgenes=%s&description=on' % (
+            screen_part_url, '+'.join(gene_names))), None),
+        ('view export_datapoints', lambda: get_streaming_view(client, '/uniqueref/export/?screens=%d&format=tsv' % screenid), None),
+        ('interval index query (10 Mb)', lambda: intervals.get_interval_index().query('1', 50000000, 60000000), None),
+        ('view region', lambda: get_view(client, '/uniqueref/region/?region=chr1:50,000,000-51,000,000&%s' % screen_part_url), None),
+        ('view region_json', lambda: get_view(client, '/uniqueref/region/json/?region=chr1:50,000,000-51,000,000'), None),
+        ('update_correlations (full)', lambda: correlations.update_correlations(full=True), None),
+        ('update_correlations (one screen)', lambda: correlations.update_correlations(), lambda: update_screen(screenid)),
+        ('view correlations', lambda: get_view(client, '/uniqueref/correlations/?screen=%d' % screenid), None),
+        ('build_neighbour_matrix', lambda: neighbours.build_neighbour_matrix(genematrix.get_gene_matrix()), None),
+        ('nearest neighbours of a gene', lambda: neighbours.get_neighbour_matrix().nearest(
+            geneindex.get_gene_index().name_to_id[gene_names[0]], authorized_screens), None),
+        ('view gene_neighbours_json', lambda: get_view(client, '/uniqueref/opengenefinder/neighbours/?gene=%s' % gene_names[0]), None),
+        ('view opengenefinder (neighbours)', lambda: get_view(client, '/uniqueref/opengenefinder/?%sgenes=%s&neighbours=on' % (
+            screen_part_url, gene_names[0])), None),
+        ('view listgenes', lambda: get_view(client, '/uniqueref/listgenes/'), None),
+        ('view listgenes_json', lambda: get_view(client, '/uniqueref/listgenes/json/?page=2&sort=chromosome'), None),
+    ]
+
+    results = {
+        'date': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'scale': {
+            'genes': len(geneindex.get_gene_index()),
+            'screens': len(authorized_screens),
+            'ip_screens': len(ip_screens),
+            'datapoints_per_screen': len(df.index),
+            'plot_genes': len(gene_names),
+        },
+        'repeat': repeat,
+        'benchmarks': {},
+    }
+    for name, func, setup in benchmarks:
+        results['benchmarks'][name] = timeit(func, repeat, setup)
+        if stdout is not None:
+            stdout.write('%-35s min %8.1f ms   median %8.1f ms' % (
+                name, 1000 * results['benchmarks'][name]['min'], 1000 * results['benchmarks'][name]['median']))
+    return results
+
+def save_results(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+def compare_results(baseline, current):
+    # Returns (name, baseline median, current median, ratio) for every benchmark present in both runs
+    rows = []
+    for name in sorted(set(baseline['benchmarks']) & set(current['benchmarks'])):
+        old = baseline['benchmarks'][name]['median']
+        new = current['benchmarks'][name]['median']
+        rows.append((name, old, new, new / old if old else float('nan')))
+    return rows
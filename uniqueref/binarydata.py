@@ -0,0 +1,64 @@
+# A compact binary format to send columns of plot data to the browser
+#
+# Embedding ~20k points as JSON in the script of a plot makes pages large and slow to parse. Instead, the numeric
+# columns are sent as raw little-endian typed arrays that the browser wraps in Float32Array & co. without parsing.
+#
+# Layout of a payload:
+#   uint32 (little-endian)   length N of the header
+#   N bytes                  JSON header: {"columns": [{"name", "dtype", "offset", "length"}, ...], ...extra keys}
+#   data                     the columns, each starting at an offset (from the start of the payload) divisible by 8
+# Columns of strings are sent as UTF-8 text joined by newlines and have dtype 'utf8'.
+
+# Other general libraries
+import numpy as np
+import struct
+import json
+
+
+# The dtypes the browser understands (see fishtail_binary.html), numpy dtype -> name of the typed array
+supported_dtypes = {
+    'float32': 'Float32Array',
+    'float64': 'Float64Array',
+    'int32': 'Int32Array',
+    'uint8': 'Uint8Array',
+}
+
+def _padding(size, alignment=8):
+    return (alignment - size % alignment) % alignment
+
+def pack_columns(columns, **extra):
+    # columns is a list of (name, array) pairs, extra keys are added to the header
+    blobs = []
+    meta = []
+    for name, values in columns:
+        values = np.asarray(values)
+        if values.dtype.kind in ('O', 'U', 'S'):
+            blob = u'\n'.join(values.astype(np.unicode_)).encode('utf-8')
+            dtype = 'utf8'
+        else:
+            dtype = values.dtype.name
+            if dtype not in supported_dtypes:
+                raise ValueError('Column %s has unsupported dtype %s' % (name, dtype))
+            blob = values.astype(values.dtype.newbyteorder('<')).tobytes()
+        meta.append({'name': name, 'dtype': dtype, 'length': len(values), 'bytes': len(blob)})
+        blobs.append(blob)
+
+    # The offsets depend on the length of the header, which in turn contains the offsets. Offsets are written with a
+    # fixed width so the length of the header does not change when they are filled in.
+    for m in meta:
+        m['offset'] = 0
+    extra['columns'] = meta
+    header_length = len(json.dumps(extra)) + 12 * len(meta)
+    header_length += _padding(4 + header_length)
+    offset = 4 + header_length
+    for m, blob in zip(meta, blobs):
+        m['offset'] = offset
+        offset += len(blob) + _padding(len(blob))
+    header = json.dumps(extra).encode('utf-8')
+    header += b' ' * (header_length - len(header))     # JSON allows trailing whitespace
+
+    parts = [struct.pack('<I', header_length), header]
+    for blob in blobs:
+        parts.append(blob)
+        parts.append(b'\0' * _padding(len(blob)))
+    return b''.join(parts)
@@ -1,6 +1,7 @@
 from bokeh.plotting import figure, output_file, show, vplot
 from bokeh.models.widgets import Select
 from bokeh.models import HoverTool, TapTool, OpenURL, Circle, Text, CustomJS, FixedTicker, ColumnDataSource
+from bokeh.layouts import row
 from bokeh.resources import CDN
 from bokeh.embed import components
 import pandas as pd
@@ -9,16 +10,19 @@ from django.contrib.auth.decorators import login_required
 import operator
 from math import pi
 from globalvars import *
+import timing
 import math
 
 
 # Size (ie. the surface of a circle pi*r*r) of bubble is reflect by number of insertions (nm)
 
 
+@timing.timed('bokeh')
 def pbubbleplot(title, df, scaling, oca, sag, textsize):
 	# In the positive selection bubbleplot the following is plotted along the axis
 	# x = seq
 	# y = logfcpv
+	# df is made by custom_functions.generate_df_pss, returns the script and div of the plot
 
 	TOOLS = "resize,hover,save,pan,wheel_zoom,box_zoom,reset,tap"
 
@@ -60,15 +64,16 @@ def pbubbleplot(title, df, scaling, oca, sag, textsize):
 	]
 
 	# Create a new dataframe and source that only holds the names and the positions of datapoints, used for labeling genes
- 	textsource = ColumnDataSource(data=dict(txval=[], tyval=[], relgene=[]))
-	# Build a ColumnDataSource from the Pandas dataframe required for Bokeh
-	source = ColumnDataSource(df)
+	textsource = ColumnDataSource(data=dict(txval=[], tyval=[], relgene=[]))
+	# Build a ColumnDataSource from the Pandas dataframe required for Bokeh, only with the columns the plot uses
+	source = ColumnDataSource(df[['xval', 'yval', 'dotsize', 'color', 'txval', 'tyval', 'relgene', 'fcpv', 'nm']])
 	# Define the layout of the circle (a Bokeh Glyph) if nothing has been selected, ie. the inital view
 	initial_view = Circle(x='xval', y='yval', fill_color='color', line_color='black', fill_alpha=0.9, line_alpha=0.9, size='dotsize') # This is the initial view, if there's no labeling if genes, this is the only plot
 	
-	# In case all significant hits needs to be labled
+	# In case all significant hits needs to be labled, only the significant genes are sent to the browser for this
 	if sag == "on":
-		p.text('txval', 'tyval', text='signame', text_color='black', text_font_size=textsize, source=source)
+		sagtextsource = ColumnDataSource(df[df['signame'] != ""][['txval', 'tyval', 'signame']])
+		p.text('txval', 'tyval', text='signame', text_color='black', text_font_size=textsize, source=sagtextsource)
 
 	if oca == "hah": # If the 'on click action' is highlight and label (hah)
 		# Define how the bokeh glyphs should look if selected
@@ -93,7 +98,7 @@ def pbubbleplot(title, df, scaling, oca, sag, textsize):
 			textsource.trigger('change');
 		""")
 
-	elif oca == "gc": # If linking out to genecards
+	else: # If linking out to genecards
 		selected_circle = initial_view
 		nonselected_circle = initial_view
 
@@ -102,11 +107,15 @@ def pbubbleplot(title, df, scaling, oca, sag, textsize):
 		taptool.callback = OpenURL(url=url)
 
 	# Plot the final graph
-	p.add_glyph(
+	renderer = p.add_glyph(
 		source,
 		initial_view,
 		selection_glyph=selected_circle,
 		nonselection_glyph=nonselected_circle
 	)
+	hover.renderers = [renderer]
 
-	return p
\ No newline at end of file
+	r = row(children=[p], responsive=True)
+	with timing.span('components'):
+		script, div = components(r, CDN)
+	return script, div
@@ -0,0 +1,119 @@
+# In-process caches of Phenosaurus
+#
+# Every worker keeps its own caches. Entries that depend on the datapoints of a screen carry the version of that
+# screen (see datastore.py) in their key, so re-importing a screen in any worker makes the old entries unreachable
+# in all workers; the stale entries are then dropped on the next miss or evicted as least recently used.
+
+# Import other custom phenosaurus functions
+import globalvars as gv
+
+# Other general libraries
+from collections import OrderedDict
+import threading
+
+
+def payload_size(value):
+    # The approximate size in bytes of a cached value: strings, numpy arrays and dicts, lists or tuples of them
+    if isinstance(value, dict):
+        return sum(payload_size(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(payload_size(v) for v in value)
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    if isinstance(value, basestring):
+        return len(value)
+    return 0
+
+
+class LRUCache(object):
+    """A thread-safe mapping that evicts the least recently used entries when it holds more than maxsize entries or,
+    if maxbytes is given, more than maxbytes bytes of payload. A value larger than maxbytes is not kept at all."""
+
+    def __init__(self, maxsize, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value     # Move to the most recently used end
+            return value
+
+    def _remove(self, key):
+        del self._data[key]
+        self.nbytes -= self._sizes.pop(key)
+
+    def set(self, key, value):
+        size = payload_size(value) if self.maxbytes is not None else 0
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            if self.maxbytes is not None and size > self.maxbytes:
+                return
+            self._data[key] = value
+            self._sizes[key] = size
+            self.nbytes += size
+            while len(self._data) > self.maxsize or (self.maxbytes is not None and self.nbytes > self.maxbytes):
+                self._remove(next(iter(self._data)))
+
+    def discard_if(self, predicate):
+        # Remove all entries for which predicate(key) is True
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.nbytes = 0
+
+
+# The rendered (script, div) pairs and tables of fishtail plots
+fishtail_cache = LRUCache(gv.fishtail_cache_size, gv.fishtail_cache_bytes)
+
+def fishtail_key(screenid, version, pvcutoff, sag, oca, textsize, showtable, datamode, authorized_screens, tracks=()):
+    # tracks is the (id, version of the tracks) of the custom tracks drawn on the plot
+    return (int(screenid), version, pvcutoff, sag, oca, textsize, showtable, datamode, frozenset(authorized_screens), tuple(tracks))
+
+# The packed columns of fishtail plots that are loaded separately by the browser (see binarydata.py)
+fishtail_data_cache = LRUCache(gv.fishtail_cache_size, gv.fishtail_data_cache_bytes)
+
+# The arrays of fishtail plots drawn with a level of detail, which are requested upon every zoom
+fishtail_arrays_cache = LRUCache(gv.fishtail_arrays_cache_size, gv.fishtail_arrays_cache_bytes)
+
+def fishtail_data_key(screenid, version, pvcutoff):
+    return (int(screenid), version, pvcutoff)
+
+def drop_stale_fishtails(screenid, version):
+    # Called upon a miss, removes the plots and data of older versions of the screen
+    fishtail_cache.discard_if(lambda key: key[0] == int(screenid) and key[1] != version)
+    fishtail_data_cache.discard_if(lambda key: key[0] == int(screenid) and key[1] != version)
+    fishtail_arrays_cache.discard_if(lambda key: key[0] == int(screenid) and key[1] != version)
+
+
+# The rendered (script, div) pairs of bubble plots of positive selection screens
+bubble_cache = LRUCache(gv.bubble_cache_size, gv.bubble_cache_bytes)
+
+def bubble_key(screenid, version, pvcutoff, scaling, oca, sag, textsize, authorized_screens):
+    return (int(screenid), version, pvcutoff, scaling, oca, sag, textsize, frozenset(authorized_screens))
+
+def drop_stale_bubbles(screenid, version):
+    bubble_cache.discard_if(lambda key: key[0] == int(screenid) and key[1] != version)
+
+
+# The sorted gene ids of custom tracks, keyed on the id of the track and the version of the tracks (see tracks.py)
+track_cache = LRUCache(gv.track_cache_size)
+
+# Pages of the gene catalogue, the version of the gene index is part of the key
+gene_page_cache = LRUCache(gv.gene_page_cache_size)
@@ -0,0 +1,99 @@
+# Conditional GET for the pages that show screen data
+#
+# A page only changes when the data it is drawn from changes, and every kind of data already has a version marker (see
+# datastore.py) that is bumped when it does. The ETag of a page is a hash of its path and parameters, the user, the
+# code and the version markers the page depends on; Last-Modified is the time of the most recent of those markers, as
+# they hold the time at which they were bumped. Both are worked out from a few small files, so a repeat visit or a proxy
+# revalidating its copy gets a 304 before the view runs a single query or draws a plot.
+
+# Import Django related libraries and functions
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+# Import other custom phenosaurus functions
+import datastore
+import geneindex
+import genematrix
+import neighbours
+import permissions
+import tracks
+
+# Other general libraries
+from datetime import datetime
+from functools import wraps
+import hashlib
+import os
+
+
+def _code_version():
+    # The time of the last change to the code or the templates, so a deployment never answers with a page of before it
+    root = os.path.dirname(os.path.abspath(__file__))
+    latest = 0
+    for path, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            if filename.endswith(('.py', '.html')):
+                latest = max(latest, os.path.getmtime(os.path.join(path, filename)))
+    return latest
+
+code_version = _code_version()
+
+
+##########################################################
+# 1. The version markers of the pages                    #
+##########################################################
+
+# Every page depends on the screens a user may see (and their names) and on the genes
+common_keys = (permissions.permissions_version_key, geneindex.gene_version_key)
+
+def fishtail_keys(request):
+    # One screen, the custom tracks that can be drawn on it, and the update history
+    keys = [datastore.dataset_version_key, tracks.tracks_version_key]
+    screenid = request.GET.get('screen', '')
+    if screenid.isdigit():
+        keys.append(datastore.screen_version_key(screenid))
+    return keys
+
+def genefinder_keys(request):
+    # Any number of screens, read from the gene matrix if it has been built, and the genes with a similar profile
+    return [datastore.dataset_version_key, genematrix.matrix_version_key, neighbours.neighbours_version_key]
+
+def listgenes_keys(request):
+    return []
+
+
+##########################################################
+# 2. ETag and Last-Modified                              #
+##########################################################
+
+def page_versions(request, keys):
+    return [datastore.get_version(key) for key in common_keys + tuple(keys(request))]
+
+def page_etag(request, keys):
+    user = request.user.pk if request.user.is_authenticated else None
+    state = (request.path, sorted(request.GET.lists()), user, datetime.now().year, code_version, page_versions(request, keys))
+    return hashlib.sha1(repr(state)).hexdigest()
+
+def page_last_modified(request, keys):
+    # None for users that are logged in, the page of one user must never be taken for that of another
+    if request.user.is_authenticated:
+        return None
+    latest = max([code_version] + [float(version) for version in page_versions(request, keys)])
+    return datetime.utcfromtimestamp(latest) if latest > 0 else None
+
+def conditional_page(keys):
+    # Decorator for a view of which the response only depends on its parameters, the user and the version markers
+    # returned by keys(request). Browsers and proxies are told to revalidate the page on every visit.
+    def decorator(view):
+        conditional_view = condition(etag_func=lambda request, *args, **kwargs: page_etag(request, keys),
+                                     last_modified_func=lambda request, *args, **kwargs: page_last_modified(request, keys))(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if request.user.is_authenticated:
+                patch_cache_control(response, max_age=0, must_revalidate=True, private=True)
+            else:
+                patch_cache_control(response, max_age=0, must_revalidate=True)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,171 @@
+# Pairwise correlations of the logmi of all intracellular phenotype screens
+#
+# The Pearson correlation of two screens is computed over the genes measured in both. It is read from the gene matrix
+# (see genematrix.py) with matrix products: for a block of screens against all screens the number of shared genes and
+# the sums of x, y, x*x, y*y and x*y over the shared genes are accumulated gene block by gene block, which keeps memory
+# bounded no matter how many screens and genes there are. The full matrix and the number of shared genes of every
+# pair are stored in datastore/correlations.npz together with the version of every screen they were computed from.
+# When screens are added or re-imported only their rows and columns are recomputed, removed screens are dropped.
+
+# Import other custom phenosaurus functions
+import globalvars as gv
+import datastore
+import genematrix
+
+# Other general libraries
+import numpy as np
+import threading
+import os
+
+
+correlations_version_key = 'correlations'
+
+_correlations = None
+_lock = threading.Lock()
+_write_lock = threading.Lock()
+
+
+def correlations_path():
+    return os.path.join(gv.datastore_dir, 'correlations.npz')
+
+
+class Correlations(object):
+    """The stored correlation matrix with a map from screen ids to positions."""
+
+    def __init__(self, store, version):
+        self.version = version
+        self.genes_version = str(store['genes_version'])
+        self.screen_ids = [int(i) for i in store['screen_ids']]
+        self.screen_versions = dict(zip(self.screen_ids, [str(v) for v in store['screen_versions']]))
+        self.screen_pos = dict((screenid, pos) for pos, screenid in enumerate(self.screen_ids))
+        self.corr = store['corr']
+        self.shared = store['shared']
+
+    def submatrix(self, screenids):
+        # The correlations and number of shared genes of the screens of screenids that are in the matrix, and their ids
+        screenids = [int(i) for i in screenids if int(i) in self.screen_pos]
+        pos = np.array([self.screen_pos[i] for i in screenids], dtype=np.int64)
+        return self.corr[np.ix_(pos, pos)], self.shared[np.ix_(pos, pos)], screenids
+
+    def most_similar(self, screenid, screenids, n=gv.correlation_top_n):
+        # The n screens of screenids (other than screenid) with the highest correlation to screenid, as (id, r, shared)
+        if int(screenid) not in self.screen_pos:
+            return []
+        row = self.screen_pos[int(screenid)]
+        others = [int(i) for i in screenids if int(i) in self.screen_pos and int(i) != int(screenid)]
+        pos = np.array([self.screen_pos[i] for i in others], dtype=np.int64)
+        r = self.corr[row, pos] if len(pos) else np.array([])
+        order = np.argsort(-np.nan_to_num(r), kind='mergesort')[:n]
+        return [(others[i], float(r[i]), int(self.shared[row, pos[i]])) for i in order if not np.isnan(r[i])]
+
+
+def read_correlations():
+    try:
+        store = np.load(correlations_path())
+    except (IOError, OSError, ValueError):
+        return None
+    try:
+        return dict((name, store[name]) for name in store.files)
+    finally:
+        store.close()
+
+def get_correlations():
+    # Returns the correlations of this worker, reloading them if they have been updated, or None if never computed
+    global _correlations
+    version = datastore.get_version(correlations_version_key)
+    correlations = _correlations
+    if correlations is None or correlations.version != version:
+        with _lock:
+            if _correlations is None or _correlations.version != version:
+                store = read_correlations()
+                _correlations = Correlations(store, version) if store is not None else None
+            correlations = _correlations
+    return correlations
+
+
+##########################################################
+# Computation                                            #
+##########################################################
+
+def correlation_block(logmi, row_pos, col_pos, gene_block=gv.correlation_gene_block):
+    # The correlations (float32) and numbers of shared genes (int32) of the rows row_pos against the rows col_pos of the
+    # (screens x genes) array logmi, in which genes that were not measured are NaN
+    sums = dict((name, np.zeros((len(row_pos), len(col_pos)))) for name in ('n', 'x', 'y', 'xx', 'yy', 'xy'))
+    for start in range(0, logmi.shape[1], gene_block):
+        a = np.asarray(logmi[row_pos, start:start + gene_block], dtype=np.float64)
+        b = np.asarray(logmi[col_pos, start:start + gene_block], dtype=np.float64)
+        ma, mb = ~np.isnan(a), ~np.isnan(b)
+        a, b = np.where(ma, a, 0), np.where(mb, b, 0)
+        ma, mb = ma.astype(np.float64), mb.astype(np.float64)
+        sums['n'] += ma.dot(mb.T)
+        sums['x'] += a.dot(mb.T)
+        sums['y'] += ma.dot(b.T)
+        sums['xx'] += (a * a).dot(mb.T)
+        sums['yy'] += ma.dot((b * b).T)
+        sums['xy'] += a.dot(b.T)
+    n = sums['n']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = n * sums['xy'] - sums['x'] * sums['y']
+        var = (n * sums['xx'] - sums['x'] ** 2) * (n * sums['yy'] - sums['y'] ** 2)
+        corr = cov / np.sqrt(var)
+    corr[n < gv.correlation_min_shared] = np.nan
+    return np.clip(corr, -1, 1).astype(np.float32), n.astype(np.int32)
+
+def correlations_exist():
+    return os.path.exists(correlations_path())
+
+def write_correlations(genes_version, screen_ids, screen_versions, corr, shared):
+    datastore._save_store(correlations_path(), genes_version, {
+        'genes_version': np.array(genes_version),
+        'screen_ids': np.array(screen_ids, dtype=np.int64),
+        'screen_versions': np.array(screen_versions),
+        'corr': corr,
+        'shared': shared,
+    })
+    datastore.bump_version(correlations_version_key)
+
+def update_correlations(full=False, stdout=None):
+    # Recomputes the rows and columns of the screens that are new or have changed since the correlations were stored
+    # (all of them if full is True or the genes have changed), from the gene matrix. Returns the number of screens
+    # recomputed, or None if the gene matrix is missing or stale.
+    matrix = genematrix.get_gene_matrix()
+    if matrix is None:
+        return None
+    screen_ids = [i for i in matrix.screen_ids if i in matrix.screen_names]
+    if not matrix.is_fresh(screen_ids):
+        return None
+    with _write_lock:
+        stored = get_correlations()
+        if full or stored is None or stored.genes_version != matrix.genes_version:
+            stored = None
+        changed = [i for i in screen_ids if stored is None or i not in stored.screen_pos
+                   or stored.screen_versions[i] != matrix.screen_versions.get(i)]
+        if stored is not None and not changed and stored.screen_ids == screen_ids:
+            return 0
+
+        # Keep the pairs of unchanged screens, NaN for the rest until computed below
+        n = len(screen_ids)
+        corr = np.full((n, n), np.nan, dtype=np.float32)
+        shared = np.zeros((n, n), dtype=np.int32)
+        kept = [i for i, screenid in enumerate(screen_ids) if stored is not None and screenid in stored.screen_pos and screenid not in changed]
+        if kept:
+            old = np.array([stored.screen_pos[screen_ids[i]] for i in kept], dtype=np.int64)
+            corr[np.ix_(kept, kept)] = stored.corr[np.ix_(old, old)]
+            shared[np.ix_(kept, kept)] = stored.shared[np.ix_(old, old)]
+
+        logmi = matrix.arrays['logmi']
+        all_pos = np.array([matrix.screen_pos[i] for i in screen_ids], dtype=np.int64)
+        new_pos = dict((screenid, i) for i, screenid in enumerate(screen_ids))
+        changed_rows = [new_pos[i] for i in changed]
+        for start in range(0, len(changed_rows), gv.correlation_row_block):
+            rows = changed_rows[start:start + gv.correlation_row_block]
+            block_corr, block_shared = correlation_block(logmi, all_pos[rows], all_pos)
+            corr[rows, :] = block_corr
+            corr[:, rows] = block_corr.T
+            shared[rows, :] = block_shared
+            shared[:, rows] = block_shared.T
+            if stdout is not None:
+                stdout.write('%d of %d screens' % (min(start + gv.correlation_row_block, len(changed_rows)), len(changed_rows)))
+
+        write_correlations(matrix.genes_version, screen_ids, [matrix.screen_versions[i] for i in screen_ids], corr, shared)
+    return len(changed)
@@ -11,6 +11,16 @@ from django.db.models import Q, Avg, Max, Min
 import plots
 import globalvars as gv
 import models as db
+import datastore
+import timing
+import caches
+import permissions
+import tracks
+from geneindex import get_gene_index
+from genematrix import get_gene_matrix
+from intervals import get_interval_index
+from correlations import get_correlations
+from neighbours import get_neighbour_matrix
 
 # Other general libraries
 from collections import Counter
@@ -37,7 +47,8 @@ import math
 # renders the code future proof when at some point authetication is required
 
 def get_authorized_screens_from_gids(gids):
-    authorized_screens =  db.Screen.objects.filter(groups__in=gids).distinct().values_list('id',flat=True)
+    # Served from the permission cache of the worker, see permissions.py
+    authorized_screens = permissions.get_authorized(gids)
     return authorized_screens
 
 def authorized_qs_screen(authorized_screens):
@@ -48,10 +59,17 @@ def authorized_qs_IPSDatapoint(authorized_screens):
     qs_IPSDatapoint = db.IPSDatapoint.objects.filter(relscreen_id__in=authorized_screens)
     return qs_IPSDatapoint
 
-# Query the genes and create dataframe, always needed, no authorization required
-def get_qs_gene():
-    qs_gene = db.Gene.objects.all()
-    return qs_gene
+# The datapoints of a set of genes in a set of screens, as used for the geneplots
+def authorized_qs_geneplot(authorized_screens, geneids, screenids):
+    qs_geneplot = authorized_qs_IPSDatapoint(authorized_screens).filter(relgene_id__in=geneids, relscreen_id__in=screenids)
+    return qs_geneplot.values_list('relgene_id', 'relscreen__name', 'mi', 'fcpv', 'logmi', 'signclass')
+
+# The custom tracks a user may draw: their own and those of the users in the public group, as (id, name) pairs
+def authorized_tracks(user):
+    qs_tracks = db.CustomTracks.objects.filter(user__groups__id=gv.public_group_id)
+    if user.is_authenticated:
+        qs_tracks = qs_tracks | db.CustomTracks.objects.filter(user=user)
+    return list(qs_tracks.distinct().order_by('name').values_list('id', 'name'))
 
 def get_qs_updates():
     qs_updates = db.UpdateHistory.objects.all()
@@ -67,7 +85,7 @@ def get_qs_updates():
 ##########################################################
 
 def create_df_gene():
-    df_gene=get_qs_gene().to_dataframe() #Create a dataframe from all genes
+    df_gene=get_gene_index().frame() # Create a dataframe from all genes, served from the in-memory gene index of this worker
     return df_gene
 
 # Find max mi value of current dataframe
@@ -106,6 +124,14 @@ def set_textsize(giventextsize):
         textsize = gv.standard_text_size       # (ie. someone has changed the textsize in URL to something like 'HOI'
     return textsize                         # rather than <int>px)
 
+# The on-click action and whether all significant genes are labelled, anything else than the options of the forms is
+# treated as no action (or the default) and no labels, so arbitrary values in the URL never make another cache entry
+def set_oca(givenoca, options=('gc', 'hah', 'gp'), default=''):
+    return givenoca if givenoca in options else default
+
+def set_switch(givenswitch):
+    return 'on' if givenswitch == 'on' else ''
+
 # A fuctions to set the p-value cutoff
 def set_pvalue(givenpvalue):
     try:
@@ -114,6 +140,26 @@ def set_pvalue(givenpvalue):
         pvcutoff = gv.pvdc                     # (ie. someone has changed the pvalue in URL to something like 'HOI'
     return pvcutoff                         # rather than number)
 
+# Same for the minimal logmi difference of the unique hit finder
+def set_logmi_difference(givendifference):
+    try:
+        difference = abs(float(givendifference))
+    except:
+        difference = gv.minimal_logmi_difference
+    return difference
+
+# A function to validate positive integers such as page numbers, values above maximum are capped
+def set_positive_int(givenint, default, maximum=None):
+    try:
+        value = int(givenint)
+    except:                                 # Return default value if input could not be converted into an int
+        value = default
+    if value < 1:
+        value = default
+    if maximum is not None:
+        value = min(value, maximum)
+    return value
+
 def set_screenids(screenids):
     try:                                    # Test the list if given screen-id's can be converted into a list of ints
         screenids_int = map(int, screenids) # if that's not the case the user may have manually changed the URL to
@@ -123,27 +169,31 @@ def set_screenids(screenids):
 
 # Function to generate the title for a plot displaying a single screen
 def title_single_screen_plot(screenid, authorized_screens):
-    df_screenname = authorized_qs_screen(authorized_screens).filter(id=screenid).to_dataframe()
-    title = df_screenname.get_value(0, 'description') # Extract the description of the screen
+    if int(screenid) not in authorized_screens:
+        return ''
+    title = permissions.get_screen_permissions().screens[int(screenid)].description # Extract the description of the screen
     return title
 
 # This function takes the list of genes that a user provides and checks it against the genes in the database.
 # Doing so allows to reporting an error if a gene wasn't found and (in case custom tracks are implemented in the
 # public function guarentees tracks without errors.
+@timing.timed('genes')
 def create_genes_array(input_string, upload=False):
     # First receive the list of genes given by the user as a string and split that string into an array, values are space separated
     input_list = input_string.split()
-    qs_gene = get_qs_gene()
+    gene_index = get_gene_index()
     # Before parsing back the list as array it is really essential to check if the genes actually exist in the database, otherwise we may run into NaN errors
-    # Therefore, use the list to query the gene-table return whatever matched the gene-names in the table
-    # We may want to raise an error....?
-    validated_list = qs_gene.filter(name__in=input_list).to_dataframe()['name'].tolist()
+    # Therefore, check the list against the gene index and keep whatever matched the gene-names in the table (once, in the order given)
+    validated_list = []
+    for x in input_list:
+        if x in gene_index and x not in validated_list:
+            validated_list.append(x)
     validated_array = np.asarray(validated_list)
-    if (len(input_list) != len(validated_list)):
-        non_match_list = list(set(input_list) - set(validated_list)) # Find the items that do not match the databse
+    non_match_list = [x for x in set(input_list) if x not in gene_index] # Find the items that do not match the databse
+    if non_match_list:
         url_list = []
         for x in non_match_list:
-            url_list.append(''.join(('<a href=\"', gv.ucsc_link, x.split("@")[0], '\"', '>', x, '</a>'))) # The quotation marks before join are the separator, ie. theres is no separator
+            url_list.append(''.join(('<a href=\"', gv.ucsc_link, gene_index.symbol(x), '\"', '>', x, '</a>'))) # The quotation marks before join are the separator, ie. theres is no separator
         url_list_join = ','.join(url_list) # The genes themself we want to separate by a comma
         suggested_genes = find_somewhat_matching_gene_names(non_match_list)
         error = "%s %s %s<br>%s %s<p>" %(gv.gene_not_found_error, url_list_join, gv.genome_browser_link_text, gv.suggested_genes_text, suggested_genes)
@@ -154,21 +204,20 @@ def create_genes_array(input_string, upload=False):
 # If the user has provided a genename that was not found in the database (using create_genes_array) return a link to
 # the USCS genome browser so the user may find the refseq name or identify why it is not in the database
 def find_somewhat_matching_gene_names(non_match_list):
-    qs_gene = get_qs_gene()
     contains_list = []
-    for x in non_match_list:
-        contains_list = np.concatenate((contains_list, qs_gene.filter(name__icontains=x).to_dataframe()['name'].tolist()), axis=0)
+    for suggestions in get_gene_index().suggest(non_match_list):
+        contains_list.extend(x for x in suggestions if x not in contains_list)
     suggestedlist = ', '.join(contains_list)
     return suggestedlist
 
 def convert_geneids_to_genenames(geneids_array):
-    qs_gene = get_qs_genes()
-    genes_array = qs_gene.filter(id__in=geneids_array).to_dataframe()['name'].tolist()
+    genes_array = get_gene_index().get_names(geneids_array)
     return genes_array
 
 
 def create_gene_plot_url(relgenestring, authorized_screens):
-    screenids = authorized_qs_screen(authorized_screens).filter(screentype='IP').to_dataframe()['id'].values.tolist()
+    screens = permissions.get_screen_permissions().screens
+    screenids = [i for i in sorted(authorized_screens) if i in screens and screens[i].screentype == 'IP']
     screen_part_url = ''
     for i in screenids:
         curr_scr = 'screens='+str(i)+'&'
@@ -186,32 +235,135 @@ def create_gene_plot_url(relgenestring, authorized_screens):
 # 3.1 This function generates the DataFrame for a Plotting a Intracellular Phenotype Screen (pips)
 def generate_df_pips(screenid, pvcutoff, authorized_screens):
 
-    # Query the datapoints from the database and get all datapoints that match screenid from the QuerySet and create a Dataframe
-    qs_datapoint=authorized_qs_IPSDatapoint(authorized_screens).filter(relscreen_id=screenid).only('relgene', 'fcpv', 'mi', 'insertions', 'low', 'high')
-    df_datapoint=qs_datapoint.to_dataframe() #
-    df_gene = create_df_gene()
-
-    # Create a new column in the dataframe datapoint that functions as the colorlabel, depending on the cutoff p-value 
-    df_datapoint['color'] = np.where(df_datapoint['fcpv']<=pvcutoff, np.where(df_datapoint['mi']<1, gv.color_sb, gv.color_st), gv.color_ns)
-    df_datapoint['linecolor'] = df_datapoint['color']
-
-    # Convert raw data into 10log values
-    df_datapoint['loginsertions'] = np.log10(df_datapoint['insertions'])
-    df_datapoint['logmi'] = np.log2(df_datapoint['mi'])
-    # Create an extra column in the dataframe that 
-    df_datapoint['signame'] = np.where(df_datapoint['fcpv']<=pvcutoff, df_datapoint['relgene'], "")
-    # Merge the dataframe holding all genes and datapoints, as the gene-descriptions in the genes tables is not yet filled, this has no function yet.... except for slowing down everything
-    df = pd.merge(df_gene, df_datapoint, left_on='name', right_on='relgene')
+    # Read the datapoints from the columnar store of the screen, the store falls back to the ORM if it is missing or stale
+    with timing.span('store'):
+        if int(screenid) in authorized_screens:
+            df_datapoint = pd.DataFrame(datastore.load_ips_columns(screenid), columns=datastore.ips_columns)
+        else:
+            df_datapoint = pd.DataFrame(columns=datastore.ips_columns)
+    with timing.span('pandas'):
+        df_gene = create_df_gene()
+        # Merge the dataframe holding all genes and datapoints, the store holds gene ids so the names of the genes come from the gene table
+        df_datapoint = pd.merge(df_gene, df_datapoint, left_on='id', right_on='relgene_id')
+        df_datapoint['relgene'] = df_datapoint['name']
+
+        # Create a new column in the dataframe datapoint that functions as the colorlabel, depending on the cutoff p-value.
+        # loginsertions, logmi and signclass (the color of a significant hit) are computed when a screen is imported
+        significant = df_datapoint['fcpv']<=pvcutoff
+        df_datapoint['color'] = np.where(significant, np.take(gv.fishtail_palette, df_datapoint['signclass'].values.astype(int)), gv.color_ns)
+        df_datapoint['linecolor'] = df_datapoint['color']
+
+        # Create an extra column in the dataframe that 
+        df_datapoint['signame'] = np.where(df_datapoint['fcpv']<=pvcutoff, df_datapoint['relgene'], "")
+    df = df_datapoint
     legend = pd.DataFrame()
     return df, legend
 
+# 3.2 The columns of a fishtail plot as arrays, for sending them to the browser in binary form (see binarydata.py).
+# The colors are given as codes that index gv.fishtail_palette.
+def generate_fishtail_arrays(screenid, pvcutoff, authorized_screens):
+    with timing.span('store'):
+        if int(screenid) in authorized_screens:
+            columns = datastore.load_ips_columns(screenid)
+        else:
+            columns = dict((name, np.array([], dtype=dtype)) for name, dtype in zip(datastore.ips_columns, datastore.ips_dtypes))
+    with timing.span('pandas'):
+        gene_index = get_gene_index()
+        known = np.in1d(columns['relgene_id'], gene_index.ids)  # Like the merge in generate_df_pips, skip unknown genes
+        fcpv = columns['fcpv'][known]
+        arrays = [
+            ('loginsertions', columns['loginsertions'][known].astype(np.float32)),
+            ('logmi', columns['logmi'][known].astype(np.float32)),
+            ('fcpv', fcpv),
+            ('colorcode', np.where(fcpv<=pvcutoff, columns['signclass'][known], 0).astype(np.uint8)),
+            ('relgene', pd.Series(columns['relgene_id'][known]).map(gene_index.id_to_name).values),
+        ]
+    return arrays
+
+def valid_window(window):
+    # A window (x0, x1, y0, y1) of finite numbers with x0 < x1 and y0 < y1
+    x0, x1, y0, y1 = window
+    return bool(np.all(np.isfinite(window)) and x0 < x1 and y0 < y1)
+
+# 3.2.1 The level of detail of a fishtail plot within the visible window (x: loginsertions, y: logmi). Significant genes
+# are only returned when asked for, as the browser keeps them. Non-significant genes in the window are returned as points
+# if there are at most gv.lod_max_points of them, otherwise as the cells of a 2D histogram with an opacity that scales
+# with the log of the number of genes in the cell.
+def fishtail_level_of_detail(screenid, pvcutoff, authorized_screens, window=None, significant=False):
+    # Every zoom or pan of the user is a request, keep the arrays of the screen in memory
+    key = caches.fishtail_data_key(screenid, datastore.get_screen_version(screenid), pvcutoff)
+    columns = caches.fishtail_arrays_cache.get(key)
+    if columns is None or int(screenid) not in authorized_screens:
+        columns = dict(generate_fishtail_arrays(screenid, pvcutoff, authorized_screens))
+        if int(screenid) in authorized_screens:
+            caches.fishtail_arrays_cache.set(key, columns)
+    with timing.span('pandas'):
+        x, y = columns['loginsertions'], columns['logmi']
+        sig = columns['colorcode'] > 0
+        if window is None:
+            finite = np.isfinite(x) & np.isfinite(y)
+            window = (0, x[finite].max() * 1.05, y[finite].min(), y[finite].max()) if finite.any() else (0, 1, -1, 1)
+            if not valid_window(window):
+                window = (0, 1, -1, 1)
+        x0, x1, y0, y1 = window
+        inside = ~sig & (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+
+        def points(mask):
+            # The coordinates are rounded for size, the p-values are shown in the hover tooltip and kept as they are
+            return dict((name, np.round(values[mask], 4).tolist() if name in ('loginsertions', 'logmi') else values[mask].tolist())
+                        for name, values in columns.items())
+
+        lod = {'significant': points(sig) if significant else None, 'aggregated': bool(inside.sum() > gv.lod_max_points)}
+        if lod['aggregated']:
+            counts, xedges, yedges = np.histogram2d(x[inside], y[inside], bins=gv.lod_bins, range=[[x0, x1], [y0, y1]])
+            ix, iy = np.nonzero(counts)
+            n = counts[ix, iy]
+            lod['points'] = points(np.zeros(len(x), dtype=bool))
+            lod['bins'] = {
+                'x': np.round((xedges[ix] + xedges[ix + 1]) / 2, 4).tolist(),
+                'y': np.round((yedges[iy] + yedges[iy + 1]) / 2, 4).tolist(),
+                'width': float(xedges[1] - xedges[0]),
+                'height': float(yedges[1] - yedges[0]),
+                'alpha': np.round(0.15 + 0.85 * np.log1p(n) / np.log1p(n.max()), 3).tolist(),
+                'count': n.astype(int).tolist(),
+            }
+        else:
+            lod['points'] = points(inside)
+            lod['bins'] = None
+    return lod
+
+# 3.2.2 The genes of the screen that are in the custom tracks, a row per gene per track. The rings around the genes grow
+# with the position of the track, so a gene that is in several tracks gets concentric rings.
+def generate_track_overlay(screenid, trackids, authorized_screens):
+    overlay_columns = ['loginsertions', 'logmi', 'relgene', 'fcpv', 'track', 'trackcolor', 'ringsize']
+    if int(screenid) not in authorized_screens or not trackids:
+        return pd.DataFrame(columns=overlay_columns)
+    with timing.span('store'):
+        columns = datastore.load_ips_columns(screenid)
+    with timing.span('pandas'):
+        custom_tracks = tracks.get_tracks(trackids)
+        membership = tracks.track_membership(columns['relgene_id'], custom_tracks)
+        track_pos, gene_pos = np.nonzero(membership)
+        gene_index = get_gene_index()
+        df = pd.DataFrame({
+            'loginsertions': columns['loginsertions'][gene_pos],
+            'logmi': columns['logmi'][gene_pos],
+            'relgene': pd.Series(columns['relgene_id'][gene_pos]).map(gene_index.id_to_name).values,
+            'fcpv': columns['fcpv'][gene_pos],
+            'track': np.array([track.name for track in custom_tracks], dtype=object)[track_pos],
+            'trackcolor': np.array([track.color for track in custom_tracks], dtype=object)[track_pos],
+            'ringsize': gv.track_ring_size + gv.track_ring_step * track_pos,
+        }, columns=overlay_columns)
+    return df[df['relgene'].notnull()]
+
 # 3.3: A tiny wee little function to generate a table from all significant hits in the dataframe
 # As this file is actually all about data manipulation and the generate_ps_tophits is more about displaying data, is should be moved at some point to another file dedicated to displaying data
+@timing.timed('tables')
 def generate_ips_tophits_list(df):
     df_top = df[(df['signame'] != "")][['relgene', 'low', 'high', 'fcpv', 'logmi']]
     df_top.rename(columns={'logmi': 'log2(MI)'}, inplace=True)
     # Change the relgene column to a url (and remove the part after the @ in case of extended genenames)
-    df_top['relgene'] = '<a href=\"' + gv.ucsc_link + df_top['relgene'].str.split("@", 1).str[0] + '\"' + 'target=\"_blank\"' + '>' + df_top['relgene'] + '</a>'
+    df_top['relgene'] = '<a href=\"' + gv.ucsc_link + df_top['relgene'].map(get_gene_index().name_to_symbol) + '\"' + 'target=\"_blank\"' + '>' + df_top['relgene'] + '</a>'
     if (not df_top.empty):  # We need this because if someone plots a track of which none of the genes is present in the screen it will crash
         with pd.option_context('display.max_colwidth', -1):
             negreg = df_top[df_top['log2(MI)']>=0].sort_values(by='log2(MI)', ascending=False).to_html(index=False, justify='left', escape=False)
@@ -225,40 +377,100 @@ def generate_ips_tophits_list(df):
 # 4. Functions specific for GenePlots                       #
 #############################################################
 
+# The datapoints of genes in screens read from the gene matrix, or None if the matrix is missing or stale
+def df_geneplot_matrix(gene_index, genes, screenids_array, authorized_screens):
+    matrix = get_gene_matrix()
+    if matrix is None:
+        return None
+    with timing.span('matrix'):
+        geneids = gene_index.get_ids(genes)
+        values = matrix.lookup(geneids, [i for i in screenids_array if int(i) in authorized_screens])
+        if values is None:
+            return None
+        gene_pos, screen_pos = np.nonzero(~np.isnan(values['logmi']))  # Gene by gene, in the order of the genes
+        logmi = values['logmi'][gene_pos, screen_pos].astype(np.float64)
+        return pd.DataFrame({
+            'relgene': [gene_index.id_to_name[geneids[i]] for i in gene_pos],
+            'relscreen': [matrix.screen_names[values['screen_ids'][i]] for i in screen_pos],
+            'logmi': logmi,
+            'fcpv': values['fcpv'][gene_pos, screen_pos].astype(np.float64),
+            'signclass': np.where(logmi < 0, 1, 2),
+        }, columns=['relgene', 'relscreen', 'logmi', 'fcpv', 'signclass'])
+
+# The datapoints of genes in screens queried from the database
+def df_geneplot_orm(gene_index, genes, screenids_array, authorized_screens):
+    with timing.span('orm'):
+        rows = list(authorized_qs_geneplot(authorized_screens, gene_index.get_ids(genes), screenids_array))
+    df = pd.DataFrame.from_records(rows, columns=['relgene', 'relscreen', 'mi', 'fcpv', 'logmi', 'signclass'])
+    # Datapoints that have not been backfilled lack the derived columns
+    missing = df['logmi'].isnull() | df['signclass'].isnull()
+    if missing.any():
+        derived = datastore.derive_ips_columns(None, df.loc[missing, 'mi'])
+        df.loc[missing, 'logmi'] = derived['logmi']
+        df.loc[missing, 'signclass'] = derived['signclass']
+    df['relgene'] = df['relgene'].map(gene_index.id_to_name)
+    return df
+
 # This function is once called from single_gene_plots to create a single dataframe containing all genes
+@timing.timed('pandas')
 def df_multiple_geneplot(genes, screenids_array, pvcutoff, authorized_screens):
     error = ""
-    text = []
-    genes_without_data = []
-    df = pd.DataFrame(columns=['relgene', 'relscreen', 'mi', 'fcpv'])
-    for gene in genes:
-        current_qs_datapoint = authorized_qs_IPSDatapoint(authorized_screens).filter(relgene__name=gene,
-                                                                             relscreen_id__in=screenids_array)
-        if not current_qs_datapoint.exists():
-            genes_without_data.append(gene)
+    gene_index = get_gene_index()
+    df = df_geneplot_matrix(gene_index, genes, screenids_array, authorized_screens)
+    if df is None:
+        df = df_geneplot_orm(gene_index, genes, screenids_array, authorized_screens)
 
-        else:
-            current_df = current_qs_datapoint.to_dataframe()[['relgene', 'relscreen', 'mi', 'fcpv']]
-            current_df['logmi'] = np.log2(current_df['mi'])
-            current_df['color'] = np.where(current_df['fcpv'] <= pvcutoff, np.where(current_df['mi'] < 1, gv.color_sb, gv.color_st),
-                                   gv.color_ns)
-            df = pd.concat([df, current_df])
-            text.append(create_textual_description(gene, current_df, pvcutoff))
+    # Keep the genes in the order in which the user requested them
+    gene_order = dict((gene, i) for i, gene in enumerate(genes))
+    df = df.iloc[np.argsort(df['relgene'].map(gene_order).values, kind='mergesort')].reset_index(drop=True)
 
+    df['color'] = np.where(df['fcpv'] <= pvcutoff, np.take(gv.fishtail_palette, df['signclass'].values.astype(int)), gv.color_ns)
+    text = create_textual_descriptions(df, pvcutoff)
+
+    genes_with_data = set(df['relgene'])
+    genes_without_data = [gene for gene in genes if gene not in genes_with_data]
     if len(genes_without_data)>0:
-        gene_urls = [''.join(('<a href=\"', gv.ucsc_link, x.split("@")[0], '\"', '>', x, '</a>')) for x in genes_without_data]
+        gene_urls = [''.join(('<a href=\"', gv.ucsc_link, gene_index.symbol(x), '\"', '>', x, '</a>')) for x in genes_without_data]
         error = gv.geneplot_no_data % " ".join([str(x) for x in gene_urls])
 
     return df, error, text
 
-def create_textual_description(gene, current_df, pvcutoff):
+# The genes that overlap a genomic region and their datapoints in a set of screens. Returns the genes (with their outer
+# bounds and the middle, which is their position in the plot) and the datapoints, in the same way as the geneplots.
+@timing.timed('pandas')
+def df_region(chromosome, start, end, screenids_array, pvcutoff, authorized_screens):
+    gene_index = get_gene_index()
+    geneids, starts, ends = get_interval_index().query(chromosome, start, end)
+    known = np.in1d(geneids, gene_index.ids)
+    geneids, starts, ends = geneids[known], starts[known], ends[known]
+    genes = gene_index.get_names(geneids)
+    df_genes = pd.DataFrame({
+        'relgene': genes,
+        'start': starts,
+        'end': ends,
+        'mid': (starts + ends) / 2.0,
+        'orientation': [gene_index.df['orientation'].values[i] for i in np.searchsorted(gene_index.ids, geneids)],
+    }, columns=['relgene', 'start', 'end', 'mid', 'orientation'])
+    df = df_geneplot_matrix(gene_index, genes, screenids_array, authorized_screens) if genes else None
+    if df is None:
+        df = df_geneplot_orm(gene_index, genes, screenids_array, authorized_screens)
+    df = pd.merge(df, df_genes[['relgene', 'mid']], on='relgene')
+    df['color'] = np.where(df['fcpv'] <= pvcutoff, np.take(gv.fishtail_palette, df['signclass'].values.astype(int)), gv.color_ns)
+    return df_genes, df
+
+def create_textual_descriptions(df, pvcutoff):
+    # Group the significant screens per gene once, and describe every gene in the order of the dataframe
+    df_sig = df[df['fcpv'] <= pvcutoff]
+    pos = df_sig[df_sig['signclass'] == 1].groupby('relgene', sort=False)['relscreen'].apply(list)
+    neg = df_sig[df_sig['signclass'] == 2].groupby('relgene', sort=False)['relscreen'].apply(list)
+    return [create_textual_description(gene, pos.get(gene, []), neg.get(gene, [])) for gene in df['relgene'].unique()]
+
+def create_textual_description(gene, pos_screens, neg_screens):
     # Create a textual description for the effect the requested genes
-    pos_screens = current_df[(current_df['fcpv'] <= pvcutoff) & (current_df['mi'] < 1)]['relscreen'].tolist()
     if len(pos_screens) > 1:
         pos_screen_text = " and ".join([", ".join(pos_screens[:-1]), pos_screens[-1]])
     else:
         pos_screen_text = "".join(pos_screens)
-    neg_screens = current_df[(current_df['fcpv'] <= pvcutoff) & (current_df['mi'] >= 1)]['relscreen'].tolist()
     if len(neg_screens) > 1:
         neg_screen_text = " and ".join([", ".join(neg_screens[:-1]), neg_screens[-1]])
     else:
@@ -284,6 +496,29 @@ def create_textual_description(gene, current_df, pvcutoff):
     return current_text
 
 
+# The genes with the most similar profile of logmi to gene across the screens of screenids (see neighbours.py), or None
+# if the gene matrix is missing or stale or the normalised matrix has not been rebuilt from it yet
+@timing.timed('neighbours')
+def df_gene_neighbours(gene, screenids_array, authorized_screens, k=gv.neighbour_top_k):
+    neighbours = get_neighbour_matrix()
+    if neighbours is None:
+        return None
+    gene_index = get_gene_index()
+    geneids, r, shared = neighbours.nearest(gene_index.name_to_id.get(gene, -1), [i for i in screenids_array if int(i) in authorized_screens], k)
+    return pd.DataFrame({
+        'relgene': gene_index.get_names(geneids),
+        'r': np.round(r, 3),
+        'shared': shared,
+    }, columns=['relgene', 'r', 'shared'])
+
+# HTML table of the neighbours of a gene, the names link to the geneplot of the gene and its neighbours
+def generate_neighbours_table(gene, df, authorized_screens):
+    df = df.copy()
+    df['relgene'] = '<a href=\"' + df['relgene'].map(lambda x: create_gene_plot_url(' '.join([gene, x]), authorized_screens)) + '\">' + df['relgene'] + '</a>'
+    df.rename(columns={'relgene': 'Gene', 'r': 'Correlation (r)', 'shared': 'Shared screens'}, inplace=True)
+    with pd.option_context('display.max_colwidth', -1):
+        return df.to_html(index=False, justify='left', escape=False)
+
 def calc_geneplot_width(plot_width, screens):
     if plot_width == 'dynamic':
         width = screens*gv.dynamic_geneplot_width+100
@@ -297,30 +532,105 @@ def calc_geneplot_width(plot_width, screens):
         width = gv.normal_geneplot_width
     return width
 
+#############################################################
+# 5. Functions specific for positive selection screens      #
+#############################################################
+
+# 5.1 The DataFrame for the bubble plot of a positive selection screen, built from the columnar store in one vectorised
+# pass. x is the position of a gene in the order of seq (precomputed by the store), y is -log(p) and the surface of
+# a bubble scales with the number of insertions.
+def generate_df_pss(screenid, pvcutoff, authorized_screens):
+    with timing.span('store'):
+        if int(screenid) in authorized_screens:
+            columns = datastore.load_pss_columns(screenid)
+        else:
+            columns = dict((name, np.array([], dtype=dtype)) for name, dtype in zip(datastore.pss_columns, datastore.pss_dtypes))
+    with timing.span('pandas'):
+        gene_index = get_gene_index()
+        known = np.in1d(columns['relgene_id'], gene_index.ids)
+        df = pd.DataFrame(dict((name, columns[name][known]) for name in ('nm', 'fcpv', 'xval')))
+        df['relgene'] = pd.Series(columns['relgene_id'][known]).map(gene_index.id_to_name).values
+        with np.errstate(divide='ignore'):
+            logp = -np.log10(df['fcpv'].values)
+        # A p-value of 0 is drawn at the largest -log(p) a float can hold, a p-value of 1 just above the bottom of a log axis
+        df['yval'] = np.clip(logp, gv.pss_min_logp, -np.log10(np.finfo(np.float64).tiny))
+        nm = np.sqrt(np.maximum(df['nm'].values, 0).astype(np.float64))
+        scale = nm / nm.max() if len(nm) and nm.max() > 0 else nm
+        df['dotsize'] = gv.pss_min_dotsize + (gv.pss_max_dotsize - gv.pss_min_dotsize) * scale
+        # Labels start just right of the bubble: convert its radius from pixels to genes along the x-axis
+        genes_per_px = 1.1 * len(df.index) / gv.bubbleplotwidth
+        df['txval'] = df['xval'] + (df['dotsize'] / 2 + gv.pss_label_margin) * genes_per_px
+        df['tyval'] = df['yval']
+        significant = df['fcpv'] <= pvcutoff
+        df['color'] = np.where(significant, gv.pss_color_s, gv.pss_color_ns)
+        df['signame'] = np.where(significant, df['relgene'], "")
+    return df
+
+
+#############################################################
+# 6. Correlations of screens                                #
+#############################################################
+
+# The correlations of the IP screens of screenids as a long DataFrame (one row per pair), for the heatmap, or None if
+# the correlations have not been computed
+@timing.timed('pandas')
+def df_correlations(screenids, authorized_screens):
+    correlations = get_correlations()
+    if correlations is None:
+        return None
+    screens = permissions.get_screen_permissions().screens
+    corr, shared, screenids = correlations.submatrix([i for i in screenids if int(i) in authorized_screens])
+    names = np.array([screens[i].name for i in screenids], dtype=object)
+    rows, cols = np.indices(corr.shape)
+    return pd.DataFrame({
+        'screen1': names[rows.ravel()],
+        'screen2': names[cols.ravel()],
+        'r': corr.ravel().astype(np.float64),
+        'shared': shared.ravel(),
+    }, columns=['screen1', 'screen2', 'r', 'shared'])
+
+# HTML table of the screens that resemble screenid most
+def generate_similar_screens_table(screenid, screenids, authorized_screens):
+    correlations = get_correlations()
+    if correlations is None or int(screenid) not in authorized_screens:
+        return ''
+    screens = permissions.get_screen_permissions().screens
+    similar = correlations.most_similar(screenid, [i for i in screenids if int(i) in authorized_screens])
+    df = pd.DataFrame([(screens[i].name, screens[i].description, round(r, 3), n) for i, r, n in similar],
+                      columns=['Screen', 'Description', 'Correlation (r)', 'Shared genes'])
+    return df.to_html(index=False, justify='left')
+
+
 ##########################################################
-# 5. Data acquisition for lists (genes, screens and tracks) #
+# 7. Data acquisition for lists (genes, screens and tracks) #
 ##########################################################
 
-def list_genes(authorized_screens):
-    df = create_df_gene()
-
-    # For creating the links to geneplots, get the autorized screens and us
-    screenids = authorized_qs_screen(authorized_screens).filter(screentype='IP').to_dataframe()['id'].values.tolist()
-    screen_part_url = ''
-    for i in screenids:
-        curr_scr = 'screens='+str(i)+'&'
-        screen_part_url = ''.join([screen_part_url, curr_scr])
-    df['urlencoded'] = df['name'].str.replace('+', '%2B') # the '+' sign needs to be encoded to safe ASCII otherwise the GET request does not understand it
-    #df['UCSC Link'] = '<a href=\"' + gv.ucsc_link + df['name'].str.split("@", 1).str[
-    #    0] + '\"' + 'target=\"_blank\"' + '>' + df['name'].str.split("@", 1).str[0] + '</a>'
-    df['name'] = '<a href=\"../opengenefinder/?' + \
-                 'genes=' + \
-                 df['urlencoded'] + \
-                 '&description=true\", ' + \
-                 'target=\"_blank\">' + \
-                 df['name'] + \
-                 '</a>'
-    df = df.drop(['urlencoded', 'id'], 1)
-    with pd.option_context('display.max_colwidth', -1):
-            table = df.sort_values(by='name').to_html(index=False, justify='left', escape=False)
-    return table
\ No newline at end of file
+def list_genes(page=1, page_size=gv.gene_page_size, sort='name', order='asc', query='', chromosome=''):
+    # Returns one page of the gene catalogue, sorted on sort and filtered on (part of) the name and the chromosome
+    gene_index = get_gene_index()
+    if sort not in ('name', 'description', 'chromosome', 'orientation'):
+        sort = 'name'
+    descending = (order == 'desc')
+    key = (gene_index.version, page, page_size, sort, descending, query.lower(), chromosome)
+    result = caches.gene_page_cache.get(key)
+    if result is None:
+        positions = gene_index.order(sort, descending)
+        if query:
+            positions = positions[np.char.find(gene_index.lower_names[positions], query.lower()) >= 0]
+        if chromosome:
+            positions = positions[gene_index.df['chromosome'].values[positions] == chromosome]
+        count = len(positions)
+        pages = max(1, int(math.ceil(float(count) / page_size)))
+        page = min(page, pages)
+        df_page = gene_index.df.iloc[positions[(page - 1) * page_size:page * page_size]]
+        result = {
+            'count': count,
+            'page': page,
+            'pages': pages,
+            'page_size': page_size,
+            'sort': sort,
+            'order': 'desc' if descending else 'asc',
+            'genes': df_page[['name', 'description', 'chromosome', 'orientation']].to_dict('records'),
+        }
+        caches.gene_page_cache.set(key, result)
+    return result
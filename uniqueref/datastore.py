@@ -0,0 +1,296 @@
+# Columnar storage of the datapoints of a screen
+#
+# Pulling ~20k IPSDatapoint rows through the ORM and django_pandas for every fishtail plot is by far the most
+# expensive part of a request. Because the datapoints of a screen only change when a screen is (re)imported, the
+# columns needed for plotting are written once to a .npz file per screen and read back directly on every request.
+#
+# Every store is stamped with the version of the screen it was built from. The version of a screen is a small
+# file that is bumped whenever its datapoints change (see signals.py and the importers). If the stamp of a store
+# does not match the current version, the store is considered stale and is rebuilt from the ORM.
+
+# Import Django related libraries and functions
+from django.db import transaction
+
+# Import other custom phenosaurus functions
+import globalvars as gv
+import models as db
+
+# Other general libraries
+from contextlib import contextmanager
+import numpy as np
+import threading
+import errno
+import time
+import os
+
+
+# The columns that are stored for intracellular phenotype screens, relgene_id is always the first column
+ips_columns = ('relgene_id', 'insertions', 'mi', 'fcpv', 'low', 'high', 'loginsertions', 'logmi', 'signclass')
+ips_dtypes = ('int32', 'int32', 'float64', 'float64', 'int32', 'int32', 'float64', 'float64', 'int8')
+# The columns of IPSDatapoint that are derived from insertions and mi, see derive_ips_columns
+ips_derived_columns = ('loginsertions', 'logmi', 'signclass')
+# The columns that are stored for positive selection screens. The stores are sorted on seq and xval is the position of
+# a gene along the x-axis of the bubble plot, ie. the rank of its seq.
+pss_columns = ('relgene_id', 'nm', 'fcpv', 'seq', 'xval')
+pss_dtypes = ('int32', 'int32', 'float64', 'int32', 'int32')
+
+
+##########################################################
+# 1. Version markers                                     #
+##########################################################
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+def _atomic_write(path, content):
+    # Write to a temporary file first and move it in place, this way a worker never reads a half-written file
+    _makedirs(os.path.dirname(path))
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.rename(tmp_path, path)
+
+def version_path(key):
+    return os.path.join(gv.datastore_dir, 'versions', key)
+
+def get_version(key):
+    # A missing marker means the data has not changed since Phenosaurus started keeping track of versions
+    try:
+        with open(version_path(key)) as f:
+            return f.read().strip() or '0'
+    except IOError:
+        return '0'
+
+def bump_version(key):
+    version = repr(time.time())
+    try:
+        _atomic_write(version_path(key), version)
+    except (IOError, OSError):
+        pass    # A read-only datastore only means that the caches can not be invalidated, never fail a request for it
+    return version
+
+def screen_version_key(screenid):
+    return 'screen_%d' % int(screenid)
+
+def get_screen_version(screenid):
+    return get_version(screen_version_key(screenid))
+
+# Bumped together with the version of any screen, which tells whether any screen has changed without reading the
+# versions of all of them
+datapoints_version_key = 'datapoints'
+
+def bump_screen_version(screenid):
+    version = bump_version(screen_version_key(screenid))
+    bump_version(datapoints_version_key)
+    return version
+
+# Importers that save datapoints one by one bump the versions once when they are done, within importing() the signal
+# handlers of the datapoints leave them alone
+_imports = threading.local()
+
+@contextmanager
+def importing():
+    _imports.active = True
+    try:
+        yield
+    finally:
+        _imports.active = False
+
+def is_importing():
+    return getattr(_imports, 'active', False)
+
+# The version of the dataset as a whole, bumped upon every import and every change to the update history. Pages that
+# show data of many screens at once depend on it (see conditional.py).
+dataset_version_key = 'dataset'
+
+def get_dataset_version():
+    return get_version(dataset_version_key)
+
+def bump_dataset_version():
+    return bump_version(dataset_version_key)
+
+
+##########################################################
+# 2. Columnar store for intracellular phenotype screens  #
+##########################################################
+
+def derive_ips_columns(insertions, mi):
+    # The vectorised version of IPSDatapoint.set_derived_fields, non-positive values have no logarithm (NaN).
+    # loginsertions is left out if insertions is None.
+    mi = np.asarray(mi, dtype='float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        derived = {
+            'logmi': np.where(mi > 0, np.log2(mi), np.nan),
+            'signclass': np.where(mi < 1, 1, 2).astype('int8'),
+        }
+        if insertions is not None:
+            insertions = np.asarray(insertions, dtype='float64')
+            derived['loginsertions'] = np.where(insertions > 0, np.log10(insertions), np.nan)
+    return derived
+
+def ips_store_path(screenid):
+    return os.path.join(gv.datastore_dir, 'ips', 'screen_%d.npz' % int(screenid))
+
+def ips_store_queryset(screenid):
+    # The only place where the datapoints of a screen are pulled from the database to fill a store
+    return db.IPSDatapoint.objects.filter(relscreen_id=screenid).order_by('relgene_id').values_list(*ips_columns)
+
+def query_ips_columns(screenid):
+    rows = list(ips_store_queryset(screenid))
+    columns = {}
+    for i, (name, dtype) in enumerate(zip(ips_columns, ips_dtypes)):
+        if name in ips_derived_columns:
+            continue
+        columns[name] = np.fromiter((row[i] for row in rows), dtype=dtype, count=len(rows))
+    # The derived columns are NULL for datapoints that have not been backfilled yet, compute those here
+    derived = derive_ips_columns(columns['insertions'], columns['mi'])
+    for name in ips_derived_columns:
+        i = ips_columns.index(name)
+        stored = np.array([np.nan if row[i] is None else row[i] for row in rows], dtype='float64')
+        missing = np.isnan(stored)
+        stored[missing] = derived[name][missing]
+        columns[name] = stored.astype(ips_dtypes[i])
+    return columns
+
+def _save_store(path, version, columns):
+    try:
+        _makedirs(os.path.dirname(path))
+        tmp_path = '%s.%d.tmp.npz' % (path[:-4], os.getpid())
+        np.savez(tmp_path, version=np.array(version), **columns)
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        pass    # Not being able to write the store only costs performance
+
+def _read_store(path, screenid, names):
+    # Returns a dictionary of arrays, or None if the store is missing or stale
+    try:
+        store = np.load(path)
+    except (IOError, OSError, ValueError):
+        return None
+    try:
+        if str(store['version']) != get_screen_version(screenid):
+            return None
+        return dict((name, store[name]) for name in names)
+    except KeyError:
+        return None     # A store written before a column was added
+    finally:
+        store.close()
+
+def write_ips_store(screenid, columns=None):
+    # Stamp the store with the version of the screen prior to querying, a change during the query makes it stale
+    version = get_screen_version(screenid)
+    if columns is None:
+        columns = query_ips_columns(screenid)
+    _save_store(ips_store_path(screenid), version, columns)
+    return columns
+
+def read_ips_store(screenid):
+    return _read_store(ips_store_path(screenid), screenid, ips_columns)
+
+def load_ips_columns(screenid):
+    # Read the store, or fall back to the ORM and (re)write the store if it is missing or stale
+    columns = read_ips_store(screenid)
+    if columns is None:
+        columns = write_ips_store(screenid)
+    return columns
+
+def drop_ips_store(screenid):
+    try:
+        os.remove(ips_store_path(screenid))
+    except OSError:
+        pass
+
+
+##########################################################
+# 3. Columnar store for positive selection screens       #
+##########################################################
+
+def pss_store_path(screenid):
+    return os.path.join(gv.datastore_dir, 'pss', 'screen_%d.npz' % int(screenid))
+
+def pss_store_queryset(screenid):
+    return db.PSSDatapoint.objects.filter(relscreen_id=screenid).order_by('seq', 'relgene_id').values_list(*pss_columns[:-1])
+
+def query_pss_columns(screenid):
+    rows = list(pss_store_queryset(screenid))
+    columns = {}
+    for i, (name, dtype) in enumerate(zip(pss_columns[:-1], pss_dtypes)):
+        columns[name] = np.fromiter((row[i] for row in rows), dtype=dtype, count=len(rows))
+    # The rows are sorted on seq, so the x positions are simply their order
+    columns['xval'] = np.arange(len(rows), dtype='int32')
+    return columns
+
+def write_pss_store(screenid, columns=None):
+    version = get_screen_version(screenid)
+    if columns is None:
+        columns = query_pss_columns(screenid)
+    _save_store(pss_store_path(screenid), version, columns)
+    return columns
+
+def read_pss_store(screenid):
+    return _read_store(pss_store_path(screenid), screenid, pss_columns)
+
+def load_pss_columns(screenid):
+    columns = read_pss_store(screenid)
+    if columns is None:
+        columns = write_pss_store(screenid)
+    return columns
+
+def drop_pss_store(screenid):
+    try:
+        os.remove(pss_store_path(screenid))
+    except OSError:
+        pass
+
+
+##########################################################
+# 4. Hooks for importers                                 #
+##########################################################
+
+def bump_versions(screenids):
+    for screenid in screenids:
+        bump_screen_version(screenid)
+    bump_dataset_version()
+
+def screens_changed(screenids, refresh_snapshots=True):
+    # Call this after the datapoints of one or more screens have been (re)imported. The versions are bumped and the
+    # stores rebuilt once the surrounding transaction has been committed: a page drawn from the old rows while the import
+    # runs is never cached under the new version, and the stores never hold data that may still be rolled back. The rows
+    # of the screens in the gene matrix are updated from the new stores, then their correlations with the other screens, and
+    # if snapshots are kept and refresh_snapshots is True their snapshots are rendered again. Rendering takes a while
+    # per screen, importers that run within a request pass False and leave it to the snapshot_public_screens command.
+    import genematrix   # Imported here as genematrix, neighbours, correlations and snapshots are built on this module
+    import neighbours
+    import correlations
+    import snapshots
+    screenids = set(int(i) for i in screenids)
+
+    def rebuild():
+        bump_versions(screenids)
+        for screenid in screenids:
+            write_ips_store(screenid)
+        try:
+            genematrix.update_gene_matrix(screenids)
+            neighbours.update_neighbour_matrix()
+            if correlations.correlations_exist():
+                correlations.update_correlations()
+        except (IOError, OSError):
+            pass    # Lookups fall back to the database as long as the rows of the screens are stale
+        if refresh_snapshots and snapshots.snapshots_enabled():
+            snapshots.update_snapshots(screenids)   # Never raises, a missing snapshot only costs performance
+    transaction.on_commit(rebuild)
+
+
+def pss_screens_changed(screenids):
+    # The same for positive selection screens, which are not part of the gene matrix
+    screenids = set(int(i) for i in screenids)
+
+    def rebuild():
+        bump_versions(screenids)
+        for screenid in screenids:
+            write_pss_store(screenid)
+    transaction.on_commit(rebuild)
@@ -0,0 +1,128 @@
+# Streaming export of the datapoints of screens
+#
+# The import-export admin builds the whole queryset and file in memory before sending anything. Here the datapoints
+# are read screen by screen with iterator(), which uses a server-side cursor on PostgreSQL, and written in chunks of
+# gv.export_chunk_rows rows, so memory stays flat no matter how many screens are exported. The columns are those read
+# by the import_datapoints command (relscreenname, relgenename and the editable fields of the model), so an export can
+# be imported again. Parquet needs pyarrow, which is optional.
+
+# Import other custom phenosaurus functions
+import globalvars as gv
+import models as db
+from geneindex import get_gene_index
+
+# Other general libraries
+from cStringIO import StringIO
+import csv
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+
+export_models = {
+    'ips': db.IPSDatapoint,
+    'pss': db.PSSDatapoint,
+}
+export_screentypes = {
+    'ips': 'IP',
+    'pss': 'PS',
+}
+export_formats = {
+    # format: (content type, file extension)
+    'csv': ('text/csv', 'csv'),
+    'tsv': ('text/tab-separated-values', 'tsv'),
+    'parquet': ('application/octet-stream', 'parquet'),
+}
+
+
+def available_formats():
+    return [name for name in sorted(export_formats) if name != 'parquet' or pq is not None]
+
+def export_fields(model):
+    # The fields of the model that import_datapoints reads, in the order of the model
+    return [field.attname for field in model._meta.concrete_fields
+            if not field.primary_key and field.name not in ('relscreen', 'relgene') and field.editable]
+
+def iter_chunks(model, screenids, chunk_rows=gv.export_chunk_rows):
+    # Yields lists of rows (relscreenname, relgenename, fields...) of at most chunk_rows rows. Screens and genes are
+    # named from memory, so the datapoints are read without joins.
+    screen_names = dict(db.Screen.objects.filter(id__in=screenids).values_list('id', 'name'))
+    gene_names = get_gene_index().id_to_name
+    fields = export_fields(model)
+    chunk = []
+    for screenid in sorted(screen_names):
+        rows = model.objects.filter(relscreen_id=screenid).order_by('relgene_id').values_list('relgene_id', *fields)
+        for row in rows.iterator():
+            chunk.append((screen_names[screenid], gene_names.get(row[0], '')) + tuple(row[1:]))
+            if len(chunk) >= chunk_rows:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+def iter_delimited(model, screenids, delimiter):
+    buf = StringIO()
+    writer = csv.writer(buf, delimiter=delimiter, lineterminator='\n')
+    writer.writerow(['relscreenname', 'relgenename'] + export_fields(model))
+    for chunk in iter_chunks(model, screenids):
+        writer.writerows(chunk)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue()    # The header of an empty export
+
+
+class DrainBuffer(object):
+    """A write-only file for pyarrow of which the written bytes are taken out after every row group."""
+
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+def iter_parquet(model, screenids):
+    # Every chunk becomes a row group
+    names = ['relscreenname', 'relgenename'] + export_fields(model)
+    sink = DrainBuffer()
+    writer = None
+    for chunk in iter_chunks(model, screenids):
+        table = pa.Table.from_arrays([pa.array(list(column)) for column in zip(*chunk)], names=names)
+        if writer is None:
+            writer = pq.ParquetWriter(sink, table.schema)
+        writer.write_table(table)
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
+
+def iter_export(datatype, screenids, fmt):
+    # The export of the screens as an iterator of byte strings. Screens of another type than datatype are left out.
+    model = export_models[datatype]
+    screenids = list(db.Screen.objects.filter(id__in=screenids, screentype=export_screentypes[datatype]).values_list('id', flat=True))
+    if fmt == 'parquet':
+        if pq is None:
+            raise ValueError(gv.export_parquet_error)
+        return iter_parquet(model, screenids)
+    return iter_delimited(model, screenids, '\t' if fmt == 'tsv' else ',')
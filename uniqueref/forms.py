@@ -10,7 +10,6 @@ from django import forms
 
 # Import other custom phenosaurus functions
 import globalvars as gv
-import models as db
 import custom_functions as cf
 
 # Other general libraries
@@ -60,33 +59,109 @@ class BootstrapAuthenticationForm(AuthenticationForm):
                                    'class': 'form-control',
                                    'placeholder':'Password'}))
 
+# The forms get the screens the user is allowed to see as permissions.AuthorizedScreens, so they need no queries
+empty_choice = [('', '---------')]
+
 class SingleIPSPlotForm(forms.Form):
 	def __init__(self, *args, **kwargs):
-		input = kwargs.pop('input')
-		authorized_screens = map(int, input.strip("[]").replace(' ', '').split(','))
+		authorized = kwargs.pop('authorized')
+		tracks = kwargs.pop('tracks', [])
 		super(SingleIPSPlotForm, self).__init__(*args, **kwargs)
-		self.fields['screen'].queryset = db.Screen.objects.filter(id__in=authorized_screens).filter(screentype='IP').order_by('name')
+		self.fields['screen'].choices = empty_choice + authorized.choices('IP')
+		self.fields['tracks'].choices = tracks
 
-	screen = forms.ModelChoiceField(queryset=db.Screen.objects.all(), label='Choose screen', widget=forms.Select(attrs={'class': 'form-control'}))
+	screen = forms.ChoiceField(label='Choose screen', widget=forms.Select(attrs={'class': 'form-control'}))
 	pvalue = forms.DecimalField(required=False, label='P-value cutoff (can also be written as 1E-xx)', initial=gv.pvdc,
 								widget=forms.NumberInput(attrs={'class': 'form-control'}))
-	textsize = forms.ChoiceField(label='Textsize (px)', choices=textsize, initial='11px', required=True)
+	textsize = forms.ChoiceField(label='Textsize (px)', choices=textsize, initial=gv.initial_text_size, required=True)
 	oca = forms.ChoiceField(label='Select action on click', choices=ocao, initial='gc',
 							widget=forms.Select(attrs={'class': 'form-control'}))
 	sag = forms.BooleanField(required=False, initial=True, label='Label all significant hits', widget=forms.CheckboxInput(attrs={'class': 'checkbox'}))
 	showtable = forms.BooleanField(required=False, label="List all significant genes in table", initial=True, widget=forms.CheckboxInput(attrs={'class': 'form-checkbox'}))
+	binarydata = forms.BooleanField(required=False, label="Load plot data separately (faster for large screens)", initial=False, widget=forms.CheckboxInput(attrs={'class': 'form-checkbox'}))
+	lod = forms.BooleanField(required=False, label="Aggregate non-significant genes until zoomed in", initial=False, widget=forms.CheckboxInput(attrs={'class': 'form-checkbox'}))
+	tracks = forms.MultipleChoiceField(widget=forms.SelectMultiple(attrs={'size': '5', 'class': 'form-control'}),
+									   label='Highlight the genes of custom track(s)', required=False)
+
+
+# y-axis scaling of the bubble plot
+scalingo = (
+	('log', 'Logarithmic'),
+	('linear', 'Linear'),
+)
+
+class BubblePlotForm(forms.Form):
+	def __init__(self, *args, **kwargs):
+		authorized = kwargs.pop('authorized')
+		super(BubblePlotForm, self).__init__(*args, **kwargs)
+		self.fields['screen'].choices = empty_choice + authorized.choices('PS')
+
+	screen = forms.ChoiceField(label='Choose screen', widget=forms.Select(attrs={'class': 'form-control'}))
+	pvalue = forms.DecimalField(required=False, label='P-value cutoff (can also be written as 1E-xx)', initial=gv.pvdc,
+								widget=forms.NumberInput(attrs={'class': 'form-control'}))
+	scaling = forms.ChoiceField(label='Scaling of the y-axis', choices=scalingo, initial='log',
+								widget=forms.Select(attrs={'class': 'form-control'}))
+	textsize = forms.ChoiceField(label='Textsize (px)', choices=textsize, initial=gv.initial_text_size, required=True)
+	oca = forms.ChoiceField(label='Select action on click', choices=ocao[:2], initial='gc',
+							widget=forms.Select(attrs={'class': 'form-control'}))
+	sag = forms.BooleanField(required=False, initial=True, label='Label all significant hits', widget=forms.CheckboxInput(attrs={'class': 'checkbox'}))
+
+
+class UniqueFinderForm(forms.Form):
+	def __init__(self, *args, **kwargs):
+		authorized = kwargs.pop('authorized')
+		super(UniqueFinderForm, self).__init__(*args, **kwargs)
+		self.fields['screen'].choices = empty_choice + authorized.choices('IP')
+		self.fields['screens'].choices = authorized.choices('IP')
+
+	screen = forms.ChoiceField(label='Screen to find unique hits in', widget=forms.Select(attrs={'class': 'form-control'}))
+	screens = forms.MultipleChoiceField(widget=forms.SelectMultiple(attrs={'size': '15', 'class': 'form-control'}),
+										label='Compare against screen(s)', required=True)
+	pvalue = forms.DecimalField(required=False, label='P-value cutoff (can also be written as 1E-xx)', initial=gv.pvdc,
+								widget=forms.NumberInput(attrs={'class': 'form-control'}))
+	mldiff = forms.DecimalField(required=False, label='Minimal difference in log2(MI) to draw an arrow', initial=gv.minimal_logmi_difference,
+								widget=forms.NumberInput(attrs={'class': 'form-control'}))
+	textsize = forms.ChoiceField(label='Textsize (px)', choices=textsize, initial=gv.initial_text_size, required=True)
+	oca = forms.ChoiceField(label='Select action on click', choices=ocao[:2], initial='gc',
+							widget=forms.Select(attrs={'class': 'form-control'}))
+
+
+class RegionForm(forms.Form):
+	def __init__(self, *args, **kwargs):
+		authorized = kwargs.pop('authorized')
+		super(RegionForm, self).__init__(*args, **kwargs)
+		self.fields['screens'].choices = authorized.choices('IP')
+
+	region = forms.CharField(widget=forms.TextInput(
+											attrs={'class': 'form-control', 'placeholder': 'chr7:100,000,000-101,000,000'}),
+											label='Genomic region', required=True)
+	screens = forms.MultipleChoiceField(widget=forms.SelectMultiple(attrs={'size': '15', 'class': 'form-control'}),
+										label='Select screen(s)', required=False)
+	pvalue = forms.DecimalField(required=False, label='P-value cutoff (can also be written as 1E-xx)', initial=gv.pvdc,
+								widget=forms.NumberInput(attrs={'class': 'form-control'}))
+	textsize = forms.ChoiceField(label='Textsize (px)', choices=textsize, initial=gv.initial_text_size, required=True)
+
+class CorrelationsForm(forms.Form):
+	def __init__(self, *args, **kwargs):
+		authorized = kwargs.pop('authorized')
+		super(CorrelationsForm, self).__init__(*args, **kwargs)
+		self.fields['screen'].choices = empty_choice + authorized.choices('IP')
+		self.fields['screens'].choices = authorized.choices('IP')
+
+	screen = forms.ChoiceField(label='List the screens that resemble', required=False, widget=forms.Select(attrs={'class': 'form-control'}))
+	screens = forms.MultipleChoiceField(widget=forms.SelectMultiple(attrs={'size': '15', 'class': 'form-control'}),
+										label='Select screen(s)', required=False)
+	textsize = forms.ChoiceField(label='Textsize (px)', choices=textsize, initial=gv.initial_text_size, required=True)
 
 	
 class OpenGeneFinderForm(forms.Form):
 	def __init__(self, *args, **kwargs):
-		input = kwargs.pop('input')
-		authorized_screens = map(int, input.strip("[]").replace(' ', '').split(','))
+		authorized = kwargs.pop('authorized')
 		super(OpenGeneFinderForm, self).__init__(*args, **kwargs)
-		self.fields['screens'].queryset = db.Screen.objects.filter(id__in=authorized_screens).filter(screentype='IP').order_by('name')
+		self.fields['screens'].choices = authorized.choices('IP')
 
-	screens = forms.ModelMultipleChoiceField(queryset=db.Screen.objects.all(),
-											 widget=forms.SelectMultiple(attrs={'size': '15', 'class': 'form-control'}),
-											 label='Select screen(s)', required=False)
+	screens = forms.MultipleChoiceField(widget=forms.SelectMultiple(attrs={'size': '15', 'class': 'form-control'}),
+										label='Select screen(s)', required=False)
 	genes = forms.CharField(widget=forms.TextInput(
 											attrs={'class': 'form-control', 'placeholder': 'EZH2 SUZ12 EED', 'style': 'min-width: 100%'}),
 											label='Enter genename(s), space separated', required=True)
@@ -95,4 +170,6 @@ class OpenGeneFinderForm(forms.Form):
 	description = forms.BooleanField(required=False, label="Text description of results", initial=False,
 								   widget=forms.CheckboxInput(attrs={'class': 'form-checkbox'}))
 	hidelegend = forms.BooleanField(required=False, label="Hide legend", initial=False,
+									 widget=forms.CheckboxInput(attrs={'class': 'form-checkbox'}))
+	neighbours = forms.BooleanField(required=False, label="Genes with a similar profile", initial=False,
 									 widget=forms.CheckboxInput(attrs={'class': 'form-checkbox'}))
\ No newline at end of file
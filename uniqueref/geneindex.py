@@ -0,0 +1,147 @@
+# A process-wide, in-memory index of all genes in the database
+#
+# The gene table only changes when an administrator imports or edits genes, yet it used to be loaded into a DataFrame
+# on every request. Each worker now keeps a single GeneIndex that is lazily rebuilt once the 'genes' version marker
+# (see datastore.py) has been bumped by signals.py or by an import.
+
+# Import other custom phenosaurus functions
+import globalvars as gv
+import datastore
+import models as db
+
+# Other general libraries
+from collections import defaultdict
+import pandas as pd
+import numpy as np
+import threading
+
+
+gene_version_key = 'genes'
+gene_columns = ['id', 'name', 'description', 'chromosome', 'orientation']
+
+
+class GeneIndex(object):
+    """Lookup tables for all genes: name->id, id->name and the canonical symbol (the part before the '@')."""
+
+    def __init__(self, df, version):
+        self.version = version
+        self.df = df
+        self.ids = df['id'].values
+        self.names = df['name'].values
+        self.symbols = df['name'].str.split('@', 1).str[0].values
+        self.name_to_id = dict(zip(self.names, self.ids))
+        self.id_to_name = dict(zip(self.ids, self.names))
+        self.name_to_symbol = dict(zip(self.names, self.symbols))
+        self.lower_names = np.char.lower(self.names.astype(np.unicode_))
+        self._postings = None   # The trigram index is only built once suggestions are requested
+        self._orders = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, name):
+        return name in self.name_to_id
+
+    def frame(self):
+        # A copy of the gene table as DataFrame, callers are free to modify it
+        return self.df.copy()
+
+    def get_ids(self, names):
+        # Returns the ids of the names that are in the index as plain ints (safe to pass to a queryset), unknown names are ignored
+        return [int(self.name_to_id[name]) for name in names if name in self.name_to_id]
+
+    def get_names(self, ids):
+        return [self.id_to_name[i] for i in ids if i in self.id_to_name]
+
+    def symbol(self, name):
+        # Unknown (or extended) names are reduced to their canonical symbol as well
+        return self.name_to_symbol.get(name, name.split('@')[0])
+
+    def contains(self, fragment):
+        # Case insensitive substring search over all names, the in-memory equivalent of name__icontains
+        hits = np.char.find(self.lower_names, fragment.lower()) >= 0
+        return self.names[hits].tolist()
+
+    def order(self, column, descending=False):
+        # The positions of the genes sorted on column, computed once per column
+        if column not in self._orders:
+            self._orders[column] = np.argsort(self.df[column].values, kind='mergesort')
+        positions = self._orders[column]
+        return positions[::-1] if descending else positions
+
+    def trigram_postings(self):
+        # Maps every trigram to the (sorted) positions of the names containing it
+        if self._postings is None:
+            postings = defaultdict(list)
+            gram_counts = np.zeros(len(self), dtype=np.float64)
+            for pos, name in enumerate(self.lower_names):
+                grams = trigrams(name)
+                gram_counts[pos] = len(grams)
+                for gram in grams:
+                    postings[gram].append(pos)
+            self._gram_counts = gram_counts
+            self._postings = dict((gram, np.array(positions, dtype=np.int64)) for gram, positions in postings.items())
+        return self._postings
+
+    def suggest(self, queries, limit=gv.max_gene_suggestions, min_score=gv.min_gene_suggestion_score):
+        # Returns, for each query, a list of at most limit names ranked by trigram similarity (Jaccard). Names that
+        # contain the query as a whole always rank first. All queries are scored together in one pass.
+        queries = list(queries)
+        if not queries or not len(self):
+            return [[] for q in queries]
+        postings = self.trigram_postings()
+        n = len(self)
+        query_rows, name_cols, query_counts = [], [], []
+        for qi, query in enumerate(queries):
+            grams = trigrams(query.lower())
+            query_counts.append(len(grams))
+            for gram in grams:
+                if gram in postings:
+                    name_cols.append(postings[gram])
+                    query_rows.append(np.repeat(qi, len(postings[gram])))
+        if name_cols:
+            flat = np.concatenate(query_rows) * n + np.concatenate(name_cols)
+            shared = np.bincount(flat, minlength=len(queries) * n).reshape(len(queries), n).astype(np.float64)
+        else:
+            shared = np.zeros((len(queries), n))
+        scores = shared / (np.array(query_counts, dtype=np.float64)[:, None] + self._gram_counts[None, :] - shared)
+        for qi, query in enumerate(queries):
+            scores[qi, np.char.find(self.lower_names, query.lower()) >= 0] += 1
+
+        suggestions = []
+        for row in scores:
+            top = np.argpartition(-row, min(limit, n) - 1)[:limit]
+            top = top[np.argsort(-row[top], kind='mergesort')]
+            suggestions.append(self.names[top[row[top] >= min_score]].tolist())
+        return suggestions
+
+
+def trigrams(word):
+    # The trigrams of a word, padded so that the start and end of the word weigh in
+    word = '  %s ' % word
+    return set(word[i:i + 3] for i in range(len(word) - 2))
+
+
+_index = None
+_lock = threading.Lock()
+
+def build_gene_index(version):
+    rows = list(db.Gene.objects.order_by('id').values_list(*gene_columns))
+    df = pd.DataFrame.from_records(rows, columns=gene_columns)
+    return GeneIndex(df, version)
+
+def get_gene_index():
+    # Returns the index of this worker, rebuilding it if the gene table has changed since it was built
+    global _index
+    version = datastore.get_version(gene_version_key)
+    index = _index
+    if index is None or index.version != version:
+        with _lock:
+            if _index is None or _index.version != version:
+                _index = build_gene_index(version)
+            index = _index
+    return index
+
+def genes_changed():
+    # Call this after genes have been added, removed or renamed
+    datastore.bump_version(gene_version_key)
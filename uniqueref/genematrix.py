@@ -0,0 +1,229 @@
+# A dense gene x screen matrix of logmi and fcpv for lookups across intracellular phenotype screens
+#
+# Answering "what does gene X do in screens S1..Sn" used to take a query joining the datapoints of all screens. The
+# matrix holds the logmi and fcpv of every (gene, IP screen) pair as float32 in two memory-mapped files, a gene that
+# was not measured in a screen is NaN. The files are laid out screen by screen (one row of all genes per screen), so
+# a screen that is added is appended and a screen that is re-imported is overwritten in place; only a change of the
+# gene table requires a full rebuild. meta.json holds the gene ids of the columns, the screen ids and names of the rows,
+# the version of every screen (see datastore.py) the rows were built from and the version of the screen table, which
+# tells whether the set of IP screens and their names are still current.
+#
+# datastore.screens_changed() updates the matrix once an import has been committed, signals.py once a change to the
+# screens or the genes has been committed (the latter rebuilds it), the build_gene_matrix command builds it from scratch. Lookups of screens of which the row is missing or stale return None, callers then fall back
+# to the database.
+
+# Import other custom phenosaurus functions
+import globalvars as gv
+import datastore
+import geneindex
+import models as db
+
+# Other general libraries
+import numpy as np
+import threading
+import json
+import os
+
+
+matrix_version_key = 'genematrix'
+screens_version_key = 'screens'     # Bumped by signals.py whenever a screen is saved or deleted
+matrix_columns = ('logmi', 'fcpv')
+
+_matrix = None
+_lock = threading.Lock()
+_write_lock = threading.Lock()
+
+
+def matrix_dir():
+    return os.path.join(gv.datastore_dir, 'genematrix')
+
+def matrix_path(column):
+    return os.path.join(matrix_dir(), '%s.f32' % column)
+
+def meta_path():
+    return os.path.join(matrix_dir(), 'meta.json')
+
+
+def positions(sorted_ids, ids):
+    # The positions of ids in the sorted array sorted_ids, -1 for ids that are not in it
+    ids = np.asarray(ids, dtype=np.int64)
+    if not len(sorted_ids):
+        return np.full(len(ids), -1, dtype=np.int64)
+    pos = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return np.where(sorted_ids[pos] == ids, pos, -1)
+
+
+class GeneMatrix(object):
+    """Read-only view on the matrix files, with maps from gene and screen ids to positions."""
+
+    def __init__(self, meta, version):
+        self.version = version
+        self.genes_version = meta['genes_version']
+        self.screens_version = meta['screens_version']
+        self.gene_ids = np.array(meta['gene_ids'], dtype=np.int64)     # Sorted
+        self.screen_ids = list(meta['screen_ids'])
+        self.screen_versions = dict((int(i), v) for i, v in meta['screen_versions'].items())
+        self.screen_pos = dict((screenid, pos) for pos, screenid in enumerate(self.screen_ids))
+        self.screen_names = dict((int(i), name) for i, name in meta['screen_names'].items())
+        self._stale = None
+        shape = (len(self.screen_ids), len(self.gene_ids))
+        self.arrays = {}
+        for column in matrix_columns:
+            if shape[0] and shape[1]:
+                self.arrays[column] = np.memmap(matrix_path(column), dtype=np.float32, mode='r', shape=shape)
+            else:
+                self.arrays[column] = np.zeros(shape, dtype=np.float32)
+
+    def gene_positions(self, geneids):
+        # The columns of geneids, -1 for genes that are not in the matrix
+        return positions(self.gene_ids, geneids)
+
+    def stale_screens(self):
+        # The IP screens of which the row was not built from the current version of the screen. The versions of all
+        # screens are only read again after the datapoints marker has been bumped, the marker is read before them so a
+        # bump in between is noticed on the next call.
+        version = datastore.get_version(datastore.datapoints_version_key)
+        stale = self._stale
+        if stale is None or stale[0] != version:
+            stale = (version, frozenset(i for i in self.screen_names if self.screen_versions.get(i) != datastore.get_screen_version(i)))
+            self._stale = stale
+        return stale[1]
+
+    def is_fresh(self, screenids):
+        # True if the genes and screens have not changed since the matrix was built, and the rows of those of screenids
+        # that are IP screens were built from the current version of the screen
+        if self.genes_version != datastore.get_version(geneindex.gene_version_key):
+            return False
+        if self.screens_version != datastore.get_version(screens_version_key):
+            return False
+        stale = self.stale_screens()
+        return not any(int(i) in stale for i in screenids)
+
+    def lookup(self, geneids, screenids):
+        # Returns {'logmi': array, 'fcpv': array} of shape (len(geneids), number of IP screens in screenids), NaN where there
+        # is no datapoint, and under 'screen_ids' the IP screens of screenids in their order. None if the matrix is stale.
+        if not self.is_fresh(screenids):
+            return None
+        screenids = [int(i) for i in screenids if int(i) in self.screen_names]
+        gene_pos = self.gene_positions(geneids)
+        screen_pos = np.array([self.screen_pos[i] for i in screenids], dtype=np.int64)
+        result = {'screen_ids': screenids}
+        for column in matrix_columns:
+            values = np.full((len(gene_pos), len(screen_pos)), np.nan, dtype=np.float32)
+            known = gene_pos >= 0
+            if known.any() and len(screen_pos):
+                values[known] = self.arrays[column][np.ix_(screen_pos, gene_pos[known])].T
+            result[column] = values
+        return result
+
+
+def read_meta():
+    try:
+        with open(meta_path()) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+def get_gene_matrix():
+    # Returns the matrix of this worker, reopening the files if they have been updated, or None if it was never built
+    global _matrix
+    version = datastore.get_version(matrix_version_key)
+    matrix = _matrix
+    if matrix is None or matrix.version != version:
+        with _lock:
+            if _matrix is None or _matrix.version != version:
+                meta = read_meta()
+                _matrix = GeneMatrix(meta, version) if meta is not None else None
+            matrix = _matrix
+    return matrix
+
+
+##########################################################
+# Building and updating                                  #
+##########################################################
+
+def screen_row(screenid, gene_ids):
+    # The logmi and fcpv of all genes in one screen, read from the columnar store of the screen
+    columns = datastore.load_ips_columns(screenid)
+    pos = positions(gene_ids, columns['relgene_id'])
+    known = pos >= 0
+    row = {}
+    for column in matrix_columns:
+        values = np.full(len(gene_ids), np.nan, dtype=np.float32)
+        values[pos[known]] = columns[column][known]
+        row[column] = values
+    return row
+
+def ip_screen_names():
+    return dict(db.Screen.objects.filter(screentype='IP').values_list('id', 'name'))
+
+def write_meta(meta):
+    datastore._atomic_write(meta_path(), json.dumps(meta))
+    datastore.bump_version(matrix_version_key)
+
+def rebuild_gene_matrix(stdout=None):
+    # Builds the matrix of all IP screens from scratch
+    with _write_lock:
+        genes_version = datastore.get_version(geneindex.gene_version_key)
+        screens_version = datastore.get_version(screens_version_key)
+        gene_ids = np.sort(geneindex.get_gene_index().ids).astype(np.int64)
+        screen_names = ip_screen_names()
+        screenids = sorted(screen_names)
+        datastore._makedirs(matrix_dir())
+        tmp_paths = dict((column, '%s.%d.tmp' % (matrix_path(column), os.getpid())) for column in matrix_columns)
+        files = dict((column, open(tmp_paths[column], 'wb')) for column in matrix_columns)
+        versions = {}
+        try:
+            for i, screenid in enumerate(screenids):
+                versions[str(screenid)] = datastore.get_screen_version(screenid)
+                row = screen_row(screenid, gene_ids)
+                for column in matrix_columns:
+                    files[column].write(row[column].tobytes())
+                if stdout is not None:
+                    stdout.write('Screen %d of %d' % (i + 1, len(screenids)))
+        finally:
+            for f in files.values():
+                f.close()
+        for column in matrix_columns:
+            os.rename(tmp_paths[column], matrix_path(column))
+        write_meta({'genes_version': genes_version, 'screens_version': screens_version, 'gene_ids': gene_ids.tolist(),
+                    'screen_ids': screenids, 'screen_names': screen_names, 'screen_versions': versions})
+    return len(screenids)
+
+def update_gene_matrix(screenids=None):
+    # Appends the rows of new screens and overwrites those of changed screens of screenids (all IP screens if screenids
+    # is None or screens have been added or renamed since). Falls back to a full rebuild if the matrix does not exist
+    # yet or the genes have changed.
+    meta = read_meta()
+    if meta is None or meta['genes_version'] != datastore.get_version(geneindex.gene_version_key):
+        return rebuild_gene_matrix()
+    with _write_lock:
+        meta = read_meta()
+        gene_ids = np.array(meta['gene_ids'], dtype=np.int64)
+        screens_version = datastore.get_version(screens_version_key)
+        screen_names = ip_screen_names()
+        if screenids is None or meta['screens_version'] != screens_version:
+            screenids = screen_names
+        screenids = sorted(int(i) for i in screenids if int(i) in screen_names)
+        stale = [i for i in screenids if meta['screen_versions'].get(str(i)) != datastore.get_screen_version(i)]
+        if not stale and meta['screens_version'] == screens_version:
+            return 0
+        meta['screens_version'] = screens_version
+        meta['screen_names'] = screen_names
+        screen_pos = dict((screenid, pos) for pos, screenid in enumerate(meta['screen_ids']))
+        row_bytes = len(gene_ids) * np.dtype(np.float32).itemsize
+        for screenid in stale:
+            version = datastore.get_screen_version(screenid)
+            row = screen_row(screenid, gene_ids)
+            if screenid not in screen_pos:
+                screen_pos[screenid] = len(meta['screen_ids'])
+                meta['screen_ids'].append(screenid)
+            # Rows are written at their offset rather than appended, so a row left behind by an interrupted update
+            # (which meta.json does not know about) is simply overwritten
+            for column in matrix_columns:
+                with open(matrix_path(column), 'r+b') as f:
+                    f.seek(screen_pos[screenid] * row_bytes)
+                    f.write(row[column].tobytes())
+            meta['screen_versions'][str(screenid)] = version
+        write_meta(meta)
+    return len(stale)
@@ -1,5 +1,6 @@
 import pandas as pd
-from bokeh.palettes import Blues9, Reds9
+from bokeh.palettes import Blues9, Reds9, RdBu11
+import os
 
 # A bunch of global statics
 #----------------------------
@@ -15,6 +16,10 @@ public_group_id = 1
 # The maximum number of geneplots for a single request
 max_geneplots = 50
 
+# The number of 'did you mean' suggestions per unknown gene and the minimal similarity (0-1) of a suggestion
+max_gene_suggestions = 5
+min_gene_suggestion_score = 0.3
+
 # Available text sizes
 text_sizes = ['8px', '9px', '10px', '11px', '12px', '13px', '14px', '15px', '16px', '17px', '18px', '19px', '20px']
 
@@ -28,6 +33,9 @@ color_st = '#FEC026'
 # The color of significant hit on the bottom of the graph
 color_sb = '#4C86C6'
 
+# The colors of a fishtail plot indexed by category code (0: not significant, 1: bottom, 2: top), see binarydata.py
+fishtail_palette = [color_ns, color_sb, color_st]
+
 # The color of the 'low' channel reads
 color_low_rr = '#a00808' # Raw reads
 color_low_ur = '#ff6666' # Unique reads
@@ -64,7 +72,16 @@ bubbleplotheight=900
 pss_color_s = '#B4045F'
 pss_color_ns = '#BDBDBD'
 
+# The diameter (px) of the bubbles of the bubble plot ranges from pss_min_dotsize to pss_max_dotsize, the surface of a
+# bubble scales with the number of insertions (nm). -log(p) is capped at pss_min_logp, which keeps genes with a p-value
+# of 1 on a log scaled y-axis. Labels are placed pss_label_margin px to the right of a bubble.
+pss_min_dotsize = 4
+pss_max_dotsize = 40
+pss_min_logp = 0.01
+pss_label_margin = 2
+
 standard_text_size = '12px'
+initial_text_size = '11px'     # The text size the forms start with, and the one of the snapshots (see snapshots.py)
 
 small_geneplot_width = 800
 normal_geneplot_width = 1440
@@ -75,15 +92,85 @@ max_graphs = 50
 
 publicuser = 'public'
 
+# The directory in which the columnar stores of the screens and the version markers are kept
+datastore_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'datastore')
+
+# The maximum number of rendered fishtail plots each worker keeps in memory, and the maximal total size (bytes) of
+# their scripts and tables, as the script of a screen of 20k genes alone takes several MB. The same for the packed
+# datapoints that the browser loads separately, and for bubble plots.
+fishtail_cache_size = 64
+fishtail_cache_bytes = 64 * 1024 * 1024
+fishtail_data_cache_bytes = 32 * 1024 * 1024
+bubble_cache_size = 32
+bubble_cache_bytes = 32 * 1024 * 1024
+
+# Level of detail of fishtail plots: if more non-significant genes than lod_max_points are in view they are drawn as
+# a density layer of lod_bins (x, y) cells instead of as individual points. Significant genes are always points.
+lod_max_points = 2000
+lod_bins = (120, 80)
+# The number of screens of which the arrays for the level of detail are kept in memory per worker
+fishtail_arrays_cache_size = 32
+fishtail_arrays_cache_bytes = 64 * 1024 * 1024
+
+# The size (bytes) and number of backups of the rotating log of request timings (see timing.py)
+timing_log_max_bytes = 10 * 1024 * 1024
+timing_log_backups = 5
+
+# The number of custom tracks of which the gene ids are kept in memory per worker
+track_cache_size = 256
+
+# The diameter (px) of the ring around the genes of the first custom track drawn on a fishtail plot, every next track
+# gets a ring track_ring_step px larger
+track_ring_size = 9
+track_ring_step = 4
+
+# The number of lanes of the gene track below region plots
+region_lanes = 3
+
+# Correlations of screens (see correlations.py) are computed for correlation_row_block screens at a time against all
+# screens, over correlation_gene_block genes at a time. Pairs of screens that share fewer than correlation_min_shared
+# measured genes have no correlation. The page of a screen lists its correlation_top_n most similar screens.
+correlation_row_block = 64
+correlation_gene_block = 4096
+correlation_min_shared = 100
+correlation_top_n = 20
+
+# Neighbours of a gene (see neighbours.py): the number of genes returned (by default and at most), the number of genes
+# per block of the search and the minimal number of screens in which both genes must have been measured
+neighbour_top_k = 20
+neighbour_max_k = 200
+neighbour_block = 4096
+neighbour_min_shared = 10
+
+# The number of datapoints written per chunk by the streaming export (see export.py)
+export_chunk_rows = 5000
+
+# The number of genes per page of the gene catalogue (default and maximum) and the number of pages cached per worker
+gene_page_size = 100
+max_gene_page_size = 1000
+gene_page_cache_size = 128
+
 # Make sure both color palelletes are of the same length!
 unique_finder_arrow_less_sign = pd.Series(Blues9[::-1])
 unique_finder_arrow_more_sign = pd.Series(Reds9[::-1])
 minimal_logmi_difference = 1.5
 
+# The colors of the correlation heatmap, from -1 to 1
+correlation_palette = RdBu11
+
 #
 # Error messages
 #
 coloroverlay_mi_error= 'Please select only 1 screen to compare against in the color-overlay and MI-arrows function'
+uniquefinder_no_data = 'The selected screen holds no datapoints'
+bubbleplot_no_data = 'The selected screen holds no datapoints'
+lod_window_error = 'The window of a level of detail request must be four finite numbers x0 < x1 and y0 < y1'
+region_error = 'Please give a region as chromosome:start-end, eg. chr7:100,000,000-101,000,000'
+region_no_genes = 'There are no genes in this region'
+correlations_missing = 'The correlations of the screens have not been computed yet, run the build_correlations command'
+neighbours_missing = 'Similar genes can not be searched until the gene matrix has been built, run the build_gene_matrix command'
+neighbours_unknown_gene = 'Unknown gene'
+export_parquet_error = 'Exporting to Parquet requires pyarrow, which is not installed on this server'
 max_graphs_warning = 'Go draw your own plots, I am not drawing more than 50 plots on one page!'
 formerror = "<i>Please fill in all required fields of the form</i>"
 failed_track_upload = 'Failed to store your track, please check the input forms'
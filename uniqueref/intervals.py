@@ -0,0 +1,105 @@
+# A process-wide, in-memory interval index of the genomic locations of the genes
+#
+# A region query ("which genes lie in chr7:100,000,000-101,000,000") is answered from per-chromosome arrays of the
+# locations sorted on their start, plus the length of the longest location of the chromosome. Every location that
+# overlaps [start, end] starts at or before end and at or after start - longest, so two binary searches bound the
+# candidates and a vectorised comparison of their ends keeps the overlapping ones. Each worker builds the index once
+# and rebuilds it when the 'locations' or the 'genes' version marker (see datastore.py) has been bumped.
+
+# Import other custom phenosaurus functions
+import datastore
+import geneindex
+import models as db
+
+# Other general libraries
+import numpy as np
+import threading
+import re
+
+
+location_version_key = 'locations'
+
+region_pattern = re.compile(r'^\s*(?:chr)?([0-9XYMxym]{1,2})\s*[:\s]\s*([0-9,]+)\s*-\s*([0-9,]+)\s*$')
+
+
+def parse_region(region):
+    # 'chr7:100,000,000-101,000,000' -> ('7', 100000000, 101000000), raises ValueError if it is not a region
+    match = region_pattern.match(region or '')
+    if match is None:
+        raise ValueError('Not a genomic region: %r' % region)
+    chromosome = match.group(1).upper()
+    start, end = (int(match.group(i).replace(',', '')) for i in (2, 3))
+    if end < start:
+        start, end = end, start
+    return chromosome, start, end
+
+
+class ChromosomeIntervals(object):
+    """The locations on one chromosome as arrays sorted on their start."""
+
+    def __init__(self, geneids, starts, ends):
+        order = np.argsort(starts, kind='mergesort')
+        self.geneids = geneids[order]
+        self.starts = starts[order]
+        self.ends = ends[order]
+        self.longest = int((self.ends - self.starts).max()) if len(order) else 0
+
+    def overlapping(self, start, end):
+        # The positions (in the sorted arrays) of the locations that overlap [start, end]
+        lo = np.searchsorted(self.starts, start - self.longest, side='left')
+        hi = np.searchsorted(self.starts, end, side='right')
+        return lo + np.nonzero(self.ends[lo:hi] >= start)[0]
+
+
+class IntervalIndex(object):
+    """One ChromosomeIntervals per chromosome."""
+
+    def __init__(self, version):
+        self.version = version
+        rows = np.array(list(db.Location.objects.values_list('relgene_id', 'startpos', 'endpos')), dtype=np.int64).reshape(-1, 3)
+        gene_index = geneindex.get_gene_index()
+        chromosome_of = dict(zip(gene_index.ids, gene_index.df['chromosome'].values))
+        chromosomes = np.array([chromosome_of.get(i, '') for i in rows[:, 0]], dtype=object)
+        # Some locations are stored with their end before their start (genes on the reverse strand)
+        starts = np.minimum(rows[:, 1], rows[:, 2])
+        ends = np.maximum(rows[:, 1], rows[:, 2])
+        self.chromosomes = {}
+        for chromosome in set(chromosomes) - set(['']):
+            on_chromosome = chromosomes == chromosome
+            self.chromosomes[str(chromosome).upper()] = ChromosomeIntervals(rows[on_chromosome, 0], starts[on_chromosome], ends[on_chromosome])
+
+    def query(self, chromosome, start, end):
+        # Returns (geneids, starts, ends) of the locations that overlap the region, sorted on start. A gene with several
+        # locations in the region is returned once, with the outer bounds of those locations.
+        intervals = self.chromosomes.get(str(chromosome).upper())
+        if intervals is None:
+            empty = np.array([], dtype=np.int64)
+            return empty, empty, empty
+        pos = intervals.overlapping(start, end)
+        geneids, inverse = np.unique(intervals.geneids[pos], return_inverse=True)
+        starts = np.full(len(geneids), np.iinfo(np.int64).max, dtype=np.int64)
+        ends = np.zeros(len(geneids), dtype=np.int64)
+        np.minimum.at(starts, inverse, intervals.starts[pos])
+        np.maximum.at(ends, inverse, intervals.ends[pos])
+        order = np.argsort(starts, kind='mergesort')
+        return geneids[order], starts[order], ends[order]
+
+
+_index = None
+_lock = threading.Lock()
+
+def get_interval_index():
+    # Returns the index of this worker, rebuilding it if the locations or the genes have changed since it was built
+    global _index
+    version = (datastore.get_version(location_version_key), datastore.get_version(geneindex.gene_version_key))
+    index = _index
+    if index is None or index.version != version:
+        with _lock:
+            if _index is None or _index.version != version:
+                _index = IntervalIndex(version)
+            index = _index
+    return index
+
+def locations_changed():
+    # Call this after locations have been added, changed or removed
+    datastore.bump_version(location_version_key)
@@ -1,96 +1,195 @@
-from bokeh.plotting import figure, output_file, show, vplot
-from bokeh.models.widgets import Select
-from bokeh.models import HoverTool, TapTool, OpenURL, Circle, Text, CustomJS, FixedTicker, ColumnDataSource
+# Unique hit finder for intracellular phenotype screens
+#
+# Compares one IP screen (the query) against a chosen set of other IP screens. A gene is a unique hit if it is
+# significant in the query screen but not, in the same direction, in any of the others. Independent of significance,
+# a gene is shifted if its logmi in the query differs by at least the minimal logmi difference from its mean logmi in
+# the others; shifts are drawn as arrows from the mean of the others to the query. All screens are aligned on the genes
+# of the query screen, so everything is computed in a single vectorised pass over (screens x genes) arrays.
+
+# Import Bokeh related libraries and functions
+from bokeh.plotting import figure
+from bokeh.models import HoverTool, TapTool, OpenURL, Circle, CustomJS, ColumnDataSource
+from bokeh.layouts import row
 from bokeh.resources import CDN
 from bokeh.embed import components
+
+# Import other custom phenosaurus functions
+import globalvars as gv
+import datastore
+import timing
+from geneindex import get_gene_index
+from genematrix import positions
+
+# Other general libraries
 import pandas as pd
 import numpy as np
-from django.contrib.auth.decorators import login_required
-import operator
-from math import pi
-from globalvars import *
-import math
-
-def pipsuniquefinder(title, df, sag, oca, textsize):
-
-		TOOLS = "resize,hover,save,pan,wheel_zoom,box_zoom,reset,tap"
-		
-		# Determine the min and max values for the y-axis on the plot. This still needs to be specific for a screen and/or gene. Now all datapoints throughout all screen are taken into account
-		max_y = Datapoint.objects.all().aggregate(Max('mi'))
-		min_y = Datapoint.objects.all().aggregate(Min('mi'))
-		log_max_y = np.log2(max_y.values()[0]) 
-		log_min_y = np.log2(min_y.values()[0])
-		 
-		p = figure(
-			width=1275,
-			height=900,
-			y_range=(-10,10),
-			x_range=(0, 5),
-			tools=[TOOLS],
-            title=title,
-			webgl=True,
-			x_axis_label = "Insertions [10log]",
-			y_axis_label = "Mutational index [2log]",
-			)		
-	
-		hover = p.select(type=HoverTool)
-		
-		# And the build the source
-		source = ColumnDataSource(data=merged)	
-		columns = ['loginsertions', 'logmi', 'name']
-		df_text = pd.DataFrame(columns=columns)
-		textsource = ColumnDataSource(data=df_text)
-	
-		# We want the toolbar on the right side
-		p.toolbar_location = "below"
-		p.outline_line_width = 3
-		p.outline_line_alpha = 1
-		p.outline_line_color = "black"
-		p.text('loginsertions', 'logmi', text='name', text_color='black', source=textsource)
-		initial_view = Circle(x='loginsertions', y='logmi', fill_color='highlightcolor', fill_alpha=1, line_color='highlightcolor')
-		
-		if oca == "hah":	
-			selected_circle = Circle(fill_color='highlightcolor', line_color='highlightcolor', fill_alpha=1, line_alpha=1)
-			nonselected_circle = Circle(fill_color='highlightcolor', line_color='highlightcolor', fill_alpha=transp_nsel_f, line_alpha=transp_nsel_l)
-			p.add_glyph(
-		  		source,
-		  		initial_view,
-		  		selection_glyph=selected_circle,
-  				nonselection_glyph=nonselected_circle
-			)
-	
-			source.callback = CustomJS(args=dict(textsource=textsource), code="""
-		        	var inds = cb_obj.get('selected')['1d'].indices;
-		        	var d1 = cb_obj.get('data');
-		        	var d2 = textsource.get('data');
-		        	d2['loginsertions'] = []
-		        	d2['logmi'] = []
-				d2['name'] = []	
-		        	for (i = 0; i < inds.length; i++) {
-		            		d2['loginsertions'].push(d1['loginsertions'][inds[i]])
-		            		d2['logmi'].push(d1['logmi'][inds[i]])
-					d2['name'].push(d1['name'][inds[i]])
-		        	}
-		        	textsource.trigger('change');
-			""")
-
-		hover.tooltips = [
-            ('P-Value', '@fcpv'),
-            ('Gene', '@name'),
-            ('Screen', '@relscreen'),
-            ]
-		
-		elif oca == "gc":
-			selected_circle = initial_view
-			nonselected_circle = initial_view
-			p.add_glyph(
-				source,
-				initial_view,
-				selection_glyph=selected_circle,
-				nonselection_glyph=nonselected_circle
-			)
-			url = "http://www.genecards.org/cgi-bin/carddisp.pl?gene=@relgene_id"
-			taptool = p.select(type=TapTool)
-			taptool.callback = OpenURL(url=url)
-
-	        p.line([0, 120],[0, 0], line_width=2, line_color="black")
\ No newline at end of file
+
+
+##########################################################
+# 1. The engine                                          #
+##########################################################
+
+def align_screens(query_screenid, other_screenids):
+    # The columns of the query screen and the logmi and fcpv of the other screens as (screens x genes) arrays aligned on
+    # the genes of the query screen, NaN where a gene was not measured in another screen
+    query = datastore.load_ips_columns(query_screenid)
+    genes = query['relgene_id']     # The stores are sorted on relgene_id
+    logmi = np.full((len(other_screenids), len(genes)), np.nan)
+    fcpv = np.full((len(other_screenids), len(genes)), np.nan)
+    for i, screenid in enumerate(other_screenids):
+        other = datastore.load_ips_columns(screenid)
+        pos = positions(other['relgene_id'], genes)
+        known = pos >= 0
+        logmi[i, known] = other['logmi'][pos[known]]
+        fcpv[i, known] = other['fcpv'][pos[known]]
+    return query, logmi, fcpv
+
+def find_unique_hits(query, other_logmi, other_fcpv, pvcutoff, min_difference=gv.minimal_logmi_difference):
+    # Returns a DataFrame with a row per gene of the query screen
+    sig_query = query['fcpv'] <= pvcutoff
+    direction = np.sign(query['logmi'])
+    with np.errstate(invalid='ignore'):
+        # Significant in another screen with the same sign of logmi (NaN compares False)
+        sig_others = (other_fcpv <= pvcutoff) & (np.sign(other_logmi) == direction)
+    n_sig_others = sig_others.sum(axis=0)
+    n_others = (~np.isnan(other_logmi)).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_other_logmi = np.nansum(other_logmi, axis=0) / n_others    # NaN for genes absent from all other screens
+    difference = query['logmi'] - mean_other_logmi
+    with np.errstate(invalid='ignore'):
+        shifted = np.abs(difference) >= min_difference
+
+    gene_index = get_gene_index()
+    df = pd.DataFrame({
+        'relgene': pd.Series(query['relgene_id']).map(gene_index.id_to_name).values,
+        'loginsertions': query['loginsertions'],
+        'logmi': query['logmi'],
+        'fcpv': query['fcpv'],
+        'signclass': query['signclass'],
+        'n_sig_others': n_sig_others,
+        'mean_other_logmi': mean_other_logmi,
+        'difference': difference,
+        'unique': sig_query & (n_sig_others == 0),
+        'shifted': shifted,
+    })
+    return df[df['relgene'].notnull()].reset_index(drop=True)
+
+def arrow_colors(difference, min_difference=gv.minimal_logmi_difference):
+    # Darker arrows for larger differences, red for increases and blue for decreases of logmi in the query screen
+    palette_size = len(gv.unique_finder_arrow_more_sign)
+    magnitude = np.abs(difference)
+    top = np.nanmax(magnitude) if len(magnitude) else min_difference
+    bins = np.linspace(min_difference, max(top, min_difference), palette_size + 1)[1:-1]
+    index = np.digitize(magnitude, bins)
+    return np.where(difference > 0, gv.unique_finder_arrow_more_sign.values[index], gv.unique_finder_arrow_less_sign.values[index])
+
+def generate_df_uniquefinder(query_screenid, other_screenids, pvcutoff, min_difference, authorized_screens):
+    # The genes of the query screen with their colors and, for shifted genes, the arrows. Screens the user may not see
+    # are left out.
+    other_screenids = [int(i) for i in other_screenids if int(i) in authorized_screens and int(i) != int(query_screenid)]
+    if int(query_screenid) not in authorized_screens:
+        return pd.DataFrame(), pd.DataFrame()
+    with timing.span('store'):
+        query, other_logmi, other_fcpv = align_screens(query_screenid, other_screenids)
+    with timing.span('pandas'):
+        df = find_unique_hits(query, other_logmi, other_fcpv, pvcutoff, min_difference)
+        df['color'] = np.where(df['unique'], np.take(gv.fishtail_palette, df['signclass'].values.astype(int)), gv.color_ns)
+        df['signame'] = np.where(df['unique'], df['relgene'], "")
+        df_arrows = df[df['shifted']].copy()
+        df_arrows['arrowcolor'] = arrow_colors(df_arrows['difference'].values, min_difference)
+    return df, df_arrows
+
+def generate_uniquefinder_table(df):
+    # HTML table of the unique hits, sorted on logmi
+    df_top = df[df['unique']][['relgene', 'fcpv', 'logmi', 'mean_other_logmi']].sort_values(by='logmi')
+    df_top.rename(columns={'logmi': 'log2(MI)', 'mean_other_logmi': 'mean log2(MI) other screens'}, inplace=True)
+    df_top['relgene'] = '<a href=\"' + gv.ucsc_link + df_top['relgene'].map(get_gene_index().name_to_symbol) + '\"' + 'target=\"_blank\"' + '>' + df_top['relgene'] + '</a>'
+    with pd.option_context('display.max_colwidth', -1):
+        return df_top.to_html(index=False, justify='left', escape=False)
+
+
+##########################################################
+# 2. The plot                                            #
+##########################################################
+
+def finite_max(values, default):
+    # The largest finite value if it is positive, otherwise default
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    return values.max() if len(values) and values.max() > 0 else default
+
+@timing.timed('bokeh')
+def pipsuniquefinder(title, df, df_arrows, oca, textsize, setwidth=1000, setheight=700):
+
+    TOOLS = "resize,hover,save,pan,wheel_zoom,box_zoom,reset,tap"
+
+    # Symmetric y-axis around 0 that includes the starting points of the arrows. Without any finite values (eg. a screen
+    # without datapoints) both axes run to 1 and the plot is merely empty.
+    absmax = finite_max(np.abs(np.concatenate([df['logmi'].values, df_arrows['mean_other_logmi'].values])), 1)
+    max_x = finite_max(df['loginsertions'].values, 1) * 1.05
+
+    p = figure(
+        width=setwidth,
+        height=setheight,
+        y_range=(-1.1*absmax, 1.1*absmax),
+        x_range=(0, max_x),
+        tools=[TOOLS],
+        title=title,
+        webgl=True,
+        x_axis_label = "Insertions [10log]",
+        y_axis_label = "Mutational index [2log]"
+    )
+    p.toolbar_location = 'below'
+    p.outline_line_width = 3
+    p.outline_line_alpha = 1
+    p.outline_line_color = "black"
+    p.line([0, 120],[0, 0], line_width=2, line_color="black")
+
+    # The arrows from the mean logmi in the other screens to the logmi in the query screen
+    arrowsource = ColumnDataSource(df_arrows[['loginsertions', 'logmi', 'mean_other_logmi', 'arrowcolor']])
+    p.segment('loginsertions', 'mean_other_logmi', 'loginsertions', 'logmi', line_color='arrowcolor', line_width=2, source=arrowsource)
+    p.circle('loginsertions', 'mean_other_logmi', fill_color=None, line_color='arrowcolor', size=4, source=arrowsource)
+
+    source = ColumnDataSource(df[['loginsertions', 'logmi', 'fcpv', 'relgene', 'color', 'n_sig_others', 'mean_other_logmi']])
+    sagtextsource = ColumnDataSource(df[df['signame'] != ""][['loginsertions', 'logmi', 'signame']])
+    p.text('loginsertions', 'logmi', text='signame', text_color='black', text_font_size=textsize, source=sagtextsource)
+    initial_view = Circle(x='loginsertions', y='logmi', fill_color='color', fill_alpha=1, line_color='color', size=5, line_width=1)
+    if oca == "hah":
+        selected_circle = Circle(fill_color='black', line_color='black', fill_alpha=1, line_alpha=1, size=5, line_width=1)
+        nonselected_circle = Circle(fill_color='color', line_color='color', fill_alpha=gv.transp_nsel_f, line_alpha=gv.transp_nsel_l, size=5, line_width=1)
+        textsource = ColumnDataSource(data=dict(loginsertions=[], logmi=[], relgene=[]))
+        p.text('loginsertions', 'logmi', text='relgene', text_color='black', text_font_size=textsize, source=textsource)
+        source.callback = CustomJS(args=dict(textsource=textsource), code="""
+            var inds = cb_obj.get('selected')['1d'].indices;
+            var d1 = cb_obj.get('data');
+            var d2 = textsource.get('data');
+            d2['loginsertions'] = []
+            d2['logmi'] = []
+            d2['relgene'] = []
+            for (i = 0; i < inds.length; i++) {
+                d2['loginsertions'].push(d1['loginsertions'][inds[i]])
+                d2['logmi'].push(d1['logmi'][inds[i]])
+                d2['relgene'].push(d1['relgene'][inds[i]])
+            }
+            textsource.trigger('change');
+        """)
+    else:
+        selected_circle = initial_view
+        nonselected_circle = initial_view
+        taptool = p.select(type=TapTool)
+        taptool.callback = OpenURL(url="http://www.genecards.org/cgi-bin/carddisp.pl?gene=@relgene")
+    renderer = p.add_glyph(source, initial_view, selection_glyph=selected_circle, nonselection_glyph=nonselected_circle)
+
+    hover = p.select(type=HoverTool)
+    hover.renderers = [renderer]
+    hover.tooltips = [
+        ('P-Value', '@fcpv'),
+        ('Gene', '@relgene'),
+        ('Significant in # other screens', '@n_sig_others'),
+        ('Mean log(MI) other screens', '@mean_other_logmi'),
+    ]
+
+    r = row(children=[p], responsive=True)
+    with timing.span('components'):
+        script, div = components(r, CDN)
+    return script, div
@@ -0,0 +1,49 @@
+# Fill the derived columns (loginsertions, logmi and signclass) of IPS datapoints imported before they existed
+#
+# The columns are computed per screen in a single vectorised pass and written back with one executemany per screen.
+# Afterwards the versions of the screens are bumped so the columnar stores and plot caches are rebuilt.
+#
+# Usage: python manage.py backfill_derived_columns [--screen 12 --screen 13] [--all]
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+# Import other custom phenosaurus functions
+from uniqueref import models as db
+from uniqueref import datastore
+
+
+class Command(BaseCommand):
+    help = 'Compute loginsertions, logmi and signclass of IPS datapoints that lack them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--screen', dest='screens', type=int, action='append', default=None,
+                            help='Only backfill this screen (id), may be given more than once')
+        parser.add_argument('--all', action='store_true', dest='all', default=False,
+                            help='Recompute the columns of all datapoints, not only of those that lack them')
+
+    def handle(self, *args, **options):
+        datapoints = db.IPSDatapoint.objects.all()
+        if not options['all']:
+            datapoints = datapoints.filter(logmi__isnull=True)
+        if options['screens']:
+            datapoints = datapoints.filter(relscreen_id__in=options['screens'])
+        screenids = sorted(set(datapoints.values_list('relscreen_id', flat=True)))
+
+        table = connection.ops.quote_name(db.IPSDatapoint._meta.db_table)
+        sql = 'UPDATE %s SET %s WHERE id = %%s' % (
+            table, ', '.join('%s = %%s' % connection.ops.quote_name(name) for name in datastore.ips_derived_columns))
+        updated = 0
+        for i, screenid in enumerate(screenids):
+            rows = list(datapoints.filter(relscreen_id=screenid).values_list('id', 'insertions', 'mi'))
+            ids, insertions, mi = zip(*rows)
+            derived = datastore.derive_ips_columns(insertions, mi)
+            columns = [[None if value != value else value for value in derived[name].tolist()]   # NaN is stored as NULL
+                       for name in datastore.ips_derived_columns]
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.executemany(sql, zip(*(columns + [list(ids)])))
+                datastore.screens_changed([screenid])
+            updated += len(rows)
+            self.stdout.write('Screen %d (%d of %d): %d datapoints' % (screenid, i + 1, len(screenids), len(rows)))
+        self.stdout.write(self.style.SUCCESS('Backfilled %d datapoints of %d screen(s)' % (updated, len(screenids))))
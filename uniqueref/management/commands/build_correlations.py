@@ -0,0 +1,27 @@
+# Compute the correlations of all IP screens (see correlations.py) from the gene matrix
+#
+# Importers keep the correlations up to date once they exist, run this command once after deployment or to repair them.
+# The gene matrix is brought up to date first.
+#
+# Usage: python manage.py build_correlations [--update]
+
+from django.core.management.base import BaseCommand, CommandError
+
+# Import other custom phenosaurus functions
+from uniqueref import genematrix
+from uniqueref import correlations
+
+
+class Command(BaseCommand):
+    help = 'Compute the pairwise correlations of the logmi of all IP screens'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--update', action='store_true', dest='update', default=False,
+                            help='Only recompute the rows and columns of new and changed screens')
+
+    def handle(self, *args, **options):
+        genematrix.update_gene_matrix()
+        n = correlations.update_correlations(full=not options['update'], stdout=self.stdout)
+        if n is None:
+            raise CommandError('The gene matrix is stale, run build_gene_matrix first')
+        self.stdout.write(self.style.SUCCESS('Computed the correlations of %d screen(s)' % n))
@@ -0,0 +1,30 @@
+# Build the gene x screen matrix of logmi and fcpv (see genematrix.py) from the columnar stores of all IP screens
+#
+# The normalised matrix for the search of similar genes (see neighbours.py) is built from it as well.
+# Importers keep both up to date, run this command once after deployment or to repair the matrix.
+#
+# Usage: python manage.py build_gene_matrix [--update]
+
+from django.core.management.base import BaseCommand
+
+# Import other custom phenosaurus functions
+from uniqueref import genematrix
+from uniqueref import neighbours
+
+
+class Command(BaseCommand):
+    help = 'Build the gene x screen matrix used for lookups across screens'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--update', action='store_true', dest='update', default=False,
+                            help='Only (re)write the rows of new and changed screens instead of rebuilding the matrix')
+
+    def handle(self, *args, **options):
+        if options['update']:
+            n = genematrix.update_gene_matrix()
+            self.stdout.write(self.style.SUCCESS('Updated the rows of %d screen(s)' % n))
+        else:
+            n = genematrix.rebuild_gene_matrix(stdout=self.stdout)
+            self.stdout.write(self.style.SUCCESS('Built the gene matrix of %d screen(s)' % n))
+        if neighbours.update_neighbour_matrix():
+            self.stdout.write(self.style.SUCCESS('Built the normalised matrix for the search of similar genes'))
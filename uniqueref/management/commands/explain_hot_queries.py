@@ -0,0 +1,85 @@
+# EXPLAIN the queries that are executed on the hot paths of Phenosaurus and flag sequential scans
+#
+# Usage: python manage.py explain_hot_queries [--screen <id>] [--genes "EZH2 SUZ12"] [--fail-on-seqscan]
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+# Import other custom phenosaurus functions
+from uniqueref import custom_functions as cf
+from uniqueref import globalvars as gv
+from uniqueref import models as db
+from uniqueref import datastore
+from uniqueref.geneindex import get_gene_index
+
+# Other general libraries
+import re
+
+
+# Per database vendor: the EXPLAIN statement and a pattern matching the lines of a plan that denote a sequential scan
+explain_syntax = {
+    'postgresql': ('EXPLAIN', re.compile(r'Seq Scan on (\w+)')),
+    'sqlite': ('EXPLAIN QUERY PLAN', re.compile(r'SCAN (?:TABLE )?(\w+)(?!.*USING (?:COVERING )?INDEX)')),
+}
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the hot queries of custom_functions and flag any sequential scans over the datapoint tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--screen', dest='screen', type=int, default=None,
+                            help='The screen to use in the queries, by default the first authorized IP screen')
+        parser.add_argument('--genes', dest='genes', default='',
+                            help='Space separated genes to use in the gene plot query, by default the first 10 genes')
+        parser.add_argument('--fail-on-seqscan', action='store_true', dest='fail', default=False,
+                            help='Exit with an error if a sequential scan over a datapoint table is found')
+
+    def hot_queries(self, options):
+        authorized_screens = list(cf.get_authorized_screens_from_gids([gv.public_group_id]))
+        screenid = options['screen']
+        if screenid is None:
+            screenids = cf.get_authorized_screens_from_gids([gv.public_group_id]).of_type('IP')[:1]
+            if not screenids:
+                raise CommandError('There are no authorized IP screens, use --screen to pick one')
+            screenid = screenids[0]
+        gene_index = get_gene_index()
+        genes = options['genes'].split() or gene_index.names[:10].tolist()
+        geneids = gene_index.get_ids(genes)
+        # The access paths: a screen alone, a screen plus genes (the unique (relscreen, relgene) index) and genes plus a
+        # set of screens (the covering (relgene, relscreen, ...) index)
+        return [
+            ('fishtail store (re)build', datastore.ips_store_queryset(screenid)),
+            ('genes in one screen', cf.authorized_qs_geneplot(authorized_screens, geneids, [screenid])),
+            ('gene plot', cf.authorized_qs_geneplot(authorized_screens, geneids, authorized_screens)),
+        ]
+
+    def handle(self, *args, **options):
+        try:
+            explain, seqscan = explain_syntax[connection.vendor]
+        except KeyError:
+            raise CommandError('Do not know how to EXPLAIN queries on %s' % connection.vendor)
+        datapoint_tables = set([db.IPSDatapoint._meta.db_table, db.PSSDatapoint._meta.db_table])
+
+        flagged = []
+        for name, qs in self.hot_queries(options):
+            sql, params = qs.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute('%s %s' % (explain, sql), params)
+                plan = [' '.join(str(col) for col in row) for row in cursor.fetchall()]
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for line in plan:
+                self.stdout.write('    %s' % line)
+            tables = [m.group(1) for m in (seqscan.search(line) for line in plan) if m]
+            for table in tables:
+                if table in datapoint_tables:
+                    flagged.append((name, table))
+                    self.stdout.write(self.style.ERROR('    sequential scan on %s' % table))
+                else:
+                    self.stdout.write(self.style.WARNING('    sequential scan on %s (small table)' % table))
+
+        if flagged:
+            message = 'Sequential scans over datapoint tables in: %s' % ', '.join('%s (%s)' % f for f in flagged)
+            if options['fail']:
+                raise CommandError(message)
+            self.stderr.write(message)
+        else:
+            self.stdout.write(self.style.SUCCESS('No sequential scans over datapoint tables'))
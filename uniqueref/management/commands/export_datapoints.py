@@ -0,0 +1,52 @@
+# Stream the datapoints of IPS or PSS screens to a CSV, TSV or Parquet file
+#
+# The rows are read screen by screen with a server-side cursor and written in chunks (see export.py), so memory stays
+# flat even when all screens are exported. The file can be read back with import_datapoints.
+#
+# Usage: python manage.py export_datapoints <file> --type ips [--format tsv] [--screen 12 --screen 13]
+
+from django.core.management.base import BaseCommand, CommandError
+
+# Import other custom phenosaurus functions
+from uniqueref import models as db
+from uniqueref import export
+
+# Other general libraries
+import sys
+
+
+class Command(BaseCommand):
+    help = 'Export the datapoints of one or more screens (all screens of the type by default) without loading them into memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to write, use '-' to write to stdout")
+        parser.add_argument('--type', dest='type', choices=sorted(export.export_models), default='ips',
+                            help='The type of screens to export')
+        parser.add_argument('--format', dest='format', choices=sorted(export.export_formats), default=None,
+                            help='File format, by default derived from the extension of the file (csv if unknown)')
+        parser.add_argument('--screen', dest='screens', type=int, action='append', default=None,
+                            help='Only export this screen (id), may be given more than once')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format']
+        if fmt is None:
+            extension = path.rsplit('.', 1)[-1].lower()
+            fmt = extension if extension in export.export_formats else 'csv'
+        if fmt not in export.available_formats():
+            raise CommandError('Exporting to Parquet requires pyarrow')
+        screenids = options['screens']
+        if screenids is None:
+            screenids = db.Screen.objects.filter(screentype=export.export_screentypes[options['type']]).values_list('id', flat=True)
+
+        f = sys.stdout if path == '-' else open(path, 'wb')
+        written = 0
+        try:
+            for data in export.iter_export(options['type'], screenids, fmt):
+                f.write(data)
+                written += len(data)
+        finally:
+            if f is not sys.stdout:
+                f.close()
+        if path != '-':
+            self.stdout.write(self.style.SUCCESS('Wrote %d bytes to %s' % (written, path)))
@@ -0,0 +1,31 @@
+# Fill the (scratch!) database with reproducible synthetic genes, screens and datapoints for benchmarking
+#
+# Usage: python manage.py generate_synthetic_data --screens 200 --genes 20000 [--pss-screens 10] [--tracks 10] [--seed 0] [--remove]
+
+from django.core.management.base import BaseCommand
+
+# Import other custom phenosaurus functions
+from uniqueref import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Generate synthetic genes, screens and IPS/PSS datapoints at a configurable scale'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--screens', dest='screens', type=int, default=200, help='Number of IP screens')
+        parser.add_argument('--pss-screens', dest='pss_screens', type=int, default=0, help='Number of PS screens')
+        parser.add_argument('--genes', dest='genes', type=int, default=20000, help='Number of genes')
+        parser.add_argument('--tracks', dest='tracks', type=int, default=10, help='Number of custom tracks')
+        parser.add_argument('--seed', dest='seed', type=int, default=0, help='Seed of the random generator')
+        parser.add_argument('--remove', action='store_true', dest='remove', default=False,
+                            help='Remove previously generated synthetic data instead')
+
+    def handle(self, *args, **options):
+        if options['remove']:
+            benchmark.remove_synthetic_data()
+            self.stdout.write(self.style.SUCCESS('Removed the synthetic data'))
+            return
+        screenids = benchmark.generate_synthetic_data(n_screens=options['screens'], n_genes=options['genes'],
+                                                      n_pss_screens=options['pss_screens'], n_tracks=options['tracks'],
+                                                      seed=options['seed'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS('Created %d genes and %d screens' % (options['genes'], len(screenids))))
@@ -0,0 +1,166 @@
+# Bulk importer for the datapoints of intracellular phenotype (IPS) and positive selection (PSS) screens
+#
+# The import-export admin resolves the screen and gene of every row with a separate query and saves rows one by one,
+# which takes minutes for a single screen. This command streams the same TSV/CSV files (the columns are those of
+# IPSDatapointResource and PSSDatapointResource in admin.py), resolves genes against the in-memory gene index and
+# inserts the rows in chunks inside a single transaction. The derived columns of IPS datapoints (loginsertions, logmi
+# and signclass) are computed per chunk.
+#
+# Usage: python manage.py import_datapoints <file> --type ips [--replace] [--chunk-size 5000] [--copy]
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction, models
+
+# Import other custom phenosaurus functions
+from uniqueref import models as db
+from uniqueref import datastore
+from uniqueref.geneindex import get_gene_index
+
+# Other general libraries
+from cStringIO import StringIO
+import time
+import csv
+import sys
+
+
+datapoint_models = {
+    'ips': db.IPSDatapoint,
+    'pss': db.PSSDatapoint,
+}
+
+class Command(BaseCommand):
+    help = 'Stream a TSV/CSV file of IPS or PSS datapoints into the database using bulk inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, use '-' to read from stdin")
+        parser.add_argument('--type', dest='type', choices=sorted(datapoint_models), default='ips',
+                            help='The type of datapoints in the file')
+        parser.add_argument('--delimiter', dest='delimiter', default=None,
+                            help='Column delimiter, by default a tab for .tsv/.txt files and a comma otherwise')
+        parser.add_argument('--screen', dest='screen', default=None,
+                            help='Name of the screen, overrides the relscreenname column of the file')
+        parser.add_argument('--replace', action='store_true', dest='replace', default=False,
+                            help='Remove the existing datapoints of every screen in the file prior to inserting')
+        parser.add_argument('--chunk-size', dest='chunk_size', type=int, default=5000,
+                            help='The number of rows inserted per statement')
+        parser.add_argument('--copy', action='store_true', dest='copy', default=False,
+                            help='Use COPY instead of bulk_create (PostgreSQL only)')
+        parser.add_argument('--strict', action='store_true', dest='strict', default=False,
+                            help='Abort the import if a gene is not in the database instead of skipping the row')
+
+    def handle(self, *args, **options):
+        self.model = datapoint_models[options['type']]
+        self.use_copy = options['copy']
+        self.fields = self.converters()
+        if self.use_copy and connection.vendor != 'postgresql':
+            raise CommandError('--copy is only available on PostgreSQL, the database is %s' % connection.vendor)
+
+        path = options['path']
+        delimiter = options['delimiter']
+        if delimiter is None:
+            delimiter = '\t' if path.endswith(('.tsv', '.txt')) or path == '-' else ','
+        f = sys.stdin if path == '-' else open(path, 'rb')
+        try:
+            # Within importing() the signal handlers leave the versions alone while --replace deletes the old rows
+            with datastore.importing(), transaction.atomic():
+                screenids = self.import_rows(csv.DictReader(f, delimiter=delimiter), options)
+                # Bump the versions of the screens and rebuild their stores once committed, so no cache serves old data
+                if self.model is db.IPSDatapoint:
+                    datastore.screens_changed(screenids)
+                else:
+                    datastore.pss_screens_changed(screenids)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+    def converters(self):
+        # The model fields that are read from the file together with the function converting the text value, fields
+        # that are not editable are derived from the others
+        converters = []
+        for field in self.model._meta.concrete_fields:
+            if field.primary_key or field.name in ('relscreen', 'relgene') or not field.editable:
+                continue
+            converters.append((field.attname, float if isinstance(field, models.FloatField) else int))
+        return converters
+
+    def import_rows(self, reader, options):
+        gene_ids = get_gene_index().name_to_id
+        screen_ids = dict(db.Screen.objects.values_list('name', 'id'))
+        converters = self.fields
+        missing = [name for name, conv in converters if name not in reader.fieldnames]
+        if missing:
+            raise CommandError('The file lacks the column(s): %s' % ', '.join(missing))
+        if options['screen'] is None and 'relscreenname' not in reader.fieldnames:
+            raise CommandError('The file lacks a relscreenname column, use --screen to set the screen')
+
+        screens_seen = set()
+        unknown_genes = set()
+        chunk = []
+        inserted = 0
+        start = time.time()
+        for row in reader:
+            screenname = options['screen'] or row['relscreenname']
+            try:
+                screenid = screen_ids[screenname]
+            except KeyError:
+                raise CommandError('Screen %s does not exist, create it in the admin first' % screenname)
+            if screenid not in screens_seen:
+                screens_seen.add(screenid)
+                if options['replace']:
+                    self.model.objects.filter(relscreen_id=screenid).delete()
+            try:
+                geneid = gene_ids[row['relgenename']]
+            except KeyError:
+                if options['strict']:
+                    raise CommandError('Gene %s does not exist' % row['relgenename'])
+                unknown_genes.add(row['relgenename'])
+                continue
+            values = dict((name, conv(row[name])) for name, conv in converters)
+            values['relscreen_id'] = screenid
+            values['relgene_id'] = geneid
+            chunk.append(values)
+            if len(chunk) >= options['chunk_size']:
+                inserted += self.insert(chunk)
+                chunk = []
+                self.report(inserted, start)
+        if chunk:
+            inserted += self.insert(chunk)
+        self.report(inserted, start)
+
+        if unknown_genes:
+            self.stderr.write('Skipped the rows of %d gene(s) that are not in the database: %s' % (
+                len(unknown_genes), ' '.join(sorted(unknown_genes))))
+        self.stdout.write(self.style.SUCCESS('Imported %d datapoints into %d screen(s)' % (inserted, len(screens_seen))))
+        return screens_seen
+
+    def derive(self, chunk):
+        # Vectorised equivalent of IPSDatapoint.set_derived_fields, which bulk inserts bypass
+        derived = datastore.derive_ips_columns([values['insertions'] for values in chunk], [values['mi'] for values in chunk])
+        for name in datastore.ips_derived_columns:
+            for values, value in zip(chunk, derived[name].tolist()):
+                values[name] = None if value != value else value     # NaN is stored as NULL
+
+    def insert(self, chunk):
+        if self.model is db.IPSDatapoint:
+            self.derive(chunk)
+        if self.use_copy:
+            return self.copy(chunk)
+        self.model.objects.bulk_create([self.model(**values) for values in chunk])
+        return len(chunk)
+
+    def copy(self, chunk):
+        columns = ['relscreen_id', 'relgene_id'] + [name for name, conv in self.fields]
+        if self.model is db.IPSDatapoint:
+            columns += list(datastore.ips_derived_columns)
+        buf = StringIO()
+        for values in chunk:
+            buf.write('\t'.join('\\N' if values[name] is None else repr(values[name]) for name in columns))
+            buf.write('\n')
+        buf.seek(0)
+        with connection.cursor() as cursor:
+            cursor.copy_from(buf, self.model._meta.db_table, columns=columns, sep='\t')
+        return len(chunk)
+
+    def report(self, inserted, start):
+        elapsed = max(time.time() - start, 1e-6)
+        self.stdout.write('%d rows, %.1f s, %d rows/s' % (inserted, elapsed, inserted / elapsed))
@@ -0,0 +1,34 @@
+# Time the hot paths of custom_functions and the plot views, and store the results as JSON
+#
+# Usage: python manage.py run_benchmarks [--repeat 5] [--output results.json] [--compare baseline.json]
+
+from django.core.management.base import BaseCommand
+
+# Import other custom phenosaurus functions
+from uniqueref import benchmark
+
+# Other general libraries
+import json
+
+
+class Command(BaseCommand):
+    help = 'Benchmark custom_functions and the IPSFishtail, opengenefinder and listgenes views'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', dest='repeat', type=int, default=5, help='Number of runs per benchmark')
+        parser.add_argument('--plot-genes', dest='plot_genes', type=int, default=10,
+                            help='Number of genes in the gene plot benchmarks')
+        parser.add_argument('--output', dest='output', default=None, help='Write the results to this JSON file')
+        parser.add_argument('--compare', dest='compare', default=None, help='JSON file of an earlier run to compare against')
+
+    def handle(self, *args, **options):
+        results = benchmark.run_benchmarks(options['repeat'], options['plot_genes'], stdout=self.stdout)
+        if options['output']:
+            benchmark.save_results(results, options['output'])
+            self.stdout.write(self.style.SUCCESS('Results written to %s' % options['output']))
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            self.stdout.write(self.style.MIGRATE_HEADING('Median compared to %s' % options['compare']))
+            for name, old, new, ratio in benchmark.compare_results(baseline, results):
+                self.stdout.write('%-35s %8.1f ms -> %8.1f ms  (x%.2f)' % (name, 1000 * old, 1000 * new, ratio))
@@ -0,0 +1,23 @@
+# Render the snapshots of the fishtail plots of all public IP screens at the default settings (see snapshots.py)
+#
+# Once the snapshots exist the importers keep them up to date. Run this command again after changes to the genes or
+# the permissions, or after a deployment, to render the snapshots that have become stale.
+#
+# Usage: python manage.py snapshot_public_screens [--all]
+
+from django.core.management.base import BaseCommand
+
+# Import other custom phenosaurus functions
+from uniqueref import snapshots
+
+
+class Command(BaseCommand):
+    help = 'Render the fishtail plots of all public IP screens at the default settings to static snapshots'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', dest='all', default=False,
+                            help='Render all snapshots again, not only those that are missing or stale')
+
+    def handle(self, *args, **options):
+        n = snapshots.update_snapshots(full=options['all'], stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS('Rendered %d snapshot(s)' % n))
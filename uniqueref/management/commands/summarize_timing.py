@@ -0,0 +1,57 @@
+# Aggregate the request timings written by timing.ServerTimingMiddleware
+#
+# Usage: python manage.py summarize_timing [--path /uniqueref/simpleplot/] [--since <unix time>]
+
+from django.core.management.base import BaseCommand
+
+# Import other custom phenosaurus functions
+from uniqueref import globalvars as gv
+from uniqueref import timing
+
+# Other general libraries
+from collections import defaultdict
+import numpy as np
+import json
+import os
+
+
+class Command(BaseCommand):
+    help = 'Summarize the per-stage request timings of the rotating timing log per path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', dest='path', default=None, help='Only summarize requests for this path')
+        parser.add_argument('--since', dest='since', type=float, default=0, help='Only requests after this unix time')
+
+    def read_records(self, options):
+        # The current log and its rotated backups
+        log_path = timing.timing_log_path()
+        paths = [log_path] + ['%s.%d' % (log_path, i) for i in range(1, gv.timing_log_backups + 1)]
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record['time'] < options['since'] or (options['path'] and record['path'] != options['path']):
+                        continue
+                    yield record
+
+    def handle(self, *args, **options):
+        per_path = defaultdict(list)
+        for record in self.read_records(options):
+            per_path[record['path']].append(record)
+
+        for path in sorted(per_path):
+            records = per_path[path]
+            totals = np.array([r['total'] for r in records]) * 1000
+            self.stdout.write(self.style.MIGRATE_HEADING('%s (%d requests)' % (path, len(records))))
+            self.stdout.write('    %-12s median %8.1f ms   p95 %8.1f ms' % ('total', np.median(totals), np.percentile(totals, 95)))
+            self.stdout.write('    %-12s median %8.1f      p95 %8.1f' % ('queries', np.median([r['queries'] for r in records]),
+                                                                        np.percentile([r['queries'] for r in records], 95)))
+            stages = sorted(set(name for r in records for name in r['spans']))
+            for stage in stages:
+                durations = np.array([r['spans'].get(stage, 0) for r in records]) * 1000
+                self.stdout.write('    %-12s median %8.1f ms   p95 %8.1f ms' % (stage, np.median(durations), np.percentile(durations, 95)))
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_datapoints(apps, schema_editor):
+    # A (screen, gene) pair that was imported more than once keeps its most recent datapoint only, otherwise the
+    # unique constraint below can not be created
+    for model_name in ('IPSDatapoint', 'PSSDatapoint'):
+        model = apps.get_model('uniqueref', model_name)
+        duplicates = model.objects.values('relscreen_id', 'relgene_id').annotate(n=Count('id'), keep=Max('id')).filter(n__gt=1)
+        for duplicate in duplicates:
+            model.objects.filter(relscreen_id=duplicate['relscreen_id'], relgene_id=duplicate['relgene_id']).exclude(id=duplicate['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uniqueref', '0014_create_screenname_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_datapoints, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='ipsdatapoint',
+            unique_together=set([('relscreen', 'relgene')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='pssdatapoint',
+            unique_together=set([('relscreen', 'relgene')]),
+        ),
+        migrations.AddIndex(
+            model_name='ipsdatapoint',
+            index=models.Index(fields=['relgene', 'relscreen', 'mi', 'fcpv'], name='ipsdp_gene_screen_cov_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pssdatapoint',
+            index=models.Index(fields=['relgene', 'relscreen'], name='pssdp_gene_screen_idx'),
+        ),
+    ]
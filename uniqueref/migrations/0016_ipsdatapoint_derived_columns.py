@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uniqueref', '0015_datapoint_screen_gene_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ipsdatapoint',
+            name='loginsertions',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='ipsdatapoint',
+            name='logmi',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='ipsdatapoint',
+            name='signclass',
+            field=models.SmallIntegerField(choices=[(1, 'Bottom of the plot (mi < 1)'), (2, 'Top of the plot (mi >= 1)')], editable=False, null=True),
+        ),
+        migrations.RemoveIndex(
+            model_name='ipsdatapoint',
+            name='ipsdp_gene_screen_cov_idx',
+        ),
+        migrations.AddIndex(
+            model_name='ipsdatapoint',
+            index=models.Index(fields=['relgene', 'relscreen', 'logmi', 'signclass', 'fcpv', 'mi'], name='ipsdp_gene_screen_cov_idx'),
+        ),
+    ]
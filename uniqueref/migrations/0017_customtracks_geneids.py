@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+import numpy as np
+
+
+def encode_genelists(apps, schema_editor):
+    # The same as tracks.encode_genelist, with the historical models
+    Gene = apps.get_model('uniqueref', 'Gene')
+    CustomTracks = apps.get_model('uniqueref', 'CustomTracks')
+    gene_ids = dict(Gene.objects.values_list('name', 'id'))
+    for track in CustomTracks.objects.all():
+        ids = sorted(set(gene_ids[name] for name in track.genelist.split() if name in gene_ids))
+        track.geneids = np.array(ids, dtype='<i4').tobytes()
+        track.save(update_fields=['geneids'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uniqueref', '0016_ipsdatapoint_derived_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customtracks',
+            name='geneids',
+            field=models.BinaryField(default=b'', editable=False),
+        ),
+        migrations.RunPython(encode_genelists, migrations.RunPython.noop),
+    ]
@@ -5,6 +5,9 @@ from django.utils.encoding import force_bytes
 from django_pandas.managers import DataFrameManager
 from django.contrib.auth.models import Group
 
+# Other general libraries
+import math
+
 class Screen(models.Model):			# Model for screens
 	name = models.TextField()	
 	scientist = models.ForeignKey('auth.User')
@@ -110,6 +113,10 @@ class PSSDatapoint(models.Model):			# A model that holds each indiviual datapoin
 	class Meta:
 		verbose_name = 'Datapoint of a positive selection screen'
  		verbose_name_plural = 'datapoints of positive selection screens'
+		unique_together = (('relscreen', 'relgene'),)	# One datapoint per gene per screen, also serves lookups by screen (and gene)
+		indexes = [
+			models.Index(fields=['relgene', 'relscreen'], name='pssdp_gene_screen_idx')	# Serves lookups of genes across a set of screens
+		]
 
 
 class IPSDatapoint(models.Model):			# A model that holds each indiviual datapoint for intracellular phenotype screens
@@ -127,20 +134,44 @@ class IPSDatapoint(models.Model):			# A model that holds each indiviual datapoin
 	fcpv = models.FloatField()
 	mi = models.FloatField()
 	insertions = models.IntegerField()
+	# Derived from the columns above when a datapoint is saved (or by datastore.derive_ips_columns for bulk imports),
+	# so plots only need to apply the p-value cutoff. Empty for datapoints imported prior to their introduction, the
+	# backfill_derived_columns command fills them.
+	signclasses = (
+		(1, 'Bottom of the plot (mi < 1)'),	# The codes index gv.fishtail_palette
+		(2, 'Top of the plot (mi >= 1)'),
+	)
+	loginsertions = models.FloatField(null=True, editable=False)		# log10(insertions)
+	logmi = models.FloatField(null=True, editable=False)				# log2(mi)
+	signclass = models.SmallIntegerField(null=True, editable=False, choices=signclasses)	# The color of a significant hit
 	objects = DataFrameManager()	# Again, needed for django_pandas
 
 	def __str__(self):
 		return force_bytes('%s' % (self.low))	# Return name of related gene
 
+	def set_derived_fields(self):
+		self.loginsertions = math.log10(self.insertions) if self.insertions > 0 else None
+		self.logmi = math.log(self.mi, 2) if self.mi > 0 else None
+		self.signclass = 1 if self.mi < 1 else 2
+
+	def save(self, *args, **kwargs):
+		self.set_derived_fields()
+		super(IPSDatapoint, self).save(*args, **kwargs)
+
 	class Meta:
 		verbose_name = 'Datapoint of a intracellular phenotype screen'
  		verbose_name_plural = 'datapoints of intracellular phenotype screens'
+		unique_together = (('relscreen', 'relgene'),)	# One datapoint per gene per screen, also serves lookups by screen (and gene)
+		indexes = [
+			models.Index(fields=['relgene', 'relscreen', 'logmi', 'signclass', 'fcpv', 'mi'], name='ipsdp_gene_screen_cov_idx')	# Serves lookups of genes across a set of screens from the index alone (gene plots)
+		]
 
 class CustomTracks(models.Model):
 	user = models.ForeignKey('auth.User')
 	name = models.CharField(max_length=100) # Name of track, eg. genes in cholesterol synthesis
 	description = models.CharField(max_length=400) # Whatever one wants to say about this track
 	genelist = models.TextField() # Space sepearated list of genes
+	geneids = models.BinaryField(default=b'', editable=False) # The ids of the genes of genelist that exist, as int32 (see tracks.py)
 	objects = DataFrameManager() # For Django Pandas
 
 	def __str__(self):
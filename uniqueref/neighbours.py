@@ -0,0 +1,159 @@
+# Genes with the most similar profile of logmi across the intracellular phenotype screens (co-regulators)
+#
+# The gene matrix (see genematrix.py) is transposed into a (genes x screens) matrix of which every row is normalised to
+# mean 0 and standard deviation 1 over the screens in which the gene was measured; unmeasured entries are 0 and a mask
+# of 0/1 tells which entries were measured. Together with the squares of the normalised values these are written as
+# float32 memory-mapped files, shared by all workers. The Pearson correlation of a gene with every other gene over the
+# screens they were both measured in (restricted to the screens a user may see) then takes six matrix-vector products
+# per block of genes, which answers a query over 20k genes x hundreds of screens in tens of milliseconds. The files are
+# rebuilt by the importers (see datastore.screens_changed) and the build_gene_matrix command after the gene matrix has
+# changed; until then searches are unavailable.
+
+# Import other custom phenosaurus functions
+import globalvars as gv
+import datastore
+import genematrix
+
+# Other general libraries
+import numpy as np
+import threading
+import json
+import os
+
+
+neighbours_version_key = 'neighbours'
+neighbour_arrays = ('values', 'squares', 'mask')
+
+_neighbours = None
+_lock = threading.Lock()
+_write_lock = threading.Lock()
+
+
+def neighbours_dir():
+    return os.path.join(gv.datastore_dir, 'neighbours')
+
+def neighbours_path(name):
+    return os.path.join(neighbours_dir(), '%s.f32' % name)
+
+def meta_path():
+    return os.path.join(neighbours_dir(), 'meta.json')
+
+
+class NeighbourMatrix(object):
+    """Read-only view on the normalised (genes x screens) matrix."""
+
+    def __init__(self, meta, version):
+        self.version = version
+        self.matrix_version = meta['matrix_version']
+        self.gene_ids = np.array(meta['gene_ids'], dtype=np.int64)     # Sorted
+        self.screen_ids = list(meta['screen_ids'])
+        shape = (len(self.gene_ids), len(self.screen_ids))
+        self.arrays = {}
+        for name in neighbour_arrays:
+            if shape[0] and shape[1]:
+                self.arrays[name] = np.memmap(neighbours_path(name), dtype=np.float32, mode='r', shape=shape)
+            else:
+                self.arrays[name] = np.zeros(shape, dtype=np.float32)
+
+    def nearest(self, geneid, screenids, k=gv.neighbour_top_k, block=gv.neighbour_block, min_shared=gv.neighbour_min_shared):
+        # The k genes with the highest correlation to geneid over screenids, as arrays (gene ids, r, shared screens)
+        # sorted on r. Empty if geneid is not in the matrix.
+        pos = genematrix.positions(self.gene_ids, [geneid])[0]
+        if pos < 0:
+            return np.array([], dtype=np.int64), np.array([]), np.array([], dtype=np.int64)
+        allowed = np.in1d(self.screen_ids, [int(i) for i in screenids]).astype(np.float64)
+        x = self.arrays['values'][pos].astype(np.float64) * allowed
+        m = self.arrays['mask'][pos].astype(np.float64) * allowed
+        xx = x * x
+        r = np.full(len(self.gene_ids), np.nan)
+        n = np.zeros(len(self.gene_ids))
+        for start in range(0, len(self.gene_ids), block):
+            values = np.asarray(self.arrays['values'][start:start + block], dtype=np.float64)
+            squares = np.asarray(self.arrays['squares'][start:start + block], dtype=np.float64)
+            mask = np.asarray(self.arrays['mask'][start:start + block], dtype=np.float64)
+            shared = mask.dot(m)
+            sy, sx = values.dot(m), mask.dot(x)
+            syy, sxx = squares.dot(m), mask.dot(xx)
+            sxy = values.dot(x)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                r[start:start + block] = (shared * sxy - sx * sy) / np.sqrt((shared * sxx - sx ** 2) * (shared * syy - sy ** 2))
+            n[start:start + block] = shared
+        r[(n < min_shared) | ~np.isfinite(r)] = np.nan
+        r[pos] = np.nan     # Not the gene itself
+        candidates = np.nonzero(~np.isnan(r))[0]
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-r[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-r[candidates], kind='mergesort')]
+        return self.gene_ids[candidates], np.clip(r[candidates], -1, 1), n[candidates].astype(np.int64)
+
+
+def read_meta():
+    try:
+        with open(meta_path()) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+def build_neighbour_matrix(matrix):
+    # Writes the normalised matrix of all IP screens of the gene matrix. The files are written under names of their own
+    # per process and moved in place, meta.json last, so a worker never opens a half-written file.
+    screen_pos = [pos for pos, screenid in enumerate(matrix.screen_ids) if screenid in matrix.screen_names]
+    values = np.array(matrix.arrays['logmi'][screen_pos], dtype=np.float32).T     # (genes x screens)
+    mask = ~np.isnan(values)
+    counts = mask.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        values -= (np.nansum(values, axis=1) / counts)[:, None]
+        values[~mask] = 0
+        sd = np.sqrt((values * values).sum(axis=1) / counts)
+        values /= np.where(sd > 0, sd, 1)[:, None]
+    values[~(sd > 0)] = 0       # Genes measured in fewer than two screens or without any variation
+    datastore._makedirs(neighbours_dir())
+    for name, array in (('values', values), ('squares', values * values), ('mask', mask)):
+        tmp_path = '%s.%d.tmp' % (neighbours_path(name), os.getpid())
+        array.astype(np.float32).tofile(tmp_path)
+        os.rename(tmp_path, neighbours_path(name))
+    meta = {'matrix_version': matrix.version, 'gene_ids': matrix.gene_ids.tolist(),
+            'screen_ids': [matrix.screen_ids[pos] for pos in screen_pos]}
+    datastore._atomic_write(meta_path(), json.dumps(meta))
+    datastore.bump_version(neighbours_version_key)
+
+def fresh_gene_matrix():
+    # The gene matrix if all its IP screens are up to date, otherwise None
+    matrix = genematrix.get_gene_matrix()
+    if matrix is None or not matrix.is_fresh([i for i in matrix.screen_ids if i in matrix.screen_names]):
+        return None
+    return matrix
+
+def update_neighbour_matrix():
+    # Rebuilds the normalised matrix if the gene matrix has changed since it was written. Called by the importers after
+    # they have updated the gene matrix and by the build_gene_matrix command, never within a request. Returns True if
+    # the matrix was rebuilt.
+    with _write_lock:
+        matrix = fresh_gene_matrix()
+        if matrix is None:
+            return False
+        meta = read_meta()
+        if meta is not None and meta['matrix_version'] == matrix.version:
+            return False
+        build_neighbour_matrix(matrix)
+        return True
+
+def get_neighbour_matrix():
+    # Returns the normalised matrix of this worker, reopening the files if they have been rebuilt. None if the gene
+    # matrix is missing or stale, or if the normalised matrix has not been built from its current version.
+    global _neighbours
+    matrix = fresh_gene_matrix()
+    if matrix is None:
+        return None
+    neighbours = _neighbours
+    if neighbours is not None and neighbours.matrix_version == matrix.version and neighbours.version == datastore.get_version(neighbours_version_key):
+        return neighbours
+    with _lock:
+        meta = read_meta()
+        if meta is None or meta['matrix_version'] != matrix.version:
+            return None
+        try:
+            _neighbours = NeighbourMatrix(meta, datastore.get_version(neighbours_version_key))
+        except (IOError, OSError, ValueError):
+            return None     # The files do not match meta.json, eg. a rebuild has been interrupted
+        return _neighbours
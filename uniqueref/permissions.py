@@ -0,0 +1,98 @@
+# A process-wide cache of which screens the groups are allowed to see
+#
+# Every request used to work out the screens of the groups of the user with a distinct() join over ScreenPermissions,
+# after which the forms and titles queried the Screen table again. The screen permissions and the few properties of
+# the screens that the forms and titles need are small, so each worker loads them once and derives the authorized
+# screens of a set of groups from memory. signals.py bumps the 'permissions' version marker (see datastore.py) upon any
+# change to a Screen or ScreenPermissions, which makes every worker reload them.
+
+# Import other custom phenosaurus functions
+import datastore
+import models as db
+
+# Other general libraries
+from collections import namedtuple, defaultdict
+import threading
+
+
+permissions_version_key = 'permissions'
+
+ScreenInfo = namedtuple('ScreenInfo', ['id', 'name', 'description', 'screentype'])
+
+
+class AuthorizedScreens(object):
+    """The screens a set of groups is allowed to see. Iterating over it yields their ids."""
+
+    def __init__(self, screens):
+        self.screens = sorted(screens, key=lambda screen: screen.name)
+        self.by_id = dict((screen.id, screen) for screen in self.screens)
+        self.ids = sorted(self.by_id)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, screenid):
+        return screenid in self.by_id
+
+    def of_type(self, screentype):
+        # The ids of the screens of one type, eg. 'IP'
+        return [screen.id for screen in self.screens if screen.screentype == screentype]
+
+    def choices(self, screentype):
+        # (id, name) pairs for the select boxes of the forms, sorted on name
+        return [(screen.id, screen.name) for screen in self.screens if screen.screentype == screentype]
+
+    def description(self, screenid):
+        return self.by_id[int(screenid)].description
+
+
+class PermissionTable(object):
+    """All screens and the screens of every group, loaded with two queries."""
+
+    def __init__(self, version):
+        self.version = version
+        self.screens = dict((row[0], ScreenInfo(*row)) for row in
+                            db.Screen.objects.values_list('id', 'name', 'description', 'screentype'))
+        self.group_screens = defaultdict(set)
+        for groupid, screenid in db.ScreenPermissions.objects.values_list('relgroup_id', 'relscreen_id'):
+            self.group_screens[groupid].add(screenid)
+        self._authorized = {}
+        self._lock = threading.Lock()
+
+    def authorized(self, gids):
+        key = frozenset(int(gid) for gid in gids)
+        authorized = self._authorized.get(key)
+        if authorized is None:
+            screenids = set()
+            for gid in key:
+                screenids |= self.group_screens.get(gid, set())
+            authorized = AuthorizedScreens([self.screens[i] for i in screenids if i in self.screens])
+            with self._lock:
+                self._authorized[key] = authorized
+        return authorized
+
+
+_permissions = None
+_lock = threading.Lock()
+
+def get_screen_permissions():
+    # Returns the permissions of this worker, reloading them if screens or permissions have changed since
+    global _permissions
+    version = datastore.get_version(permissions_version_key)
+    permissions = _permissions
+    if permissions is None or permissions.version != version:
+        with _lock:
+            if _permissions is None or _permissions.version != version:
+                _permissions = PermissionTable(version)
+            permissions = _permissions
+    return permissions
+
+def get_authorized(gids):
+    return get_screen_permissions().authorized(gids)
+
+def permissions_changed():
+    # Call this after screens or their permissions have been added, changed or removed
+    datastore.bump_version(permissions_version_key)
@@ -4,7 +4,7 @@ from django.contrib.auth.decorators import login_required
 # Import Bokeh related libraries and functions
 from bokeh.plotting import figure, output_file, show, vplot
 from bokeh.models.widgets import Select
-from bokeh.models import HoverTool, TapTool, OpenURL, Circle, Text, CustomJS, FixedTicker, ColumnDataSource, Legend
+from bokeh.models import HoverTool, TapTool, OpenURL, Circle, Text, CustomJS, FixedTicker, ColumnDataSource, Legend, LinearColorMapper
 from bokeh.models.widgets import TableColumn, DataTable
 from bokeh.embed import components
 from bokeh.resources import CDN
@@ -16,6 +16,7 @@ from bokeh.io import vplot, hplot, gridplot
 import models as db
 import custom_functions as cf
 import globalvars as gv
+import timing
 
 # Other general libraries
 import pandas as pd
@@ -26,12 +27,20 @@ import sys
 
 import logging
 from django.conf import settings
+from django.template.loader import render_to_string
 
 ##########################################################
 # 1. Fistail plots                                       #
 ##########################################################
 
-def fishtail(title, df, sag, oca, textsize, authorized_screens, legend=pd.DataFrame(), setwidth=1000, setheight=700, legend_location="top_right"):
+@timing.timed('bokeh')
+def fishtail(title, df, sag, oca, textsize, authorized_screens, legend=pd.DataFrame(), setwidth=1000, setheight=700, legend_location="top_right", data_url=None, lod_url=None, df_tracks=None):
+    # If data_url is given the plot is sent without data, the browser loads the columns from data_url as typed arrays
+    # (see binarydata.py), in that case df only needs to hold the logmi and loginsertions columns to set the ranges.
+    # If lod_url is given the browser fetches the level of detail of the visible window from lod_url every time the
+    # plot is zoomed or panned (see cf.fishtail_level_of_detail), dense regions of non-significant genes are then drawn
+    # as a density layer.
+    # df_tracks holds the genes of custom tracks (see cf.generate_track_overlay), which are drawn as colored rings
 
     TOOLS = "resize,hover,save,pan,wheel_zoom,box_zoom,reset,tap"
 
@@ -71,16 +80,27 @@ def fishtail(title, df, sag, oca, textsize, authorized_screens, legend=pd.DataFr
         ('Gene', '@relgene'),
     ]            
 
-    # Create a ColumnDataSource from the merged dataframa
-    source = ColumnDataSource(df[['color', 'linecolor', 'logmi', 'loginsertions', 'relgene', 'fcpv']])
+    if data_url is None and lod_url is None:
+        # Create a ColumnDataSource from the merged dataframa
+        source = ColumnDataSource(df[['color', 'linecolor', 'logmi', 'loginsertions', 'relgene', 'fcpv']])
+        fill_color, line_color = 'color', 'linecolor'
+    else:
+        # An empty source, colors are sent as small integer codes that index gv.fishtail_palette
+        source = ColumnDataSource(data=dict(colorcode=[], logmi=[], loginsertions=[], relgene=[], fcpv=[]))
+        mapper = LinearColorMapper(palette=gv.fishtail_palette, low=0, high=len(gv.fishtail_palette)-1)
+        fill_color = line_color = {'field': 'colorcode', 'transform': mapper}
     # Create a new dataframe and source that only holds the names and the positions of datapoints, used for labeling genes
     textsource = ColumnDataSource(data=dict(loginsertions=[], logmi=[], relgene=[]))
     # Define the layout of the circle (a Bokeh Glyph) if nothing has been selected, ie. the inital view
-    initial_view = Circle(x='loginsertions', y='logmi', fill_color='color', fill_alpha=1, line_color='linecolor', size=5, line_width=1) # This is the initial view, if there's no labeling if genes, this is the only plot
+    initial_view = Circle(x='loginsertions', y='logmi', fill_color=fill_color, fill_alpha=1, line_color=line_color, size=5, line_width=1) # This is the initial view, if there's no labeling if genes, this is the only plot
 
     # sag == "on" means that all significant genes needs to be annotated
+    sagtextsource = None
     if sag == "on":
-        sagtextsource = ColumnDataSource(df[df['signame']!=""][['logmi', 'loginsertions', 'signame']])
+        if data_url is None and lod_url is None:
+            sagtextsource = ColumnDataSource(df[df['signame']!=""][['logmi', 'loginsertions', 'signame']])
+        else:
+            sagtextsource = ColumnDataSource(data=dict(logmi=[], loginsertions=[], signame=[]))
         p.text('loginsertions', 'logmi', text='signame', text_color='black', text_font_size=textsize, source=sagtextsource) # This loads more data than needed
     if oca == "hah": # If the 'on click action' is highlight and label
     # Start with creating an empty overlaying plot for the textlabels
@@ -88,7 +108,7 @@ def fishtail(title, df, sag, oca, textsize, authorized_screens, legend=pd.DataFr
         # Define how the bokeh glyphs should look if selected
         selected_circle = Circle(fill_color='black', line_color='black', fill_alpha=1, line_alpha=1, size=5, line_width=1)
         # Define how the bokeh glyphs should look if not selected
-        nonselected_circle = Circle(fill_color='color', line_color='linecolor', fill_alpha=gv.transp_nsel_f, line_alpha=gv.transp_nsel_l, size=5, line_width=1)
+        nonselected_circle = Circle(fill_color=fill_color, line_color=line_color, fill_alpha=gv.transp_nsel_f, line_alpha=gv.transp_nsel_l, size=5, line_width=1)
         
         source.callback = CustomJS(args=dict(textsource=textsource), code="""
             var inds = cb_obj.get('selected')['1d'].indices;
@@ -123,16 +143,51 @@ def fishtail(title, df, sag, oca, textsize, authorized_screens, legend=pd.DataFr
         taptool = p.select(type=TapTool)
         taptool.callback = OpenURL(url=url)
 
+    if lod_url is not None:
+        # The density layer of non-significant genes, drawn below the points
+        densitysource = ColumnDataSource(data=dict(x=[], y=[], width=[], height=[], alpha=[]))
+        p.rect('x', 'y', 'width', 'height', fill_color=gv.color_ns, fill_alpha='alpha', line_color=None, source=densitysource)
+        range_callback = CustomJS(code="if (window.uniqueref_lod) { window.uniqueref_lod['%s'](); }" % source.ref['id'])
+        p.x_range.callback = range_callback
+        p.y_range.callback = range_callback
+
     # Plot the final graph  
-    p.add_glyph(
+    renderer = p.add_glyph(
         source,
         initial_view,
         selection_glyph=selected_circle,
         nonselection_glyph=nonselected_circle
     )
+    if lod_url is not None:
+        # Only the points can be hovered and clicked, not the density layer
+        hover.renderers = [renderer]
+        p.select(type=TapTool).renderers = [renderer]
+
+    # A ring around every gene of a custom track, with one legend entry per track
+    if df_tracks is not None and not df_tracks.empty:
+        for track, df_track in df_tracks.groupby('track', sort=False):
+            p.circle('loginsertions', 'logmi', size='ringsize', fill_color=None, line_color='trackcolor', line_width=2,
+                     legend=track, source=ColumnDataSource(df_track))
+        p.legend.location = legend_location
 
     r = row(children=[p], responsive=True)
-    script, div = components(r, CDN)
+    with timing.span('components'):
+        script, div = components(r, CDN)
+    if data_url is not None:
+        script += render_to_string('uniqueref/fishtail_binary.html', {
+            'data_url': data_url,
+            'source_id': source.ref['id'],
+            'sag_source_id': sagtextsource.ref['id'] if sagtextsource is not None else '',
+        })
+    if lod_url is not None:
+        script += render_to_string('uniqueref/fishtail_lod.html', {
+            'lod_url': lod_url,
+            'source_id': source.ref['id'],
+            'density_source_id': densitysource.ref['id'],
+            'sag_source_id': sagtextsource.ref['id'] if sagtextsource is not None else '',
+            'x_range_id': p.x_range.ref['id'],
+            'y_range_id': p.y_range.ref['id'],
+        })
     return script, div
 
 
@@ -141,73 +196,76 @@ def fishtail(title, df, sag, oca, textsize, authorized_screens, legend=pd.DataFr
 # 3. Single gene plots (genefinder histogram things)     #
 ##########################################################
 
-def single_gene_plots(df_all, hidelegend=False):
+# The legend shared by all gene plots, drawn once above them instead of inside every plot
+def geneplot_legend(width):
+    p = figure(width=width, height=50, tools=[], toolbar_location=None, min_border_left=65, min_border_top=0,
+               sizing_mode='scale_width', x_range=(0, 1), y_range=(0, 1))
+    p.axis.visible = False
+    p.grid.visible = False
+    p.outline_line_alpha = 0
+    # Glyphs outside the ranges, they only provide the symbols of the legend
+    legend = Legend(items=[
+        ('Pos. reg', [p.circle(x=-1, y=-1, color=gv.color_sb)]),
+        ('Neg. reg', [p.circle(x=-1, y=-1, color=gv.color_st)]),
+        ('Not sign', [p.circle(x=-1, y=-1, color=gv.color_ns)])],
+        location='top_right'
+    )
+    legend.orientation = 'horizontal'
+    legend.background_fill_alpha = 0.1
+    legend.background_fill_color = gv.legend_background
+    legend.border_line_width = 1
+    legend.border_line_color = "black"
+    legend.border_line_alpha = 0.3
+    p.add_layout(legend)
+    return p
+
+def single_gene_plot(gene, df, x_range, width):
     # A limited set of tools
     TOOLS = "resize,save,pan,wheel_zoom,box_zoom,reset,hover"
+    source = ColumnDataSource(df[['relscreen', 'logmi', 'fcpv', 'color']])
+    # This gives optimal separation of the datapoints but 0 is not always in the middle (or present at all!)... would that be desirable?
+    absmin = np.absolute(df['logmi'].min())
+    absmax = np.absolute(df['logmi'].max())
+    if (absmin >= absmax):
+        min = -absmin-(0.1*absmin)
+        max = absmin+(0.1*absmin)
+    else:
+        min = -absmax-(0.1*absmax)
+        max = absmax+(0.1*absmax)
+    p = figure(
+        width=width,
+        height=400,
+        y_range=(min, max),
+        x_range=x_range,
+        tools=[TOOLS],
+        title=gene,
+        min_border_left=65,
+        min_border_top=45,
+        toolbar_location='above',
+        sizing_mode = 'scale_both'
+    )
+    p.circle('relscreen', 'logmi', color='color', alpha=1, source=source, size=10)
+    p.xaxis.major_label_orientation = pi/4
+    # The hover guy
+    hover = p.select(type=HoverTool)
+    hover.tooltips = [
+        ('P-Value', '@fcpv'),
+        ('log(MI)', '@logmi'),
+        ('Screen', '@relscreen'),
+    ]
+    return p
+
+@timing.timed('bokeh')
+def single_gene_plots(df_all, hidelegend=False):
+    # One plot per gene, in the order of the genes in df_all
     # The labels for the x-axis
     x_range = [str(screen) for screen in df_all.relscreen.unique()]
-    # Now we create a dictionary that uses the genenames to create variables. An sich this is a nice approach but because dictionaries are intrinsically unsorted, the plots will have an unsorted order in which they appear under each other
-    figures = {str(name): 0 for name in df_all.relgene.unique()}
-    # Now we create another empty array, which will hold the actual plotobjects instead of the variables
-    # The reason for restructing like this is that bokeh gridplot can only handle an array of plot objects, and certainly not a dict of variables
     calculated_plot_width = cf.calc_geneplot_width('normal', len(x_range))
-    plot_dict = {}
-    print('x-range: ', x_range)
-    print('figures: ', figures)
-    for y in figures:
-        df = df_all[df_all['relgene']==y]
-        print("current df: ", df)
-        title=y
-        source = ColumnDataSource(df)
-        # This gives optimal separation of the datapoints but 0 is not always in the middle (or present at all!)... would that be desirable?
-        absmin = np.absolute(df['logmi'].min())
-        absmax = np.absolute(df['logmi'].max())
-        if (absmin >= absmax):
-            min = -absmin-(0.1*absmin)
-            max = absmin+(0.1*absmin)
-        else:
-            min = -absmax-(0.1*absmax)
-            max = absmax+(0.1*absmax)
-        figures[y] = figure(
-            width=calculated_plot_width,
-            height=400,
-            y_range=(min, max),
-            x_range=x_range,
-            tools=[TOOLS],
-            title=title,
-            min_border_left=65,
-            min_border_top=45,
-            toolbar_location='above',
-            sizing_mode = 'scale_both'
-        )
-        figures[y].circle('relscreen', 'logmi', color='color', alpha=1, source=source, size=10)
-        figures[y].xaxis.major_label_orientation = pi/4
-        # The hover guy
-        hover = figures[y].select(type=HoverTool)
-        hover.tooltips = [
-            ('P-Value', '@fcpv'),
-            ('log(MI)', '@logmi'),
-            ('Screen', '@relscreen'),
-        ]
-
-        if not hidelegend:
-            legend = Legend(items=[
-                ('Pos. reg', [figures[y].circle(x=0, y=0, color=gv.color_sb)]),
-                ('Neg. reg', [figures[y].circle(x=0, y=0, color=gv.color_st)]),
-                ('Not sign', [figures[y].circle(x=0, y=0, color=gv.color_ns)])],
-                location='top_right'
-            )
-            legend.orientation = 'horizontal'
-            legend.background_fill_alpha = 0.1
-            legend.background_fill_color = gv.legend_background
-            legend.border_line_width = 1
-            legend.border_line_color = "black"
-            legend.border_line_alpha = 0.3
-
-            figures[y].add_layout(legend)
-        plot_dict[y] = figures[y]
-
-    return(plot_dict.values())
+    # Split the dataframe once rather than filtering it per gene
+    figures = [single_gene_plot(str(gene), df, x_range, calculated_plot_width) for gene, df in df_all.groupby('relgene', sort=False)]
+    if not hidelegend and figures:
+        figures.insert(0, geneplot_legend(calculated_plot_width))
+    return figures
 
 
 ##########################################################
@@ -216,5 +274,108 @@ def single_gene_plots(df_all, hidelegend=False):
 
 def vertical_geneplots_layout(list_of_geneplot_objects):
     p = column(list_of_geneplot_objects, responsive=True)
-    script, div = components(p)
+    with timing.span('components'):
+        script, div = components(p)
+    return script, div
+
+
+##########################################################
+# 5. Region plots                                        #
+##########################################################
+
+@timing.timed('bokeh')
+def region_plot(title, df_genes, df, textsize, setwidth=1000):
+    # The log(MI) of the genes in a genomic region in every screen at the middle of the gene, above a track with the
+    # bodies of the genes. Both plots share the x-axis (the position on the chromosome).
+    TOOLS = "resize,hover,save,xpan,xwheel_zoom,box_zoom,reset"
+    start, end = df_genes['start'].min(), df_genes['end'].max()
+    margin = 0.02 * max(end - start, 1)
+    absmax = np.absolute(df['logmi']).max() if not df.empty else 1
+
+    p = figure(
+        width=setwidth,
+        height=500,
+        x_range=(start - margin, end + margin),
+        y_range=(-1.1*absmax, 1.1*absmax),
+        tools=[TOOLS],
+        title=title,
+        webgl=True,
+        y_axis_label = "Mutational index [2log]",
+        min_border_left=65
+    )
+    p.xaxis.visible = False
+    p.line([start - margin, end + margin], [0, 0], line_width=1, line_color="black")
+    p.circle('mid', 'logmi', color='color', size=7, alpha=0.9, source=ColumnDataSource(df[['mid', 'logmi', 'fcpv', 'color', 'relgene', 'relscreen']]))
+    hover = p.select(type=HoverTool)
+    hover.tooltips = [
+        ('Gene', '@relgene'),
+        ('Screen', '@relscreen'),
+        ('log(MI)', '@logmi'),
+        ('P-Value', '@fcpv'),
+    ]
+
+    # The genes are spread over a few lanes so the names of neighbouring genes do not overlap
+    df_track = df_genes.copy()
+    df_track['lane'] = np.arange(len(df_track.index)) % gv.region_lanes
+    track = figure(
+        width=setwidth,
+        height=40 + 30*gv.region_lanes,
+        x_range=p.x_range,
+        y_range=(-0.5, gv.region_lanes - 0.5),
+        tools="hover,xpan,xwheel_zoom,reset",
+        x_axis_label = "Position on chromosome",
+        min_border_left=65
+    )
+    track.yaxis.visible = False
+    track.ygrid.grid_line_color = None
+    tracksource = ColumnDataSource(df_track)
+    track.segment('start', 'lane', 'end', 'lane', line_width=6, line_color=gv.pss_color_ns, source=tracksource)
+    track.text('mid', 'lane', text='relgene', text_font_size=textsize, text_align='center', text_baseline='bottom', y_offset=-5, source=tracksource)
+    track.select(type=HoverTool).tooltips = [
+        ('Gene', '@relgene'),
+        ('Start', '@start'),
+        ('End', '@end'),
+        ('Strand', '@orientation'),
+    ]
+
+    c = column(children=[p, track], responsive=True)
+    with timing.span('components'):
+        script, div = components(c, CDN)
+    return script, div
+
+
+##########################################################
+# 6. Correlation heatmap                                 #
+##########################################################
+
+@timing.timed('bokeh')
+def correlation_heatmap(title, df, textsize, setsize=900):
+    # df holds one row per pair of screens (see cf.df_correlations), pairs without a correlation are left blank
+    TOOLS = "resize,hover,save,pan,wheel_zoom,box_zoom,reset"
+    names = list(pd.unique(df['screen1']))
+    mapper = LinearColorMapper(palette=gv.correlation_palette, low=-1, high=1)
+    p = figure(
+        width=setsize,
+        height=setsize,
+        x_range=names,
+        y_range=names[::-1],
+        tools=[TOOLS],
+        title=title,
+        x_axis_location='above',
+        min_border_left=65
+    )
+    p.grid.grid_line_color = None
+    p.axis.major_label_text_font_size = textsize
+    p.xaxis.major_label_orientation = pi/3
+    source = ColumnDataSource(df[df['r'].notnull()])
+    p.rect('screen1', 'screen2', 1, 1, fill_color={'field': 'r', 'transform': mapper}, line_color=None, source=source)
+    hover = p.select(type=HoverTool)
+    hover.tooltips = [
+        ('Screens', '@screen1 / @screen2'),
+        ('Correlation (r)', '@r'),
+        ('Shared genes', '@shared'),
+    ]
+    r = row(children=[p], responsive=True)
+    with timing.span('components'):
+        script, div = components(r, CDN)
     return script, div
@@ -0,0 +1,119 @@
+# Signal handlers that keep the caches and stores of Phenosaurus in line with the database
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+from django.db import transaction
+
+# Import other custom phenosaurus functions
+import datastore
+import geneindex
+import genematrix
+import correlations
+import neighbours
+import intervals
+import permissions
+import tracks
+import models as db
+
+# Other general libraries
+import threading
+
+
+def on_commit_once(func):
+    # Runs func once the transaction has been committed, but only once however many rows of a bulk change are saved
+    connection = transaction.get_connection()
+    if not any(registered is func for savepoint_ids, registered in connection.run_on_commit):
+        transaction.on_commit(func)
+
+
+# Any change to a single datapoint (eg. through the admin) makes the columnar store of its screen stale. Imports bump
+# the versions of their screens once when they are done, as do fixtures (raw) which are followed by an import command,
+# and so does the deletion of a screen of which the datapoints are deleted along with it.
+@receiver(post_save, sender=db.IPSDatapoint)
+@receiver(post_delete, sender=db.IPSDatapoint)
+@receiver(post_save, sender=db.PSSDatapoint)
+@receiver(post_delete, sender=db.PSSDatapoint)
+def datapoint_changed(sender, instance, **kwargs):
+    if kwargs.get('raw') or datastore.is_importing() or instance.relscreen_id in deleting_screens():
+        return
+    datastore.bump_screen_version(instance.relscreen_id)
+    datastore.bump_dataset_version()
+
+
+# The update history is shown with the data, a new entry usually comes with an import
+@receiver(post_save, sender=db.UpdateHistory)
+@receiver(post_delete, sender=db.UpdateHistory)
+def updatehistory_changed(sender, instance, **kwargs):
+    datastore.bump_dataset_version()
+
+
+# Adding, renaming or removing screens changes the rows of the gene matrix and the correlations of the screens, which are
+# updated if they have been built
+@receiver(post_save, sender=db.Screen)
+@receiver(post_delete, sender=db.Screen)
+def screen_changed(sender, instance, **kwargs):
+    datastore.bump_version(genematrix.screens_version_key)
+    permissions.permissions_changed()
+    if genematrix.read_meta() is not None:
+        on_commit_once(update_gene_matrix)
+
+def update_gene_matrix():
+    try:
+        genematrix.update_gene_matrix()
+        neighbours.update_neighbour_matrix()
+        if correlations.correlations_exist():
+            correlations.update_correlations()
+    except (IOError, OSError):
+        pass    # Lookups fall back to the database as long as the matrix is stale
+
+# The screens being deleted by this thread, their datapoints are deleted (and signalled) one by one before the screen
+_deleting = threading.local()
+
+def deleting_screens():
+    if not hasattr(_deleting, 'screenids'):
+        _deleting.screenids = set()
+    return _deleting.screenids
+
+@receiver(pre_delete, sender=db.Screen)
+def screen_deleting(sender, instance, **kwargs):
+    deleting_screens().add(instance.id)
+
+@receiver(post_delete, sender=db.Screen)
+def screen_deleted(sender, instance, **kwargs):
+    deleting_screens().discard(instance.id)
+    datastore.bump_screen_version(instance.id)
+    datastore.bump_dataset_version()
+
+
+# Granting or revoking access to screens changes the authorized screens of the groups in every worker
+@receiver(post_save, sender=db.ScreenPermissions)
+@receiver(post_delete, sender=db.ScreenPermissions)
+def screenpermissions_changed(sender, instance, **kwargs):
+    permissions.permissions_changed()
+
+
+# Adding, renaming or removing genes invalidates the gene index of every worker, and the gene ids of the tracks
+@receiver(post_save, sender=db.Gene)
+@receiver(post_delete, sender=db.Gene)
+def gene_changed(sender, instance, **kwargs):
+    geneindex.genes_changed()
+    if genematrix.read_meta() is not None:
+        on_commit_once(update_gene_matrix)     # The columns of the matrix are the genes, this rebuilds it
+    on_commit_once(tracks.reencode_tracks)
+
+
+# The same for the interval index of the locations of the genes
+@receiver(post_save, sender=db.Location)
+@receiver(post_delete, sender=db.Location)
+def location_changed(sender, instance, **kwargs):
+    intervals.locations_changed()
+
+
+# The names of the genes of a track are validated once, when it is saved, and stored as gene ids
+@receiver(pre_save, sender=db.CustomTracks)
+def customtrack_saving(sender, instance, **kwargs):
+    instance.geneids = tracks.encode_genelist(instance.genelist)
+
+@receiver(post_save, sender=db.CustomTracks)
+@receiver(post_delete, sender=db.CustomTracks)
+def customtrack_changed(sender, instance, **kwargs):
+    tracks.tracks_changed()
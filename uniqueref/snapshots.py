@@ -0,0 +1,143 @@
+# Static snapshots of the fishtail plots of the public screens
+#
+# Most visits of the public deployment are of the fishtail plot of a public screen at the default settings (the p-value
+# cutoff gv.pvdc, the initial text size of the form, oca=gc and all significant genes labelled). The script and div of the plot
+# and the tables of its significant genes are rendered once per screen to datastore/snapshots/screen_<id>.json, which
+# every worker can serve without touching the database or Bokeh. A snapshot is stamped with the versions it was drawn
+# from: those of the screen, the permissions (the titles and gene plot links), the genes and the code. A snapshot of
+# which any of them has changed is ignored until it is rendered again. Run the snapshot_public_screens command once to
+# start keeping snapshots; from then on import_datapoints re-renders the snapshots of the screens it has imported.
+# Imports through the admin leave that to the command, so an admin request never renders a batch of plots.
+
+# Import other custom phenosaurus functions
+import globalvars as gv
+import custom_functions as cf
+import plots
+import datastore
+import permissions
+import geneindex
+import conditional
+
+# Other general libraries
+import pandas as pd
+import logging
+import json
+import os
+
+
+logger = logging.getLogger('uniqueref.snapshots')
+
+
+##########################################################
+# 1. Rendering of fishtail plots                         #
+##########################################################
+
+def render_fishtail(screenid, version, pvcutoff, sag, oca, textsize, showtable, datamode, trackids, authorized_screens):
+    # The script and div of the fishtail plot of a screen, and with showtable the tables of its significant genes
+    rendered = {}
+    title = cf.title_single_screen_plot(screenid, authorized_screens)
+    df_tracks = cf.generate_track_overlay(screenid, trackids, authorized_screens)
+    if datamode:
+        # Only the ranges of the axes are set here, the browser fetches the datapoints from IPSFishtailData
+        # or, with lod, from IPSFishtailLOD.
+        # The version in the url lets the browser cache the data until the screen is re-imported
+        columns = dict(cf.generate_fishtail_arrays(screenid, pvcutoff, authorized_screens))
+        df = pd.DataFrame({'logmi': columns['logmi'], 'loginsertions': columns['loginsertions']})
+        query = '?screen=%d&pvalue=%s&v=%s' % (int(screenid), pvcutoff, version)
+        if datamode == 'lod':
+            rendered['script'], rendered['div'] = plots.fishtail(title, df, sag, oca, textsize, authorized_screens, lod_url='/uniqueref/simpleplot/lod/' + query, df_tracks=df_tracks)
+        else:
+            rendered['script'], rendered['div'] = plots.fishtail(title, df, sag, oca, textsize, authorized_screens, data_url='/uniqueref/simpleplot/data/' + query, df_tracks=df_tracks)
+    else:
+        df,legend = cf.generate_df_pips(screenid, pvcutoff, authorized_screens)
+        rendered['script'], rendered['div'] = plots.fishtail(title, df, sag, oca, textsize, authorized_screens, df_tracks=df_tracks) # The script and div that is generated by the pfishtailplot function and contains all plotting info
+    # If the user want's to display a table of all datapoints call generate_ips_tophits function to make the table
+    if showtable == "on":
+        if datamode:
+            df,legend = cf.generate_df_pips(screenid, pvcutoff, authorized_screens)
+        rendered['negreg'], rendered['posreg'] = cf.generate_ips_tophits_list(df)
+    return rendered
+
+
+##########################################################
+# 2. Snapshots                                           #
+##########################################################
+
+def snapshots_dir():
+    return os.path.join(gv.datastore_dir, 'snapshots')
+
+def snapshot_path(screenid):
+    return os.path.join(snapshots_dir(), 'screen_%d.json' % int(screenid))
+
+def snapshots_enabled():
+    return os.path.isdir(snapshots_dir())
+
+def is_default(pvcutoff, sag, oca, textsize, datamode, trackids):
+    # Whether a fishtail plot is drawn at the settings of the snapshots
+    return (pvcutoff == gv.pvdc and sag == 'on' and oca == 'gc' and textsize == gv.initial_text_size
+            and not datamode and not trackids)
+
+def public_screens():
+    return permissions.get_authorized([gv.public_group_id])
+
+def snapshot_stamp(screenid):
+    return {
+        'screen': datastore.get_screen_version(screenid),
+        'permissions': datastore.get_version(permissions.permissions_version_key),
+        'genes': datastore.get_version(geneindex.gene_version_key),
+        'code': repr(conditional.code_version),
+    }
+
+def read_snapshot(screenid, authorized_screens):
+    # The rendered plot and tables of a screen, or None if there is no up to date snapshot or if the user may see
+    # other screens than the public ones (which the gene plot links of the snapshot are made for)
+    if list(authorized_screens) != list(public_screens()):
+        return None
+    try:
+        with open(snapshot_path(screenid)) as f:
+            snapshot = json.load(f)
+    except (IOError, ValueError):
+        return None
+    if snapshot.get('stamp') != snapshot_stamp(screenid):
+        return None
+    return snapshot['rendered']
+
+def write_snapshot(screenid):
+    # The stamp is taken before rendering, a screen that changes meanwhile leaves a snapshot that is already stale
+    stamp = snapshot_stamp(screenid)
+    rendered = render_fishtail(screenid, stamp['screen'], gv.pvdc, 'on', 'gc', gv.initial_text_size, 'on', '', [],
+                               list(public_screens()))
+    datastore._atomic_write(snapshot_path(screenid), json.dumps({'stamp': stamp, 'rendered': rendered}))
+
+def update_snapshots(screenids=None, full=False, stdout=None):
+    # Renders the snapshots of the public IP screens of screenids (all of them by default) of which the snapshot is
+    # missing or stale, or all of them if full is True, and removes those of screens that are no longer public.
+    # Returns the number of snapshots rendered. A screen that fails to render is logged and skipped, it is drawn live
+    # until its snapshot is rendered.
+    rendered = 0
+    try:
+        public = public_screens().of_type('IP')
+        datastore._makedirs(snapshots_dir())
+        for filename in os.listdir(snapshots_dir()):
+            screenid = filename[len('screen_'):-len('.json')]
+            if filename.startswith('screen_') and filename.endswith('.json') and screenid.isdigit() and int(screenid) not in public:
+                os.remove(os.path.join(snapshots_dir(), filename))
+    except (IOError, OSError):
+        logger.exception('Could not update the snapshots directory')
+        return rendered
+    if screenids is not None:
+        screenids = set(int(i) for i in screenids)
+        public = [i for i in public if i in screenids]
+    for screenid in public:
+        if full or read_snapshot(screenid, public_screens()) is None:
+            try:
+                write_snapshot(screenid)
+            except Exception:
+                logger.exception('Could not render the snapshot of screen %d' % screenid)
+                if stdout is not None:
+                    stdout.write('Could not render the snapshot of screen %d' % screenid)
+                continue
+            rendered += 1
+            if stdout is not None:
+                stdout.write('Rendered the snapshot of screen %d' % screenid)
+    return rendered
@@ -1,3 +1,385 @@
-from django.test import TestCase
+from django.test import TestCase, SimpleTestCase, Client
+from django.db.models import F
+from django.contrib.auth.models import Group, User
 
-# Create your tests here.
+# Import other custom phenosaurus functions
+import globalvars as gv
+import benchmark
+import caches
+import binarydata
+import custom_functions as cf
+import ips_uniquefinder
+import geneindex
+import permissions
+import models as db
+import tracks
+import intervals
+import datastore
+import genematrix
+import correlations
+import neighbours
+import snapshots
+
+# Other general libraries
+import numpy as np
+import tempfile
+import shutil
+import struct
+import json
+
+
+def pairwise_corrcoef(x, y):
+	# The Pearson correlation of x and y over the positions where both are measured
+	both = ~np.isnan(x) & ~np.isnan(y)
+	return np.corrcoef(x[both], y[both])[0, 1]
+
+
+class SyntheticDataTestCase(TestCase):
+	"""Base class for tests that need a small synthetic database and a private datastore directory."""
+
+	n_screens = 3
+	n_genes = 200
+
+	def setUp(self):
+		self.old_datastore_dir = gv.datastore_dir
+		gv.datastore_dir = tempfile.mkdtemp()
+		caches.fishtail_cache.clear()
+		self.screenids = benchmark.generate_synthetic_data(n_screens=self.n_screens, n_genes=self.n_genes, n_pss_screens=1)
+
+	def tearDown(self):
+		shutil.rmtree(gv.datastore_dir)
+		gv.datastore_dir = self.old_datastore_dir
+
+
+class BenchmarkTest(SyntheticDataTestCase):
+	"""Runs the benchmark suite once on a tiny dataset, which exercises every hot path and view."""
+
+	def test_run_benchmarks(self):
+		results = benchmark.run_benchmarks(repeat=1, n_plot_genes=3)
+		self.assertEqual(results['scale']['ip_screens'], self.n_screens)
+		self.assertEqual(results['scale']['datapoints_per_screen'], self.n_genes)
+		for name, timing in results['benchmarks'].items():
+			self.assertEqual(len(timing['runs']), 1, name)
+
+
+class BinaryDataTest(SimpleTestCase):
+	"""The layout of the payloads of binarydata.pack_columns, as read by the browser."""
+
+	def test_pack_columns(self):
+		columns = [
+			('logmi', np.array([0.5, -1.25, np.nan], dtype=np.float32)),
+			('colorcode', np.array([0, 1, 2], dtype=np.uint8)),
+			('relgene', np.array(['EZH2', 'SUZ12', 'EED'], dtype=object)),
+		]
+		payload = binarydata.pack_columns(columns, version='1')
+		header_length = struct.unpack('<I', payload[:4])[0]
+		self.assertEqual((4 + header_length) % 8, 0)
+		header = json.loads(payload[4:4 + header_length].decode('utf-8'))
+		self.assertEqual(header['version'], '1')
+		self.assertEqual([m['name'] for m in header['columns']], ['logmi', 'colorcode', 'relgene'])
+		for meta, (name, values) in zip(header['columns'], columns):
+			self.assertEqual(meta['offset'] % 8, 0)
+			self.assertEqual(meta['length'], len(values))
+			blob = payload[meta['offset']:meta['offset'] + meta['bytes']]
+			if meta['dtype'] == 'utf8':
+				self.assertEqual(blob.decode('utf-8').split('\n'), list(values))
+			else:
+				np.testing.assert_array_equal(np.frombuffer(blob, dtype=np.dtype(meta['dtype']).newbyteorder('<')), values)
+
+	def test_unsupported_dtype(self):
+		with self.assertRaises(ValueError):
+			binarydata.pack_columns([('insertions', np.array([1, 2], dtype=np.int64))])
+
+
+class LevelOfDetailTest(SyntheticDataTestCase):
+	"""The datapoints of the visible window of a fishtail plot drawn with a level of detail."""
+
+	def setUp(self):
+		super(LevelOfDetailTest, self).setUp()
+		self.screenid = self.screenids[0]
+		self.authorized_screens = list(cf.get_authorized_screens_from_gids([gv.public_group_id]))
+		self.columns = dict(cf.generate_fishtail_arrays(self.screenid, gv.pvdc, self.authorized_screens))
+
+	def test_significant_genes_keep_their_pvalues(self):
+		lod = cf.fishtail_level_of_detail(self.screenid, gv.pvdc, self.authorized_screens, significant=True)
+		significant = self.columns['colorcode'] > 0
+		self.assertTrue(significant.any())
+		self.assertEqual(lod['significant']['fcpv'], self.columns['fcpv'][significant].tolist())
+
+	def test_aggregation(self):
+		max_points = gv.lod_max_points
+		gv.lod_max_points = 10
+		try:
+			lod = cf.fishtail_level_of_detail(self.screenid, gv.pvdc, self.authorized_screens)
+		finally:
+			gv.lod_max_points = max_points
+		self.assertTrue(lod['aggregated'])
+		self.assertEqual(lod['points']['relgene'], [])
+		x, y = self.columns['loginsertions'], self.columns['logmi']
+		inside = (self.columns['colorcode'] == 0) & np.isfinite(x) & np.isfinite(y)
+		self.assertEqual(sum(lod['bins']['count']), inside.sum())
+
+	def test_invalid_windows(self):
+		client = Client()
+		for window in ('x0=inf&x1=1&y0=-1&y1=1', 'x0=nan&x1=1&y0=-1&y1=1', 'x0=2&x1=1&y0=-1&y1=1', 'x0=0&x1=1&y0=1&y1=1'):
+			response = client.get('/uniqueref/simpleplot/lod/?screen=%d&%s' % (self.screenid, window))
+			self.assertEqual(response.status_code, 400, window)
+		response = client.get('/uniqueref/simpleplot/lod/?screen=%d&x0=0&x1=1&y0=-1&y1=1' % self.screenid)
+		self.assertEqual(response.status_code, 200)
+
+
+class UniqueFinderTest(SyntheticDataTestCase):
+	"""The engine of the unique hit finder on a few hand-made genes."""
+
+	def test_find_unique_hits(self):
+		geneids = geneindex.get_gene_index().ids[:3]
+		query = {
+			'relgene_id': geneids,
+			'loginsertions': np.array([1.0, 2.0, 3.0]),
+			'logmi': np.array([1.0, -1.0, 0.5]),
+			'fcpv': np.array([0.01, 0.01, 0.5]),
+			'signclass': np.array([2, 1, 2]),
+		}
+		other_logmi = np.array([[1.2, 0.8, np.nan], [np.nan, -2.0, np.nan]])
+		other_fcpv = np.array([[0.01, 0.01, np.nan], [np.nan, 0.5, np.nan]])
+		df = ips_uniquefinder.find_unique_hits(query, other_logmi, other_fcpv, 0.05, min_difference=0.3)
+		# Significant in another screen in the same direction
+		self.assertFalse(df['unique'][0])
+		self.assertEqual(df['n_sig_others'][0], 1)
+		# Only significant elsewhere in the opposite direction
+		self.assertTrue(df['unique'][1])
+		self.assertAlmostEqual(df['mean_other_logmi'][1], -0.6)
+		self.assertAlmostEqual(df['difference'][1], -0.4)
+		self.assertTrue(df['shifted'][1])
+		# Not significant and not measured in any other screen
+		self.assertFalse(df['unique'][2])
+		self.assertTrue(np.isnan(df['mean_other_logmi'][2]))
+		self.assertFalse(df['shifted'][2])
+
+	def test_finite_max(self):
+		self.assertEqual(ips_uniquefinder.finite_max(np.array([np.nan, np.nan]), 1), 1)
+		self.assertEqual(ips_uniquefinder.finite_max(np.array([]), 1), 1)
+		self.assertEqual(ips_uniquefinder.finite_max(np.array([np.nan, 2.0, np.inf]), 1), 2.0)
+
+
+class PermissionsTest(SyntheticDataTestCase):
+	"""The screens of the groups are reloaded after a change to the permissions, and only then."""
+
+	def test_permissions_follow_changes(self):
+		group = Group.objects.create(name='lab')
+		self.assertEqual(len(permissions.get_authorized([group.id])), 0)
+		permission = db.ScreenPermissions.objects.create(relscreen_id=self.screenids[0], relgroup=group)
+		self.assertEqual(list(permissions.get_authorized([group.id])), [self.screenids[0]])
+		self.assertIn(self.screenids[0], permissions.get_authorized([group.id, gv.public_group_id]))
+		permission.delete()
+		self.assertEqual(len(permissions.get_authorized([group.id])), 0)
+
+	def test_permissions_are_kept(self):
+		loaded = permissions.get_screen_permissions()
+		self.assertIs(permissions.get_screen_permissions(), loaded)
+		self.assertIs(permissions.get_authorized([gv.public_group_id]), permissions.get_authorized([gv.public_group_id]))
+
+
+class TracksTest(SyntheticDataTestCase):
+	"""The gene ids of the custom tracks."""
+
+	def test_encode_genelist(self):
+		gene_index = geneindex.get_gene_index()
+		names = list(gene_index.get_names(gene_index.ids[:3]))
+		encoded = tracks.encode_genelist(' '.join([names[2], names[0], 'NOSUCHGENE', names[2]]))
+		geneids = tracks.decode_geneids(encoded)
+		self.assertEqual(list(geneids), sorted(gene_index.get_ids([names[0], names[2]])))
+		track = tracks.Track(1, 'track', geneids, tracks.track_color(0))
+		membership = tracks.track_membership(gene_index.ids[:3], [track])
+		self.assertEqual(membership.tolist(), [[True, False, True]])
+
+	def test_reencode_tracks(self):
+		user = User.objects.get(username='synthetic')
+		track = db.CustomTracks.objects.create(user=user, name='late', description='', genelist='LATEGENE')
+		self.assertEqual(len(tracks.get_tracks([track.id])[0].geneids), 0)
+		gene = db.Gene.objects.create(name='LATEGENE', description='', chromosome='1', orientation='+')
+		self.assertEqual(tracks.reencode_tracks(), 1)
+		self.assertEqual(list(tracks.get_tracks([track.id])[0].geneids), [gene.id])
+		self.assertEqual(tracks.reencode_tracks(), 0)
+
+
+class IntervalsTest(SyntheticDataTestCase):
+	"""The parsing of regions and the interval index of the locations of the genes."""
+
+	def test_parse_region(self):
+		self.assertEqual(intervals.parse_region('chr7:100,000,000-101,000,000'), ('7', 100000000, 101000000))
+		self.assertEqual(intervals.parse_region('7 2000-1000'), ('7', 1000, 2000))
+		self.assertEqual(intervals.parse_region('x:1-10'), ('X', 1, 10))
+		for region in ['', None, 'chr7', 'chr7:a-b', 'chr123:1-10']:
+			self.assertRaises(ValueError, intervals.parse_region, region)
+
+	def test_chromosome_intervals(self):
+		chromosome = intervals.ChromosomeIntervals(np.array([1, 2, 3]), np.array([100, 5000, 10]), np.array([200, 6000, 9000]))
+		# The long location of gene 3 starts well before the window but spans it
+		self.assertEqual(sorted(chromosome.geneids[chromosome.overlapping(3000, 4000)]), [3])
+		# Both ends are inclusive
+		self.assertEqual(sorted(chromosome.geneids[chromosome.overlapping(200, 200)]), [1, 3])
+		self.assertEqual(sorted(chromosome.geneids[chromosome.overlapping(6000, 7000)]), [2, 3])
+		self.assertEqual(len(chromosome.overlapping(9001, 10000)), 0)
+
+	def test_query(self):
+		gene = db.Gene.objects.create(name='SPLITGENE', description='', chromosome='Y', orientation='-')
+		db.Location.objects.create(relgene=gene, startpos=2000000000, endpos=2000001000)
+		db.Location.objects.create(relgene=gene, startpos=2000005000, endpos=2000003000)
+		geneids, starts, ends = intervals.get_interval_index().query('y', 1999999000, 2000010000)
+		self.assertEqual(list(geneids), [gene.id])
+		self.assertEqual((starts[0], ends[0]), (2000000000, 2000005000))
+
+
+class CorrelationsTest(SyntheticDataTestCase):
+	"""The correlations of the screens, computed in blocks and updated incrementally."""
+
+	def test_correlation_block(self):
+		random = np.random.RandomState(0)
+		logmi = random.normal(size=(5, 300))
+		logmi[:, :150] += random.normal(size=150)    # Correlated screens
+		logmi[random.uniform(size=logmi.shape) < 0.1] = np.nan
+		corr, shared = correlations.correlation_block(logmi, np.array([0, 1]), np.arange(5), gene_block=64)
+		for i in range(2):
+			for j in range(5):
+				both = ~np.isnan(logmi[i]) & ~np.isnan(logmi[j])
+				self.assertEqual(shared[i, j], both.sum())
+				self.assertAlmostEqual(corr[i, j], pairwise_corrcoef(logmi[i], logmi[j]), places=5)
+
+	def test_incremental_update(self):
+		genematrix.rebuild_gene_matrix()
+		self.assertEqual(correlations.update_correlations(full=True), len(genematrix.ip_screen_names()))
+		screenid = sorted(genematrix.ip_screen_names())[0]
+		db.IPSDatapoint.objects.filter(relscreen_id=screenid).update(logmi=F('logmi') * -1)
+		datastore.bump_screen_version(screenid)
+		genematrix.update_gene_matrix([screenid])
+		self.assertEqual(correlations.update_correlations(), 1)
+		incremental = correlations.get_correlations()
+		corr, shared = incremental.corr.copy(), incremental.shared.copy()
+		correlations.update_correlations(full=True)
+		np.testing.assert_allclose(corr, correlations.get_correlations().corr, atol=1e-6)
+		np.testing.assert_array_equal(shared, correlations.get_correlations().shared)
+
+
+class NeighboursTest(SyntheticDataTestCase):
+	"""The nearest genes of the normalised matrix against a plain computation over the gene matrix."""
+
+	n_screens = 8
+	n_genes = 100
+
+	def setUp(self):
+		super(NeighboursTest, self).setUp()
+		geneids = geneindex.get_gene_index().ids
+		self.screens = sorted(genematrix.ip_screen_names())
+		# Leave genes out of some screens
+		db.IPSDatapoint.objects.filter(relscreen_id=self.screens[0], relgene_id__in=[int(i) for i in geneids[::3]]).delete()
+		db.IPSDatapoint.objects.filter(relscreen_id=self.screens[1], relgene_id__in=[int(i) for i in geneids[1::4]]).delete()
+		genematrix.rebuild_gene_matrix()
+		self.assertTrue(neighbours.update_neighbour_matrix())
+		self.geneid = int(geneids[2])
+
+	def expected_nearest(self, screenids, k, min_shared):
+		matrix = genematrix.get_gene_matrix()
+		rows = [matrix.screen_pos[i] for i in screenids]
+		logmi = np.array(matrix.arrays['logmi'][rows], dtype=np.float64)
+		x = logmi[:, matrix.gene_positions([self.geneid])[0]]
+		r = np.full(len(matrix.gene_ids), np.nan)
+		with np.errstate(all='ignore'):
+			for j, geneid in enumerate(matrix.gene_ids):
+				both = ~np.isnan(x) & ~np.isnan(logmi[:, j])
+				if geneid != self.geneid and both.sum() >= min_shared:
+					r[j] = pairwise_corrcoef(x, logmi[:, j])
+		candidates = np.nonzero(~np.isnan(r))[0]
+		candidates = candidates[np.argsort(-r[candidates], kind='mergesort')[:k]]
+		return matrix.gene_ids[candidates], r[candidates]
+
+	def check_nearest(self, screenids):
+		geneids, r, shared = neighbours.get_neighbour_matrix().nearest(self.geneid, screenids, k=5, min_shared=3)
+		expected_geneids, expected_r = self.expected_nearest(screenids, 5, 3)
+		self.assertEqual(list(geneids), list(expected_geneids))
+		np.testing.assert_allclose(r, expected_r, atol=1e-4)
+
+	def test_all_screens(self):
+		self.check_nearest(self.screens)
+
+	def test_subset_of_screens(self):
+		self.check_nearest(self.screens[:4])
+
+
+class ConditionalPageTest(SyntheticDataTestCase):
+	"""Repeat visits of a page get a 304 until the data the page is drawn from changes."""
+
+	def setUp(self):
+		super(ConditionalPageTest, self).setUp()
+		self.client = Client()
+		self.screenid = sorted(genematrix.ip_screen_names())[0]
+		self.url = '/uniqueref/simpleplot/?screen=%d&pvalue=0.05&textsize=11px&oca=gc' % self.screenid
+
+	def test_not_modified(self):
+		response = self.client.get(self.url)
+		self.assertEqual(response.status_code, 200)
+		self.assertTrue(response.has_header('Last-Modified'))
+		etag = response['ETag']
+		self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+		datastore.bump_screen_version(self.screenid)
+		response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 200)
+		self.assertNotEqual(response['ETag'], etag)
+
+	def test_listgenes(self):
+		response = self.client.get('/uniqueref/listgenes/json/?page=1')
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(self.client.get('/uniqueref/listgenes/json/?page=1', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+class SnapshotsTest(SyntheticDataTestCase):
+	"""The fishtail plots of the public screens at the default settings are served from their snapshot while it is up to date."""
+
+	marker = '<div id="snapshot-marker"></div>'
+
+	def setUp(self):
+		super(SnapshotsTest, self).setUp()
+		self.client = Client()
+		self.screens = sorted(genematrix.ip_screen_names())
+		self.url = '/uniqueref/simpleplot/?screen=%d&pvalue=0.05&textsize=11px&oca=gc&sag=on&showtable=on' % self.screens[0]
+
+	def mark_snapshot(self, screenid):
+		# Replaces the plot of a snapshot by the marker, so a response tells whether it was served from the snapshot
+		with open(snapshots.snapshot_path(screenid)) as f:
+			snapshot = json.load(f)
+		snapshot['rendered']['div'] = self.marker
+		with open(snapshots.snapshot_path(screenid), 'w') as f:
+			json.dump(snapshot, f)
+		caches.fishtail_cache.clear()
+
+	def test_snapshots(self):
+		self.assertEqual(snapshots.update_snapshots(), len(self.screens))
+		self.assertEqual(snapshots.update_snapshots(), 0)
+		for screenid in self.screens:
+			self.assertIsNotNone(snapshots.read_snapshot(screenid, snapshots.public_screens()))
+		self.mark_snapshot(self.screens[0])
+		self.assertIn(self.marker, self.client.get(self.url).content)
+
+	def test_stale_snapshot(self):
+		snapshots.update_snapshots()
+		self.mark_snapshot(self.screens[0])
+		datastore.bump_screen_version(self.screens[0])
+		self.assertIsNone(snapshots.read_snapshot(self.screens[0], snapshots.public_screens()))
+		self.assertNotIn(self.marker, self.client.get(self.url).content)
+		self.assertEqual(snapshots.update_snapshots(), 1)
+
+
+class ScreenDeletionTest(SyntheticDataTestCase):
+	"""Deleting a screen bumps its version once, not once for every datapoint deleted along with it."""
+
+	def test_delete_screen(self):
+		screenid = sorted(genematrix.ip_screen_names())[0]
+		bumped = []
+		bump_screen_version = datastore.bump_screen_version
+		datastore.bump_screen_version = lambda i: bumped.append(i) or bump_screen_version(i)
+		try:
+			db.Screen.objects.get(id=screenid).delete()
+		finally:
+			datastore.bump_screen_version = bump_screen_version
+		self.assertEqual(bumped, [screenid])
+		self.assertFalse(db.IPSDatapoint.objects.filter(relscreen_id=screenid).exists())
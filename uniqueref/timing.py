@@ -0,0 +1,134 @@
+# Per-request timing of the stages of the plot pipeline
+#
+# Wrap a stage in 'with timing.span("pandas"):', or decorate a function with '@timing.timed("bokeh")', to record how
+# long it took. Spans may be nested, a span only counts the time not spent in the spans inside it.
+# ServerTimingMiddleware collects the spans of a request, adds them together with the number of database queries and
+# their duration to the Server-Timing header of the response (visible in the network tab of the browser) and writes
+# them as a JSON line to a rotating log, see the summarize_timing command. To enable it, add 'uniqueref.timing.ServerTimingMiddleware' to the
+# MIDDLEWARE setting. Without the middleware spans cost next to nothing and are not recorded.
+
+# Import Django related libraries and functions
+from django.db import connection
+
+# Import other custom phenosaurus functions
+import globalvars as gv
+
+# Other general libraries
+from logging.handlers import RotatingFileHandler
+from collections import OrderedDict
+from functools import wraps
+import threading
+import logging
+import json
+import time
+import os
+
+
+_local = threading.local()
+logger = logging.getLogger('uniqueref.timing')
+
+
+class span(object):
+    """Context manager that adds the time spent inside it to the stage 'name' of the current request."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        stack = getattr(_local, 'stack', None)
+        if stack is not None:
+            stack.append(0.0)   # The time spent in nested spans
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        spans = getattr(_local, 'spans', None)
+        if spans is not None:
+            elapsed = time.time() - self.start
+            nested = _local.stack.pop()
+            spans[self.name] = spans.get(self.name, 0.0) + elapsed - nested
+            if _local.stack:
+                _local.stack[-1] += elapsed
+        return False
+
+
+def timed(name):
+    # Decorator version of span
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def start_recording():
+    _local.spans = OrderedDict()
+    _local.stack = []
+
+def stop_recording():
+    spans = getattr(_local, 'spans', None)
+    _local.spans = None
+    _local.stack = None
+    return spans or OrderedDict()
+
+def server_timing_header(spans, total, queries, query_time):
+    # Durations in the Server-Timing header are in milliseconds
+    metrics = ['%s;dur=%.1f' % (name, 1000 * duration) for name, duration in spans.items()]
+    metrics.append('db;dur=%.1f;desc="%d queries"' % (1000 * query_time, queries))
+    metrics.append('total;dur=%.1f' % (1000 * total))
+    return ', '.join(metrics)
+
+def timing_log_path():
+    return os.path.join(gv.datastore_dir, 'logs', 'timing.log')
+
+def configure_logger():
+    # Only attach the rotating file handler if the logging configuration of the project did not already do so
+    if not logger.handlers:
+        path = timing_log_path()
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            handler = RotatingFileHandler(path, maxBytes=gv.timing_log_max_bytes, backupCount=gv.timing_log_backups)
+        except (IOError, OSError):
+            handler = logging.NullHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+
+class ServerTimingMiddleware(object):
+    """Adds a Server-Timing header with per-stage durations and the query count to every response, and logs it."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        configure_logger()
+
+    def __call__(self, request):
+        # Record the queries of this request, Django only does this by default if DEBUG is on
+        force_debug_cursor = connection.force_debug_cursor
+        connection.force_debug_cursor = True
+        queries_before = len(connection.queries_log)
+        start_recording()
+        start = time.time()
+        try:
+            response = self.get_response(request)
+        finally:
+            total = time.time() - start
+            spans = stop_recording()
+            queries = list(connection.queries_log)[queries_before:]
+            connection.force_debug_cursor = force_debug_cursor
+        query_time = sum(float(q.get('time') or 0) for q in queries)
+
+        response['Server-Timing'] = server_timing_header(spans, total, len(queries), query_time)
+        logger.info(json.dumps(OrderedDict([
+            ('time', start),
+            ('path', request.path),
+            ('status', response.status_code),
+            ('total', total),
+            ('queries', len(queries)),
+            ('query_time', query_time),
+            ('spans', spans),
+        ])))
+        return response
@@ -0,0 +1,87 @@
+# Custom tracks (named sets of genes) as arrays of gene ids
+#
+# CustomTracks.genelist holds the names of the genes as typed by the user. When a track is saved, signals.py validates
+# the names against the gene index once and stores the ids of the genes that exist in CustomTracks.geneids as int32.
+# After a change to the genes all tracks are validated again, so a gene added later becomes a member of the tracks
+# that name it.
+# Every worker keeps the sorted ids of the tracks it has used in caches.track_cache, keyed on the 'tracks' version
+# marker (see datastore.py) that is bumped whenever a track is saved or deleted. Membership of the genes of a screen is
+# then one vectorised np.in1d per track.
+
+# Import other custom phenosaurus functions
+import globalvars as gv
+import models as db
+import datastore
+import caches
+from geneindex import get_gene_index
+
+# Other general libraries
+from collections import namedtuple
+import numpy as np
+
+
+tracks_version_key = 'tracks'
+
+Track = namedtuple('Track', ['id', 'name', 'geneids', 'color'])
+
+
+def encode_genelist(genelist):
+    # The ids of the genes of a space separated list of gene names that exist, sorted, as bytes for CustomTracks.geneids
+    gene_index = get_gene_index()
+    ids = sorted(set(gene_index.name_to_id[name] for name in genelist.split() if name in gene_index))
+    return np.array(ids, dtype='<i4').tobytes()
+
+def as_bytes(geneids):
+    # The database backends return the BinaryField as bytes, buffer or memoryview
+    return geneids.tobytes() if isinstance(geneids, memoryview) else bytes(geneids)
+
+def decode_geneids(geneids):
+    return np.frombuffer(as_bytes(geneids), dtype='<i4').astype(np.int64)
+
+def track_color(position):
+    # The tracks of a plot are colored in the order they were chosen
+    colors = gv.df_custom_track_colors['color'].values
+    return colors[position % len(colors)]
+
+def get_tracks(trackids):
+    # Returns a Track for every id in trackids that exists, in the order of trackids
+    version = datastore.get_version(tracks_version_key)
+    loaded = {}
+    missing = []
+    for trackid in trackids:
+        track = caches.track_cache.get((int(trackid), version))
+        if track is None:
+            missing.append(int(trackid))
+        else:
+            loaded[int(trackid)] = track
+    if missing:
+        for trackid, name, geneids in db.CustomTracks.objects.filter(id__in=missing).values_list('id', 'name', 'geneids'):
+            loaded[trackid] = (name, decode_geneids(geneids))
+            caches.track_cache.set((trackid, version), loaded[trackid])
+    found = [int(i) for i in trackids if int(i) in loaded]
+    return [Track(trackid, loaded[trackid][0], loaded[trackid][1], track_color(position))
+            for position, trackid in enumerate(found)]
+
+def track_membership(geneids, tracks):
+    # A boolean (tracks x genes) array that tells which of geneids are in which track
+    geneids = np.asarray(geneids)
+    membership = np.zeros((len(tracks), len(geneids)), dtype=bool)
+    for i, track in enumerate(tracks):
+        membership[i] = np.in1d(geneids, track.geneids)
+    return membership
+
+def tracks_changed():
+    datastore.bump_version(tracks_version_key)
+
+def reencode_tracks():
+    # Validates the names of the genes of all tracks again, after genes have been added, renamed or removed. Returns the
+    # number of tracks of which the genes have changed.
+    changed = 0
+    for trackid, genelist, geneids in db.CustomTracks.objects.values_list('id', 'genelist', 'geneids'):
+        encoded = encode_genelist(genelist)
+        if encoded != as_bytes(geneids):
+            db.CustomTracks.objects.filter(id=trackid).update(geneids=encoded)   # update() sends no signals
+            changed += 1
+    if changed:
+        tracks_changed()
+    return changed
@@ -5,8 +5,18 @@ from .admin import phenosaurusadmin
 
 urlpatterns = [
 	url(r'^$', home, name='home'),
+	url(r'^simpleplot/lod/', IPSFishtailLOD, name='Fishtail plot level of detail'),
+	url(r'^simpleplot/data/', IPSFishtailData, name='Fishtail plot data'),
 	url(r'^simpleplot/', IPSFishtail, name='Single Intracellular Fixed Screen'),
+	url(r'^bubbleplot/', PSSBubbleplot, name='Single Positive Selection Screen'),
+	url(r'^uniquefinder/', uniquefinder, name='Unique hit finder'),
+	url(r'^export/', export_datapoints, name='Export datapoints'),
+	url(r'^correlations/', correlations, name='Screen correlations'),
+	url(r'^region/json/', region_json, name='Genomic region data'),
+	url(r'^region/', region, name='Genomic region'),
+	url(r'^listgenes/json/', listgenes_json, name='Gene catalogue'),
 	url(r'^listgenes/', listgenes, name='List all Genes'),
+	url(r'^opengenefinder/neighbours/', gene_neighbours_json, name='Gene neighbours'),
 	url(r'^opengenefinder/', opengenefinder, name='Find gene'),
 	url(r'^help/', help, name='Documentation'),
 	url(r'^updates/', updates, name='Update History'),
@@ -1,6 +1,6 @@
 # Import Django related libraries and functions
 from django.shortcuts import render, render_to_response, redirect
-from django.http import HttpResponse, HttpRequest
+from django.http import HttpResponse, HttpRequest, JsonResponse, StreamingHttpResponse
 from django.db.models import Q, Avg, Max, Min	# To find min and max values in QS
 from django.template import RequestContext
 from django.contrib import messages
@@ -15,6 +15,17 @@ import custom_functions as cf
 import plots
 import globalvars as gv
 import forms
+import datastore
+import caches
+import binarydata
+import ips_uniquefinder
+import bubbleplot
+import export
+import tracks
+import intervals
+import geneindex
+import conditional
+import snapshots
 
 # Other general libraries
 from datetime import datetime
@@ -66,17 +77,28 @@ def updates(request):
 	}
 	return render(request, "uniqueref/updates.html", context)
 
+@conditional.conditional_page(conditional.listgenes_keys)
 def listgenes(request):
-	"""Renders the list of genes page."""
+	"""Renders the list of genes page, the table itself is filled from listgenes_json."""
 	assert isinstance(request, HttpRequest)
-	authorized_screens = list(
-		get_authorized_screens(request))  # Check user groups to see which screen are allowed to be seen
 	context = {
-		'data': cf.list_genes(authorized_screens), # Call custom fucnction to draw the table
+		'page_size': gv.gene_page_size,
 		'year': datetime.now().year,
 	}
 	return render(request, "uniqueref/listgenes.html", context)
 
+@conditional.conditional_page(conditional.listgenes_keys)
+def listgenes_json(request):
+	"""Returns one page of the gene catalogue as JSON."""
+	assert isinstance(request, HttpRequest)
+	page = cf.set_positive_int(request.GET.get('page', ''), 1)
+	page_size = cf.set_positive_int(request.GET.get('page_size', ''), gv.gene_page_size, gv.max_gene_page_size)
+	sort = request.GET.get('sort', 'name')				# The column to sort on
+	order = request.GET.get('order', 'asc')				# asc or desc
+	query = request.GET.get('q', '').strip()			# Show only genes of which the name contains this
+	chromosome = request.GET.get('chromosome', '').strip()
+	return JsonResponse(cf.list_genes(page, page_size, sort, order, query, chromosome))
+
 def help(request):
 	return render(request, "uniqueref/help.html", {})
 
@@ -139,14 +161,16 @@ def get_authorized_screens(request):
 	gids = [gv.public_group_id]
 	# For user identification replace it with the following line
 	#gids = request.user.groups.values_list('id',flat=True)
-	authorized_screens = cf.get_authorized_screens_from_gids(gids)
+	authorized_screens = cf.get_authorized_screens_from_gids(gids)	# A permissions.AuthorizedScreens, iterating over it yields the screen ids
 	return authorized_screens
 
+@conditional.conditional_page(conditional.fishtail_keys)
 def IPSFishtail(request):
 	# To render the form, send it the data to display the right options based on the user and use a GET request to obtain the results
-	authorized_screens = list(get_authorized_screens(request)) # Check user groups to see which screen are allowed to be seen
-	strigefied_authorized_screens=','.join(str(i) for i in authorized_screens)	# Convert list if screens that user is allowed to see to string
-	filter = forms.SingleIPSPlotForm(input=strigefied_authorized_screens) # First load the filter from .form
+	authorized = get_authorized_screens(request)	# Check user groups to see which screen are allowed to be seen
+	authorized_screens = list(authorized)
+	track_choices = cf.authorized_tracks(request.user)	# The custom tracks the user may draw, as (id, name)
+	filter = forms.SingleIPSPlotForm(authorized=authorized, tracks=track_choices) # First load the filter from .form
 
 	# Pull the data from the URL upon submission of the form
 	screenid = request.GET.get('screen', '') 		# Screenid is parsed as a number packed in a string
@@ -155,47 +179,270 @@ def IPSFishtail(request):
 	givenpvalue = request.GET.get('pvalue', '') 	# The p-value cutoff for coloring
 	sag = request.GET.get('sag','') 				# Do all genes need to be labeled?
 	showtable = request.GET.get('showtable', '')	# Whether a table should be drawn with raw values
+	binarydata = request.GET.get('binarydata', '')	# Whether the browser loads the datapoints separately
+	lod = request.GET.get('lod', '')				# Whether the browser loads the datapoints depending on the zoom level
+	trackids = request.GET.getlist('tracks', '')	# The custom tracks of which the genes are highlighted
 
 	context = {'filter': filter, 'year': datetime.now().year}
 
 	# First check if the user has given a screen as input, otherwise raise an error
 	if request.GET:
-		if int(screenid) in authorized_screens:
+		trackids = cf.set_screenids(trackids)		# Converts the ids of the tracks to int the same way
+		if int(screenid) in authorized_screens and set(trackids).issubset(set(i for i, name in track_choices)):
 		# Then check if screen requested by the user is actually a screen that he/she is allowed to see.
 		# This may seem a bit over the top but a user may have manually changed the URL and has entered a screenid in it of
 		# screen that does not belong to this user. Although it doesn't really matter because validation always occurs too
 		# prior to quering the database and not solely by this form, it is nice to know the user isn't trying to sneak around
 			textsize = cf.set_textsize(giventextsize)	# Check the textsize given by the user
 			pvcutoff = cf.set_pvalue(givenpvalue)		# Check the p-value given by the user
-			title = cf.title_single_screen_plot(screenid, authorized_screens)
-			df,legend = cf.generate_df_pips(screenid, pvcutoff, authorized_screens)
-			context['script'], context['div'] = plots.fishtail(title, df, sag, oca, textsize, authorized_screens) # The script and div that is generated by the pfishtailplot function and contains all plotting info
-			# If the user want's to display a table of all datapoints call generate_ips_tophits function to make the table
-			if showtable == "on":
-				context['negreg'], context['posreg'] = cf.generate_ips_tophits_list(df)
+			oca, sag, showtable = cf.set_oca(oca), cf.set_switch(sag), cf.set_switch(showtable)
+			# The rendered plot only depends on the parameters below, serve it from the cache if it was drawn before
+			version = datastore.get_screen_version(screenid)
+			datamode = 'lod' if lod == "on" else 'binary' if binarydata == "on" else ''
+			tracks_version = datastore.get_version(tracks.tracks_version_key) if trackids else ''
+			key = caches.fishtail_key(screenid, version, pvcutoff, sag, oca, textsize, showtable, datamode, authorized_screens,
+									  [(i, tracks_version) for i in trackids])
+			rendered = caches.fishtail_cache.get(key)
+			if rendered is None:
+				caches.drop_stale_fishtails(screenid, version)
+				# The plots of the public screens at the default settings are served from their snapshot, if up to date
+				if snapshots.is_default(pvcutoff, sag, oca, textsize, datamode, trackids):
+					rendered = snapshots.read_snapshot(screenid, authorized_screens)
+					if rendered is not None and showtable != "on":
+						rendered = {'script': rendered['script'], 'div': rendered['div']}
+				if rendered is None:
+					rendered = snapshots.render_fishtail(screenid, version, pvcutoff, sag, oca, textsize, showtable, datamode, trackids, authorized_screens)
+				caches.fishtail_cache.set(key, rendered)
+			context.update(rendered)
 		# If previous statement returns false, the user has manually modified the GET request in an illegal way. Serve an error.
 		else:
 			context['error'] = gv.request_screen_authorization_error
 	return render(request, "uniqueref/singlescreen.html", context)
 
 
+def IPSFishtailData(request):
+	# The datapoints of a fishtail plot as typed arrays, requested by the browser when the plot was drawn with binarydata
+	authorized_screens = list(get_authorized_screens(request))
+	screenid = request.GET.get('screen', '')
+	pvcutoff = cf.set_pvalue(request.GET.get('pvalue', ''))
+	if not screenid.isdigit() or int(screenid) not in authorized_screens:
+		return HttpResponse(gv.request_screen_authorization_error, status=403)
+	version = datastore.get_screen_version(screenid)
+	key = caches.fishtail_data_key(screenid, version, pvcutoff)
+	payload = caches.fishtail_data_cache.get(key)
+	if payload is None:
+		caches.drop_stale_fishtails(screenid, version)
+		payload = binarydata.pack_columns(cf.generate_fishtail_arrays(screenid, pvcutoff, authorized_screens), version=version)
+		caches.fishtail_data_cache.set(key, payload)
+	response = HttpResponse(payload, content_type='application/octet-stream')
+	if request.GET.get('v') == version:
+		# The url changes with the version of the screen, so the response to a given url never changes
+		response['Cache-Control'] = 'private, max-age=31536000'
+	else:
+		response['Cache-Control'] = 'private, no-cache'
+	return response
+
+
+def IPSFishtailLOD(request):
+	# The datapoints of the visible window of a fishtail plot drawn with lod, requested by the browser upon zooming
+	authorized_screens = list(get_authorized_screens(request))
+	screenid = request.GET.get('screen', '')
+	pvcutoff = cf.set_pvalue(request.GET.get('pvalue', ''))
+	if not screenid.isdigit() or int(screenid) not in authorized_screens:
+		return HttpResponse(gv.request_screen_authorization_error, status=403)
+	try:
+		window = tuple(float(request.GET[i]) for i in ('x0', 'x1', 'y0', 'y1'))
+	except (KeyError, ValueError):
+		window = None		# The whole plot
+	if window is not None and not cf.valid_window(window):
+		return HttpResponse(gv.lod_window_error, status=400)
+	significant = request.GET.get('significant', '') == "on"
+	return JsonResponse(cf.fishtail_level_of_detail(screenid, pvcutoff, authorized_screens, window, significant))
+
+
+def PSSBubbleplot(request):
+	# The bubble plot of a positive selection screen, rendered plots are cached like the fishtail plots
+	authorized = get_authorized_screens(request)
+	authorized_screens = list(authorized)
+	filter = forms.BubblePlotForm(authorized=authorized)
+
+	screenid = request.GET.get('screen', '')
+	oca = request.GET.get('oca', '')
+	giventextsize = request.GET.get('textsize', '')
+	givenpvalue = request.GET.get('pvalue', '')
+	sag = request.GET.get('sag', '')
+	scaling = 'linear' if request.GET.get('scaling', '') == 'linear' else 'log'
+
+	context = {'filter': filter, 'year': datetime.now().year}
+	if request.GET:
+		if screenid.isdigit() and int(screenid) in authorized.of_type('PS'):
+			textsize = cf.set_textsize(giventextsize)
+			pvcutoff = cf.set_pvalue(givenpvalue)
+			oca, sag = cf.set_oca(oca, ('gc', 'hah'), 'gc'), cf.set_switch(sag)
+			version = datastore.get_screen_version(screenid)
+			key = caches.bubble_key(screenid, version, pvcutoff, scaling, oca, sag, textsize, authorized_screens)
+			rendered = caches.bubble_cache.get(key)
+			if rendered is None:
+				caches.drop_stale_bubbles(screenid, version)
+				rendered = {}
+				df = cf.generate_df_pss(screenid, pvcutoff, authorized_screens)
+				if df.empty:
+					rendered['error'] = gv.bubbleplot_no_data
+				else:
+					title = cf.title_single_screen_plot(screenid, authorized_screens)
+					rendered['script'], rendered['div'] = bubbleplot.pbubbleplot(title, df, scaling, oca, sag, textsize)
+				caches.bubble_cache.set(key, rendered)
+			context.update(rendered)
+		else:
+			context['error'] = gv.request_screen_authorization_error
+	return render(request, "uniqueref/bubbleplot.html", context)
+
+
+def export_datapoints(request):
+	# Streams the datapoints of one or more screens (all authorized screens of the type if none are given) as a file
+	authorized = get_authorized_screens(request)
+	datatype = request.GET.get('type', 'ips')			# ips or pss
+	fmt = request.GET.get('format', 'csv')				# csv, tsv or parquet
+	screenids = cf.set_screenids(request.GET.getlist('screens', ''))
+	if datatype not in export.export_models or fmt not in export.export_formats:
+		return HttpResponse(gv.formerror, status=400)
+	if fmt not in export.available_formats():
+		return HttpResponse(gv.export_parquet_error, status=400)
+	if not screenids:
+		screenids = authorized.of_type(export.export_screentypes[datatype])
+	if not set(screenids).issubset(set(authorized)):
+		return HttpResponse(gv.request_screen_authorization_error, status=403)
+	content_type, extension = export.export_formats[fmt]
+	response = StreamingHttpResponse(export.iter_export(datatype, screenids, fmt), content_type=content_type)
+	response['Content-Disposition'] = 'attachment; filename="phenosaurus_%s.%s"' % (datatype, extension)
+	return response
+
+
+def uniquefinder(request):
+	# Find the hits of one screen that are not hits in a set of other screens
+	authorized = get_authorized_screens(request)
+	authorized_screens = list(authorized)
+	filter = forms.UniqueFinderForm(authorized=authorized)
+
+	screenid = request.GET.get('screen', '')					# The screen to find unique hits in
+	screenids = request.GET.getlist('screens', '')				# The screens to compare against
+	givenpvalue = request.GET.get('pvalue', '')
+	givenmldiff = request.GET.get('mldiff', '')				# Minimal logmi difference for an arrow
+	giventextsize = request.GET.get('textsize', '')
+	oca = request.GET.get('oca', '')
+
+	context = {'filter': filter, 'year': datetime.now().year}
+	if request.GET:
+		screenids_array = cf.set_screenids(screenids)
+		if screenid.isdigit() and set([int(screenid)] + screenids_array).issubset(set(authorized_screens)):
+			pvcutoff = cf.set_pvalue(givenpvalue)
+			mldiff = cf.set_logmi_difference(givenmldiff)
+			textsize = cf.set_textsize(giventextsize)
+			df, df_arrows = ips_uniquefinder.generate_df_uniquefinder(screenid, screenids_array, pvcutoff, mldiff, authorized_screens)
+			if df.empty:
+				context['error'] = gv.uniquefinder_no_data
+			else:
+				title = ' '.join(['Unique hits of', cf.title_single_screen_plot(screenid, authorized_screens), 'compared to',
+								  str(len(screenids_array)), 'screen(s)'])
+				context['script'], context['div'] = ips_uniquefinder.pipsuniquefinder(title, df, df_arrows, oca, textsize)
+				context['table'] = ips_uniquefinder.generate_uniquefinder_table(df)
+		else:
+			context['error'] = gv.request_screen_authorization_error
+	return render(request, "uniqueref/uniquefinder.html", context)
+
+
+def region_query(request, authorized):
+	# Validates the region and screens of a region request, returns (chromosome, start, end, screenids, pvcutoff) or the error
+	authorized_screens = list(authorized)
+	try:
+		chromosome, start, end = intervals.parse_region(request.GET.get('region', ''))
+	except ValueError:
+		return None, gv.region_error
+	screenids = cf.set_screenids(request.GET.getlist('screens', '')) or authorized.of_type('IP')
+	if not set(screenids).issubset(set(authorized_screens)):
+		return None, gv.request_screen_authorization_error
+	return (chromosome, start, end, screenids, cf.set_pvalue(request.GET.get('pvalue', ''))), None
+
+def region(request):
+	# The phenotypes of all genes in a genomic region across a set of screens (all IP screens by default)
+	authorized = get_authorized_screens(request)
+	authorized_screens = list(authorized)
+	filter = forms.RegionForm(authorized=authorized)
+	context = {'filter': filter, 'year': datetime.now().year}
+	if request.GET:
+		query, context['error'] = region_query(request, authorized)
+		if query is not None:
+			chromosome, start, end, screenids, pvcutoff = query
+			df_genes, df = cf.df_region(chromosome, start, end, screenids, pvcutoff, authorized_screens)
+			if df_genes.empty:
+				context['error'] = gv.region_no_genes
+			else:
+				title = 'chr%s:%s-%s, %d gene(s) in %d screen(s)' % (chromosome, '{:,}'.format(start), '{:,}'.format(end), len(df_genes.index), len(screenids))
+				textsize = cf.set_textsize(request.GET.get('textsize', ''))
+				context['script'], context['div'] = plots.region_plot(title, df_genes, df, textsize)
+	return render(request, 'uniqueref/region.html', context)
+
+def region_json(request):
+	# The same as JSON: the genes in the region and their datapoints, column by column
+	authorized = get_authorized_screens(request)
+	query, error = region_query(request, authorized)
+	if query is None:
+		return JsonResponse({'error': error}, status=400 if error == gv.region_error else 403)
+	chromosome, start, end, screenids, pvcutoff = query
+	df_genes, df = cf.df_region(chromosome, start, end, screenids, pvcutoff, list(authorized))
+	return JsonResponse({
+		'chromosome': chromosome,
+		'start': start,
+		'end': end,
+		'genes': dict((name, df_genes[name].tolist()) for name in ('relgene', 'start', 'end', 'orientation')),
+		'datapoints': dict((name, df[name].tolist()) for name in ('relgene', 'relscreen', 'logmi', 'fcpv')),
+	})
+
+
+def correlations(request):
+	# The heatmap of the correlations of a set of IP screens (all by default) and the screens that resemble one screen
+	authorized = get_authorized_screens(request)
+	authorized_screens = list(authorized)
+	filter = forms.CorrelationsForm(authorized=authorized)
+	screenid = request.GET.get('screen', '')
+	screenids = cf.set_screenids(request.GET.getlist('screens', '')) or authorized.of_type('IP')
+	context = {'filter': filter, 'year': datetime.now().year}
+	if request.GET:
+		if set(screenids).issubset(set(authorized_screens)) and (not screenid or (screenid.isdigit() and int(screenid) in authorized_screens)):
+			df = cf.df_correlations(screenids, authorized_screens)
+			if df is None:
+				context['error'] = gv.correlations_missing
+			else:
+				textsize = cf.set_textsize(request.GET.get('textsize', ''))
+				title = 'Correlation of log2(MI) between %d screens' % len(pd.unique(df['screen1']))
+				context['script'], context['div'] = plots.correlation_heatmap(title, df, textsize)
+				if screenid:
+					context['similar'] = cf.generate_similar_screens_table(screenid, authorized.of_type('IP'), authorized_screens)
+					context['similar_title'] = cf.title_single_screen_plot(screenid, authorized_screens)
+		else:
+			context['error'] = gv.request_screen_authorization_error
+	return render(request, 'uniqueref/correlations.html', context)
+
+
+@conditional.conditional_page(conditional.genefinder_keys)
 def opengenefinder(request):
 	# Call the search- and customization form
 	# Check user groups to see which screen are allowed to be seen by the user
-	authorized_screens = list(get_authorized_screens(request)) # Check user groups to see which screen are allowed to be seen
-	strigefied_authorized_screens=','.join(str(i) for i in authorized_screens)	# Convert list if screens that user is allowed to see to string
-	filter = forms.OpenGeneFinderForm(input=strigefied_authorized_screens) # First load the filter from .forms
+	authorized = get_authorized_screens(request)	# Check user groups to see which screen are allowed to be seen
+	authorized_screens = list(authorized)
+	filter = forms.OpenGeneFinderForm(authorized=authorized) # First load the filter from .forms
 	# Pull the data from the URL upon submission of the form
 	screenids = request.GET.getlist('screens', '') 		# The screens for which the MI-values needs to be plotted
 	genenamesstring = request.GET.get('genes', '') 		# The given list of genes, presented as a string
 	givenpvalue = request.GET.get('pvalue', '') 		# The p-value cutoff for coloring
 	description = request.GET.get('description', '')	# Get the description of the results boolean switch
 	hidelegend = request.GET.get('hidelegend', '')	# Whether a table should be drawn with raw values
+	neighbours = request.GET.get('neighbours', '')	# Whether the genes with the most similar profile should be listed
 
 	context = {'filter':filter, 'year': datetime.now().year, 'title': 'Study the effect of genes across multiple phenotypes'}
 	if request.GET:
 		if not screenids:
-			screenids=authorized_screens
+			screenids=authorized.of_type('IP')
 
 		# Then check if screens requested by the user are actually screens that he/she is allowed to see.
 		# This may seem a bit over the top but a user may have manually changed the URL and has entered a screenid in it
@@ -225,6 +472,34 @@ def opengenefinder(request):
 					context['error'] = "".join([context['error'], error])
 				if not description: # If decription is not requested, do not parse it
 					context['text'] = []
+				if neighbours:
+					context['neighbours'] = []
+					for gene in genes_array:
+						df_neighbours = cf.df_gene_neighbours(gene, screenids_array, authorized_screens)
+						if df_neighbours is None:
+							context['error'] = "".join([context['error'], gv.neighbours_missing])
+							break
+						context['neighbours'].append((gene, cf.generate_neighbours_table(gene, df_neighbours, authorized_screens)))
 		else:
 			context['error'] = gv.request_screen_authorization_error
-	return render(request, 'uniqueref/opengenefinder.html', context)
\ No newline at end of file
+	return render(request, 'uniqueref/opengenefinder.html', context)
+
+def gene_neighbours_json(request):
+	# The genes with the most similar profile to one gene across a set of screens (all IP screens by default), column by column
+	authorized = get_authorized_screens(request)
+	authorized_screens = list(authorized)
+	gene = request.GET.get('gene', '')
+	screenids = cf.set_screenids(request.GET.getlist('screens', '')) or authorized.of_type('IP')
+	if not set(screenids).issubset(set(authorized_screens)):
+		return JsonResponse({'error': gv.request_screen_authorization_error}, status=403)
+	if gene not in geneindex.get_gene_index():
+		return JsonResponse({'error': gv.neighbours_unknown_gene}, status=400)
+	k = request.GET.get('k', '')
+	k = min(int(k), gv.neighbour_max_k) if k.isdigit() and int(k) > 0 else gv.neighbour_top_k
+	df = cf.df_gene_neighbours(gene, screenids, authorized_screens, k)
+	if df is None:
+		return JsonResponse({'error': gv.neighbours_missing}, status=503)
+	return JsonResponse({
+		'gene': gene,
+		'neighbours': dict((name, df[name].tolist()) for name in ('relgene', 'r', 'shared')),
+	})